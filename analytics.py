@@ -0,0 +1,374 @@
+"""
+跨对局统计分析
+
+读取 logs/ 下的对局归档（game_*.wga.*，见 archive.py），汇总出模型排行榜：
+- 按模型 / 角色 / 模型+角色统计胜率（Wilson 95% 置信区间）与平均积分（95% 置信区间）
+- 模型 Elo 等级分：好人阵营与狼人阵营按平均分对抗，同一局内零和；置信区间由按局自助重采样得到
+
+归档的解压与解析在进程池中并行完成，每个归档只保留一条精简摘要；
+摘要、已读取文件和 Elo 保存在状态文件 logs/analytics_state.json 中，
+再次运行时只读取新增或被改写的归档，统计在摘要上用 NumPy 向量化计算。
+
+用法：
+    python analytics.py [归档文件或目录...] [--by model|role|model_role] [--workers N] [--rebuild]
+"""
+from typing import Dict, Any, List, Optional, Set
+from multiprocessing import Pool
+import glob
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from archive import load_archive
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+DEFAULT_STATE_PATH = 'logs/analytics_state.json'
+ARCHIVE_PATTERNS = ('game_*.wga.zst', 'game_*.wga.gz')
+
+WOLF_ROLE = '狼人'
+WOLF_WIN = '狼人胜利'
+GOOD_WIN = '村民胜利'
+
+ELO_BASE = 1500.0
+ELO_K = 32.0
+Z_95 = 1.959964
+
+
+def summarize_archive(path: str) -> Optional[Dict[str, Any]]:
+    """
+    读取一个归档并提取统计所需的最少信息（在工作进程中运行）
+
+    返回 {game, winner, seats: [[座位, 角色, 模型, 是否获胜, 总分], ...]}，
+    未分胜负或无法读取的归档返回 None
+    """
+    try:
+        archive = load_archive(path)
+    except Exception as e:
+        logger.warning(f"读取归档失败 {path}: {e}")
+        return None
+
+    meta = archive.get("meta", {})
+    winner = meta.get("winner")
+    if winner not in (WOLF_WIN, GOOD_WIN):
+        return None
+
+    strings = archive["strings"]
+    players = archive["players"]
+    player_scores = (meta.get("scores") or {}).get("player_scores") or {}
+    seats = []
+    for index, role_ref, model_ref in zip(players["index"], players["role"], players["model"]):
+        role = strings[role_ref]
+        detail = player_scores.get(str(index))
+        if detail:
+            is_winner = bool(detail.get("is_winner"))
+            score = detail.get("total_score")
+        else:
+            is_winner = (role == WOLF_ROLE) == (winner == WOLF_WIN)
+            score = None
+        seats.append([index, role, strings[model_ref], is_winner, score])
+    return {"game": meta.get("game"), "winner": winner, "seats": seats}
+
+
+def find_archives(paths: List[str]) -> List[str]:
+    """展开目录为其中的归档文件"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ARCHIVE_PATTERNS:
+                found.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            found.append(path)
+    return sorted(set(found))
+
+
+def wilson_interval(wins: np.ndarray, n: np.ndarray, z: float = Z_95):
+    """胜率的 Wilson 置信区间（向量化）"""
+    n = n.astype(float)
+    safe_n = np.where(n > 0, n, 1.0)
+    p = wins / safe_n
+    denom = 1 + z * z / safe_n
+    center = (p + z * z / (2 * safe_n)) / denom
+    half = z * np.sqrt(p * (1 - p) / safe_n + z * z / (4 * safe_n * safe_n)) / denom
+    low = np.where(n > 0, center - half, 0.0)
+    high = np.where(n > 0, center + half, 1.0)
+    return low, high
+
+
+class GameTable:
+    """把对局摘要展开为按座位的列数组，便于 NumPy 分组聚合"""
+
+    def __init__(self, games: List[Dict[str, Any]]):
+        self.games = games
+        self.models: List[str] = sorted({seat[2] for g in games for seat in g["seats"]})
+        self.roles: List[str] = sorted({seat[1] for g in games for seat in g["seats"]})
+        model_idx = {m: i for i, m in enumerate(self.models)}
+        role_idx = {r: i for i, r in enumerate(self.roles)}
+
+        rows = [(gi, model_idx[seat[2]], role_idx[seat[1]], seat[1] == WOLF_ROLE, seat[3],
+                 np.nan if seat[4] is None else seat[4])
+                for gi, g in enumerate(games) for seat in g["seats"]]
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.game = np.array(columns[0], dtype=np.int64)
+        self.model = np.array(columns[1], dtype=np.int64)
+        self.role = np.array(columns[2], dtype=np.int64)
+        self.is_wolf = np.array(columns[3], dtype=bool)
+        self.win = np.array(columns[4], dtype=float)
+        self.score = np.array(columns[5], dtype=float)
+
+    def group_keys(self, by: str):
+        """返回 (每行的分组下标, 分组名列表)"""
+        if by == "model":
+            return self.model, self.models
+        if by == "role":
+            return self.role, self.roles
+        if by == "model_role":
+            key = self.model * len(self.roles) + self.role
+            names = [f"{m}/{r}" for m in self.models for r in self.roles]
+            return key, names
+        raise ValueError(f"不支持的分组方式: {by}")
+
+    def aggregate(self, by: str = "model") -> List[Dict[str, Any]]:
+        keys, names = self.group_keys(by)
+        size = len(names)
+        n = np.bincount(keys, minlength=size)
+        wins = np.bincount(keys, weights=self.win, minlength=size)
+        low, high = wilson_interval(wins, n)
+
+        scored = ~np.isnan(self.score)
+        score = np.where(scored, self.score, 0.0)
+        n_scored = np.bincount(keys, weights=scored, minlength=size)
+        score_sum = np.bincount(keys, weights=score, minlength=size)
+        score_sq = np.bincount(keys, weights=score * score, minlength=size)
+        safe = np.where(n_scored > 0, n_scored, 1.0)
+        mean = score_sum / safe
+        var = np.maximum(score_sq / safe - mean * mean, 0.0) * safe / np.maximum(safe - 1, 1.0)
+        half = Z_95 * np.sqrt(var / safe)
+
+        rows = []
+        for i in np.flatnonzero(n):
+            has_score = n_scored[i] > 0
+            rows.append({
+                "name": names[i],
+                "seats": int(n[i]),
+                "wins": int(wins[i]),
+                "win_rate": round(float(wins[i] / n[i]), 4),
+                "win_rate_ci": [round(float(low[i]), 4), round(float(high[i]), 4)],
+                "avg_score": round(float(mean[i]), 2) if has_score else None,
+                "avg_score_ci": [round(float(mean[i] - half[i]), 2), round(float(mean[i] + half[i]), 2)] if has_score else None,
+            })
+        rows.sort(key=lambda r: r["win_rate"], reverse=True)
+        return rows
+
+    def seat_matrix(self):
+        """返回 (模型矩阵, 是否狼人矩阵, 好人是否获胜)，形状为 (局数, 座位数)，座位不足处模型为 -1"""
+        n_games = len(self.games)
+        width = max((len(g["seats"]) for g in self.games), default=0)
+        models = np.full((n_games, width), -1, dtype=np.int64)
+        wolves = np.zeros((n_games, width), dtype=bool)
+        model_idx = {m: i for i, m in enumerate(self.models)}
+        for gi, g in enumerate(self.games):
+            for si, seat in enumerate(g["seats"]):
+                models[gi, si] = model_idx[seat[2]]
+                wolves[gi, si] = seat[1] == WOLF_ROLE
+        good_win = np.array([g["winner"] == GOOD_WIN for g in self.games], dtype=bool)
+        return models, wolves, good_win
+
+
+def elo_update(ratings: np.ndarray, models: np.ndarray, wolves: np.ndarray, good_win: np.ndarray, k: float = ELO_K):
+    """
+    同时对 B 组等级分各进行一局 Elo 更新（原地修改）
+
+    ratings: (B, 模型数)；models / wolves: (B, 座位数)；good_win: (B,)
+    两个阵营以成员平均分对抗，阵营的得失分平均分给其成员，保证每局零和
+    """
+    valid = models >= 0
+    rows = np.arange(ratings.shape[0])[:, None]
+    seat_ratings = np.where(valid, ratings[rows, np.maximum(models, 0)], 0.0)
+    good = valid & ~wolves
+    bad = valid & wolves
+    n_good = np.maximum(good.sum(axis=1), 1)
+    n_bad = np.maximum(bad.sum(axis=1), 1)
+    good_rating = (seat_ratings * good).sum(axis=1) / n_good
+    bad_rating = (seat_ratings * bad).sum(axis=1) / n_bad
+    expected_good = 1.0 / (1.0 + 10 ** ((bad_rating - good_rating) / 400.0))
+    delta = k * (good_win.astype(float) - expected_good)
+    seat_delta = np.where(good, (delta / n_good)[:, None], 0.0) - np.where(bad, (delta / n_bad)[:, None], 0.0)
+    np.add.at(ratings, (np.broadcast_to(rows, models.shape)[valid], models[valid]), seat_delta[valid])
+
+
+def elo_bootstrap(table: GameTable, samples: int = 200, seed: int = 0):
+    """按局有放回重采样并重放 Elo，得到各模型等级分的 95% 置信区间；所有样本同时推进"""
+    models, wolves, good_win = table.seat_matrix()
+    n_games = len(table.games)
+    if n_games == 0:
+        return np.zeros(0), np.zeros(0)
+    rng = np.random.default_rng(seed)
+    order = rng.integers(0, n_games, size=(samples, n_games))
+    ratings = np.full((samples, len(table.models)), ELO_BASE)
+    for step in range(n_games):
+        picked = order[:, step]
+        elo_update(ratings, models[picked], wolves[picked], good_win[picked])
+    return np.percentile(ratings, 2.5, axis=0), np.percentile(ratings, 97.5, axis=0)
+
+
+class AnalyticsStore:
+    """增量维护的跨对局统计状态"""
+
+    def __init__(self, state_path: str = DEFAULT_STATE_PATH):
+        self.state_path = state_path
+        self.files: Dict[str, List[float]] = {}       # 归档路径 -> [mtime, size]
+        self.games: Dict[str, Dict[str, Any]] = {}    # 对局ID -> 摘要
+        self.elo: Dict[str, float] = {}               # 模型 -> 等级分（按归档读取顺序累计）
+        self.elo_games: Set[str] = set()              # 已计入 Elo 的对局（状态文件中为排序后的列表）
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取统计状态失败，将重新统计: {e}")
+            return
+        if state.get("version") != STATE_VERSION:
+            return
+        self.files = state.get("files", {})
+        self.games = state.get("games", {})
+        self.elo = state.get("elo", {})
+        self.elo_games = set(state.get("elo_games", []))
+
+    def save(self):
+        state = {
+            "version": STATE_VERSION,
+            "files": self.files,
+            "games": self.games,
+            "elo": self.elo,
+            "elo_games": sorted(self.elo_games),
+        }
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def pending(self, paths: List[str]) -> List[str]:
+        """筛出新增或自上次读取后被改写的归档（例如设置MVP后重写的归档）"""
+        changed = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self.files.get(path) != [stat.st_mtime, stat.st_size]:
+                changed.append(path)
+        return changed
+
+    def ingest(self, paths: List[str], workers: Optional[int] = None) -> int:
+        """并行读取新归档并更新状态，返回新读取的归档数"""
+        todo = self.pending(find_archives(paths))
+        if not todo:
+            return 0
+        if len(todo) == 1 or workers == 1:
+            summaries = [summarize_archive(p) for p in todo]
+        else:
+            with Pool(processes=workers) as pool:
+                summaries = pool.map(summarize_archive, todo, chunksize=max(1, len(todo) // 32))
+
+        new_games = []
+        for path, summary in zip(todo, summaries):
+            stat = os.stat(path)
+            self.files[path] = [stat.st_mtime, stat.st_size]
+            if summary is None:
+                continue
+            self.games[summary["game"]] = summary
+            if summary["game"] not in self.elo_games:
+                new_games.append(summary)
+
+        # Elo 只对新对局按时间顺序累计；重写的归档只更新积分，胜负不变
+        new_games.sort(key=lambda g: str(g["game"]))
+        self._apply_elo(new_games)
+        self.save()
+        return len(todo)
+
+    def _apply_elo(self, games: List[Dict[str, Any]]):
+        if not games:
+            return
+        table = GameTable(games)
+        ratings = np.array([[self.elo.get(m, ELO_BASE) for m in table.models]])
+        models, wolves, good_win = table.seat_matrix()
+        for gi in range(len(games)):
+            elo_update(ratings, models[gi:gi + 1], wolves[gi:gi + 1], good_win[gi:gi + 1])
+        for i, model in enumerate(table.models):
+            self.elo[model] = float(ratings[0, i])
+        self.elo_games.update(g["game"] for g in games)
+
+    def rebuild(self):
+        """丢弃已有状态，下次 ingest 时全部重新读取"""
+        self.files, self.games, self.elo, self.elo_games = {}, {}, {}, set()
+
+    def leaderboard(self, by: str = "model", bootstrap: int = 200) -> List[Dict[str, Any]]:
+        """排行榜；按模型统计时附带 Elo 及其置信区间"""
+        table = GameTable(sorted(self.games.values(), key=lambda g: str(g["game"])))
+        rows = table.aggregate(by)
+        if by == "model" and table.models:
+            low, high = elo_bootstrap(table, samples=bootstrap) if bootstrap else (None, None)
+            model_idx = {m: i for i, m in enumerate(table.models)}
+            for row in rows:
+                row["elo"] = round(self.elo.get(row["name"], ELO_BASE), 1)
+                if low is not None:
+                    i = model_idx[row["name"]]
+                    row["elo_ci"] = [round(float(low[i]), 1), round(float(high[i]), 1)]
+            rows.sort(key=lambda r: r["elo"], reverse=True)
+        return rows
+
+
+def format_leaderboard(rows: List[Dict[str, Any]]) -> str:
+    lines = []
+    for row in rows:
+        line = (f"{row['name']:<32} 场次 {row['seats']:>4}  胜率 {row['win_rate']:.1%} "
+                f"[{row['win_rate_ci'][0]:.1%}, {row['win_rate_ci'][1]:.1%}]")
+        if row["avg_score"] is not None:
+            line += f"  平均分 {row['avg_score']:.2f} [{row['avg_score_ci'][0]:.2f}, {row['avg_score_ci'][1]:.2f}]"
+        if "elo" in row:
+            line += f"  Elo {row['elo']:.0f}"
+            if "elo_ci" in row:
+                line += f" [{row['elo_ci'][0]:.0f}, {row['elo_ci'][1]:.0f}]"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    by = "model"
+    workers = None
+    rebuild = False
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--by":
+            by = args[i + 1]
+            i += 2
+        elif args[i] == "--workers":
+            workers = int(args[i + 1])
+            i += 2
+        elif args[i] == "--rebuild":
+            rebuild = True
+            i += 1
+        else:
+            paths.append(args[i])
+            i += 1
+
+    store = AnalyticsStore()
+    if rebuild:
+        store.rebuild()
+    count = store.ingest(paths or ['logs'], workers=workers)
+    print(f"新读取归档 {count} 个，共 {len(store.games)} 局")
+    print(format_leaderboard(store.leaderboard(by)))
@@ -0,0 +1,252 @@
+"""
+对局归档
+
+每局游戏结束后写出一个紧凑的归档文件 logs/game_{start_time}.wga.zst（未安装 zstandard 时为 .wga.gz），
+内容按列存储，取代 result_*.txt / llm_*.txt / replay_*.json 中大量重复的文本：
+- strings: 字符串表，所有文本只保存一次，其余位置只存下标
+  * 提示词按字段拆开存储，游戏规则、策略等模板字段在整局中只出现一次
+  * 历史事件按回合存储，每次调用的"事件"字段只引用各回合，相同的历史前缀不会重复保存
+- players / events / llm_calls / replay: 列式表（每列一个数组）
+- meta: 对局信息、胜负与积分
+
+批量导出为 Parquet 以便跨对局分析（需安装 pyarrow）：
+    python archive.py export logs/game_*.wga.* --out analytics/
+"""
+from typing import Dict, Any, List, Optional
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+from history import EVENT_TYPES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_VERSION = 1
+
+
+class StringTable:
+    """字符串驻留表：相同内容只保存一次"""
+
+    def __init__(self, strings: Optional[List[str]] = None):
+        self.strings = list(strings or [])
+        self._index = {s: i for i, s in enumerate(self.strings)}
+
+    def ref(self, value: str) -> int:
+        idx = self._index.get(value)
+        if idx is None:
+            idx = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+    def json_ref(self, value) -> int:
+        """以 JSON 文本驻留任意值"""
+        return self.ref(json.dumps(value, ensure_ascii=False))
+
+    def get(self, idx: int) -> str:
+        return self.strings[idx]
+
+
+def _columns(*names) -> Dict[str, list]:
+    return {name: [] for name in names}
+
+
+class GameArchive:
+    """收集一局游戏的结构化记录，结束时写出归档文件"""
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self._lock = threading.Lock()
+        self.strings = StringTable()
+        self.players = _columns("index", "role", "model")
+        self.llm_calls = _columns("time", "player", "prompt_type", "model", "prompt", "response", "reasoning")
+
+    def set_players(self, players):
+        with self._lock:
+            self.players = _columns("index", "role", "model")
+            for player in players:
+                self.players["index"].append(player.player_index)
+                self.players["role"].append(self.strings.ref(player.role_type))
+                self.players["model"].append(self.strings.ref(player.model.model_name))
+
+    def add_llm_call(self, player_index: int, prompt_type: str, model_name: str,
+                     prompt_dict: Dict[str, Any], response, reasoning=None):
+        """记录一次LLM调用，prompt_dict 为序列化前的提示词字典"""
+        with self._lock:
+            self.llm_calls["time"].append(round(time.time(), 3))
+            self.llm_calls["player"].append(player_index)
+            self.llm_calls["prompt_type"].append(self.strings.ref(prompt_type))
+            self.llm_calls["model"].append(self.strings.ref(model_name))
+            self.llm_calls["prompt"].append(self._prompt_refs(prompt_dict))
+            self.llm_calls["response"].append(self.strings.json_ref(response))
+            self.llm_calls["reasoning"].append(self.strings.ref(str(reasoning)) if reasoning else -1)
+
+    def _prompt_refs(self, prompt_dict: Dict[str, Any]) -> List[list]:
+        """
+        每个字段存为 [字段名, 值, 是否JSON编码]；
+        "事件"字段存为 [字段名, [各回合的JSON]]，各次调用共享相同的历史前缀
+        """
+        refs = []
+        for key, value in prompt_dict.items():
+            if key == '事件' and isinstance(value, list):
+                refs.append([self.strings.ref(key), [self.strings.json_ref(r) for r in value]])
+            elif isinstance(value, str):
+                refs.append([self.strings.ref(key), self.strings.ref(value), 0])
+            else:
+                refs.append([self.strings.ref(key), self.strings.json_ref(value), 1])
+        return refs
+
+    def _event_columns(self, history) -> Dict[str, list]:
+        events = _columns("round", "is_daytime", "type", "player", "target", "public", "text")
+        if history is None:
+            return events
+        for round_obj in history.rounds:
+            # 同一回合内先白天后夜晚（第0回合只有首夜）
+            for is_daytime, round_events in ((1, round_obj.day_events), (0, round_obj.night_events)):
+                for event in round_events:
+                    events["round"].append(round_obj.day_count)
+                    events["is_daytime"].append(is_daytime)
+                    events["type"].append(event.CODE)
+                    events["player"].append(event.player_idx)
+                    events["target"].append(getattr(event, 'target_idx', -1))
+                    events["public"].append(1 if event.is_public else 0)
+                    events["text"].append(self.strings.ref(event.desc()))
+        return events
+
+    def build(self, history, winner: Optional[str] = None, scores: Optional[Dict[str, Any]] = None,
+              replay: Optional[List[Any]] = None, metrics: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with self._lock:
+            data = {
+                "version": ARCHIVE_VERSION,
+                "meta": {
+                    "game": self.game_id,
+                    "winner": winner,
+                    "scores": scores,
+                    "llm_metrics": metrics
+                },
+                "players": self.players,
+                "events": self._event_columns(history),
+                "llm_calls": self.llm_calls,
+                "replay": [self.strings.json_ref(entry) for entry in (replay or [])],
+            }
+            data["strings"] = self.strings.strings
+            return data
+
+    def save(self, directory: str, history, **kwargs) -> str:
+        data = self.build(history, **kwargs)
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if zstandard is not None:
+            path = os.path.join(directory, f"game_{self.game_id}.wga.zst")
+            payload = zstandard.ZstdCompressor(level=10).compress(payload)
+        else:
+            path = os.path.join(directory, f"game_{self.game_id}.wga.gz")
+            payload = gzip.compress(payload, compresslevel=9)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_archive(path: str) -> Dict[str, Any]:
+    """读取归档文件"""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("读取 .zst 归档需要安装 zstandard")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        payload = gzip.decompress(payload)
+    return json.loads(payload.decode('utf-8'))
+
+
+def expand_prompt(archive: Dict[str, Any], call_idx: int) -> Dict[str, Any]:
+    """还原第 call_idx 次LLM调用的完整提示词字典"""
+    strings = archive["strings"]
+    prompt = {}
+    for entry in archive["llm_calls"]["prompt"][call_idx]:
+        key = strings[entry[0]]
+        if isinstance(entry[1], list):
+            prompt[key] = [json.loads(strings[r]) for r in entry[1]]
+        elif entry[2]:
+            prompt[key] = json.loads(strings[entry[1]])
+        else:
+            prompt[key] = strings[entry[1]]
+    return prompt
+
+
+def expand_replay(archive: Dict[str, Any]) -> List[Any]:
+    """还原回放记录，格式与 replay_*.json 相同"""
+    strings = archive["strings"]
+    return [json.loads(strings[r]) for r in archive.get("replay", [])]
+
+
+def _table_rows(archive: Dict[str, Any], table: str, string_columns=()) -> Dict[str, list]:
+    strings = archive["strings"]
+    columns = archive[table]
+    n = len(next(iter(columns.values()), []))
+    rows = {"game": [archive["meta"]["game"]] * n}
+    for name, values in columns.items():
+        if name in string_columns:
+            rows[name] = [strings[v] if v >= 0 else None for v in values]
+        elif name == "type":
+            rows[name] = [EVENT_TYPES[v] if 0 <= v < len(EVENT_TYPES) else None for v in values]
+        elif name == "prompt":
+            rows["prompt_chars"] = [sum(len(strings[entry[0]]) + (sum(len(strings[r]) for r in entry[1])
+                                                                  if isinstance(entry[1], list) else len(strings[entry[1]]))
+                                        for entry in refs) for refs in values]
+        else:
+            rows[name] = values
+    return rows
+
+
+def export_parquet(paths: List[str], out_dir: str) -> Dict[str, str]:
+    """把多个归档合并导出为 players / events / llm_calls 三张 Parquet 表"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("导出 Parquet 需要安装 pyarrow")
+
+    tables = {"players": {}, "events": {}, "llm_calls": {}}
+    string_columns = {
+        "players": ("role", "model"),
+        "events": ("text",),
+        "llm_calls": ("prompt_type", "model", "response", "reasoning"),
+    }
+    for path in paths:
+        archive = load_archive(path)
+        for table, merged in tables.items():
+            rows = _table_rows(archive, table, string_columns[table])
+            if table == "players":
+                rows["winner"] = [archive["meta"].get("winner")] * len(rows["game"])
+            for name, values in rows.items():
+                merged.setdefault(name, []).extend(values)
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for table, columns in tables.items():
+        out_path = os.path.join(out_dir, f"{table}.parquet")
+        pq.write_table(pa.table(columns), out_path)
+        written[table] = out_path
+    return written
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "export":
+        args = sys.argv[2:]
+        out_dir = "analytics"
+        if "--out" in args:
+            i = args.index("--out")
+            out_dir = args[i + 1]
+            args = args[:i] + args[i + 2:]
+        for table, path in export_parquet(args, out_dir).items():
+            print(f"{table}: {path}")
+    else:
+        print("用法: python archive.py export <归档文件...> [--out 目录]")
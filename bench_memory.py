@@ -0,0 +1,81 @@
+"""
+对局历史内存基准
+
+批量模拟后做跨对局分析时，会在内存中同时保留大量对局的历史（History）。
+本脚本按固定随机种子合成若干局典型的历史（每晚查验、杀人、女巫用药，每天全员发言、投票、处决与遗言），
+用 tracemalloc 统计全部保留时平均每局占用的内存。
+
+用法：
+    python bench_memory.py [--games N] [--days N] [--speech-chars N]
+"""
+from typing import List
+import random
+import sys
+import tracemalloc
+
+from history import (History, SpeakEvent, VoteEvent, ExecuteEvent, LastWordEvent, KillEvent,
+                     DivineEvent, WitchActionEvent, HunterRevengeEvent, AttackEvent)
+
+N_PLAYERS = 9
+
+
+def synthesize(rng: random.Random, days: int, speech_chars: int) -> History:
+    """合成一局历史（不考虑胜负，只保证事件的种类与数量接近真实对局）"""
+    history = History()
+    for day in range(days):
+        # 夜晚
+        target = rng.randint(1, N_PLAYERS)
+        history.add_event(DivineEvent(4, rng.randint(1, N_PLAYERS), rng.choice(["好人", "狼人"])))
+        history.add_event(KillEvent(target))
+        if day == 0:
+            history.add_event(WitchActionEvent(5, "cure", target))
+        history.toggle_day_night()
+        # 白天
+        for idx in range(1, N_PLAYERS + 1):
+            text = "".join(rng.choice("我认为号玩家是狼人好人预言家女巫猎人村民，。") for _ in range(speech_chars))
+            history.add_event(SpeakEvent(idx, text))
+        vote_result = []
+        for idx in range(1, N_PLAYERS + 1):
+            vote_id = rng.choice([-1] + list(range(1, N_PLAYERS + 1)))
+            history.add_event(VoteEvent(idx, vote_id))
+            vote_result.append({"player_idx": idx, "vote_id": vote_id})
+        executed = rng.randint(1, N_PLAYERS)
+        history.add_event(ExecuteEvent(executed, vote_result))
+        history.add_event(LastWordEvent(executed, "遗言" * (speech_chars // 4)))
+        if day == 1:
+            history.add_event(HunterRevengeEvent(6, 3))
+            history.add_event(AttackEvent(3))
+        history.toggle_day_night()
+    return history
+
+
+def measure(games: int, days: int, speech_chars: int) -> float:
+    """返回平均每局占用的字节数"""
+    rng = random.Random(0)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    histories: List[History] = [synthesize(rng, days, speech_chars) for _ in range(games)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    assert len(histories) == games
+    return total / games
+
+
+def main(argv: List[str]) -> int:
+    options = {"--games": 1000, "--days": 5, "--speech-chars": 200}
+    for i in range(0, len(argv) - 1, 2):
+        if argv[i] in options:
+            options[argv[i]] = int(argv[i + 1])
+    games, days, speech_chars = options["--games"], options["--days"], options["--speech-chars"]
+
+    per_game = measure(games, days, speech_chars)
+    print(f"{games} 局 × {days} 天，发言 {speech_chars} 字：平均每局 {per_game / 1024:.1f} KiB")
+    # 不计发言文本，只看事件结构本身的开销
+    structure = measure(games, days, 0)
+    print(f"其中事件结构（发言为空）：平均每局 {structure / 1024:.1f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
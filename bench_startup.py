@@ -0,0 +1,87 @@
+"""
+启动耗时基准
+
+用 python -X importtime 统计导入服务端模块的耗时，并检查启动时没有导入各模型提供商的SDK
+（这些SDK应在首次构建对应模型时才导入，见 llm.py 的 MODEL_PROVIDERS）。
+
+用法：
+    python bench_startup.py [模块名，默认 web] [--runs N] [--max-ms 毫秒] [--top N]
+
+导入耗时超过 --max-ms 或导入了禁止在启动时加载的SDK时返回非零退出码，可用于CI检查。
+"""
+from typing import Dict, List, Tuple
+import statistics
+import subprocess
+import sys
+
+# 启动时不应导入的模块（按顶层包名匹配）
+LAZY_MODULES = ("openai", "dashscope", "zhipuai", "requests", "volcenginesdkarkruntime")
+
+
+def measure(module: str) -> Tuple[float, Dict[str, int]]:
+    """在新进程中导入一次 module，返回 (总耗时毫秒, {模块名: 累计耗时微秒})"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    total_us = 0
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, raw_name = line.split("|", 2)
+        cumulative = int(cumulative)
+        name = raw_name.strip()
+        modules[name] = cumulative
+        # 顶层导入（没有额外缩进）的累计耗时之和即为总耗时
+        if raw_name.startswith(" ") and not raw_name.startswith("  "):
+            total_us += cumulative
+    return total_us / 1000, modules
+
+
+def main(argv: List[str]) -> int:
+    module = "web"
+    runs, max_ms, top = 3, None, 15
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--runs":
+            runs = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--max-ms":
+            max_ms = float(argv[i + 1])
+            i += 2
+        elif argv[i] == "--top":
+            top = int(argv[i + 1])
+            i += 2
+        else:
+            module = argv[i]
+            i += 1
+
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        total_ms, modules = measure(module)
+        totals.append(total_ms)
+    median_ms = statistics.median(totals)
+
+    print(f"导入 {module}: 中位数 {median_ms:.1f} ms（{runs} 次: {', '.join(f'{t:.1f}' for t in totals)}）")
+    print(f"累计耗时最多的 {top} 个模块：")
+    for name, us in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({name.split(".")[0] for name in modules} & set(LAZY_MODULES))
+    if eager:
+        print(f"启动时导入了应延迟加载的SDK: {', '.join(eager)}")
+        failed = True
+    if max_ms is not None and median_ms > max_ms:
+        print(f"导入耗时 {median_ms:.1f} ms 超过上限 {max_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
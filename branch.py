@@ -0,0 +1,132 @@
+"""
+反事实分支
+
+从一局的检查点日志（见 journal.py）中某个行动开始之前的局面分出多个分支，每个分支指定若干决策
+（如"第2夜女巫毒杀3号"，见 WerewolfGame.force），在进程池中各自跑完，比较胜负与贡献分。
+各分支共用一个 LLM 响应缓存（见 llm_cache.py）：提示词完全相同的请求只调用一次模型，
+分歧之前（以及分歧尚未影响到的玩家视角）的共同部分不重复付费，分支的开销基本只有分歧之后的部分。
+同一进程内探索分支时可直接使用 WerewolfGame.fork()。
+
+用法：
+    python branch.py <检查点日志> --steps
+    python branch.py <检查点日志> --at <行动序号> --branches <分支定义.json> [--workers N] [--max-days N]
+
+分支定义为列表，每项为 {"name": 分支名, "forced": [{"player_idx", "prompt_type", "response"}]}，例如
+    [{"name": "poison3", "forced": [{"player_idx": 5, "prompt_type": "cure_or_poison",
+                                     "response": {"thinking": "", "cure": 0, "poison": 3}}]}]
+"""
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import os
+import sys
+import time
+
+from journal import load_journal, records_before
+from log import setup_logging, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DAYS = 20
+
+
+def _init_worker():
+    setup_logging()
+
+
+def play_branch(task: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中由分支起点的记录恢复对局，应用指定的决策后跑完"""
+    from game import WerewolfGame
+    from llm_cache import SharedLlmCache
+    from runner import HeadlessRunner
+
+    game_id = task["game_id"]
+    started = time.time()
+    cache = SharedLlmCache(task["cache"])
+    try:
+        game = WerewolfGame(game_id=game_id)
+        game.auto_mvp = False
+        game.llm_cache = cache
+        game.restore_records([{"t": "start", "game": game_id}] + task["records"][1:])
+        for forced in task["forced"]:
+            game.force(**forced)
+        winner = HeadlessRunner(game, max_days=task["max_days"]).play(resume=True)
+        if game.scoring is not None:
+            game.scoring.wait()
+        result = {
+            "winner": winner,
+            "day": game.current_day,
+            "contribution_scores": dict(game.score_tracker.contribution_scores),
+            "archive": game.save_archive(),
+        }
+        game.close_logs()
+    except Exception as e:
+        logger.exception(f"分支 {game_id} 出错")
+        result = {"error": str(e)}
+    finally:
+        shutdown_logging()
+    result["name"] = task["name"]
+    result["cache_hits"] = cache.hits
+    result["cache_misses"] = cache.misses
+    result["duration"] = round(time.time() - started, 1)
+    return result
+
+
+def list_steps(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """检查点日志中已开始的行动，可作为分支起点"""
+    return [{key: record.get(key) for key in ("seq", "day", "action", "player_idx")}
+            for record in records if record["t"] == "begin"]
+
+
+def explore(journal: str, at: int, branches: List[Dict[str, Any]], workers: Optional[int] = None,
+            max_days: int = DEFAULT_MAX_DAYS, cache_path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """从 journal 中行动 at 开始之前的局面并行跑完各分支，返回 {分支名: 结果}"""
+    records = records_before(load_journal(journal), at)
+    game_id = records[0]["game"]
+    cache_path = cache_path or os.path.join('logs', f"branch_cache_{game_id}.sqlite")
+    tasks = [{"game_id": f"{game_id}_at{at}_{branch['name']}", "name": branch["name"], "records": records,
+              "forced": branch.get("forced", []), "max_days": max_days, "cache": cache_path}
+             for branch in branches]
+    logger.info(f"从对局 {game_id} 的行动 {at} 分出 {len(tasks)} 个分支")
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(play_branch, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            name = result.pop("name")
+            results[name] = result
+            if "error" in result:
+                logger.error(f"分支 {name} 失败：{result['error']}")
+            else:
+                logger.info(f"分支 {name} 结束：{result['winner']}（第{result['day']}天，{result['duration']}秒，"
+                            f"缓存命中 {result['cache_hits']} / 请求模型 {result['cache_misses']}）")
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0].startswith("--"):
+        print("用法: python branch.py <检查点日志> --steps\n"
+              "      python branch.py <检查点日志> --at <行动序号> --branches <分支定义.json> [--workers N] [--max-days N]")
+        sys.exit(1)
+    journal = args[0]
+    if "--steps" in args:
+        for step in list_steps(load_journal(journal)):
+            print(f"{step['seq']:>4}  第{step['day']}天  {step['action']:<13} {step['player_idx'] or ''}")
+        sys.exit(0)
+    options = {"--at": None, "--branches": None, "--workers": None, "--max-days": DEFAULT_MAX_DAYS}
+    for i in range(1, len(args) - 1, 2):
+        if args[i] in options:
+            options[args[i]] = args[i + 1]
+    if options["--at"] is None or options["--branches"] is None:
+        print("需要指定 --at 与 --branches")
+        sys.exit(1)
+    with open(options["--branches"], 'r', encoding='utf-8') as f:
+        branches = json.load(f)
+
+    setup_logging()
+    results = explore(journal, int(options["--at"]), branches,
+                      workers=int(options["--workers"]) if options["--workers"] else None,
+                      max_days=int(options["--max-days"]))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
@@ -0,0 +1,64 @@
+"""
+提示词上下文快照
+
+同一阶段内每位玩家的提示词都包含相同的公共信息（当前天数、公开事件、玩家存活状态），
+狼人还需要队友列表。ContextSnapshot 把这些内容预先渲染一次，按历史版本缓存：
+只有切换昼夜或记录新事件（玩家生死变化都伴随事件）后才会重新生成，
+各角色的 prompt_preprocess / make_extra_data 直接复用，不再逐个玩家重复遍历事件和玩家列表。
+"""
+from typing import Any, Dict, List
+import threading
+
+
+class ContextSnapshot:
+    """某一历史版本下的对局上下文（只读，各玩家共享，不要修改其中的列表）"""
+
+    def __init__(self, game, key):
+        self.key = key
+        # 生成快照时的历史对象：按对象本身比较，不用 id()（对象回收后 id 可能被新的历史复用）
+        self.source = game.history
+        # 公共视角
+        self.current_day = f'当前是第{game.current_day}天'
+        self.history: List[Dict[str, Any]] = game.history.get_history()
+        self.players_state: List[str] = [
+            f"{player.player_index}号玩家: {'存活' if player.is_alive else '死亡'}" for player in game.players
+        ]
+        # 狼人阵营视角
+        self.wolves: List[Dict[str, Any]] = [
+            {"player_index": player.player_index, "is_alive": player.is_alive}
+            for player in game.players if player.role_type == "狼人"
+        ]
+        self._wolf_lines = [
+            (wolf["player_index"], f"{wolf['player_index']}号玩家是狼人, 目前{'存活' if wolf['is_alive'] else '已死亡'}")
+            for wolf in self.wolves
+        ]
+
+    def wolf_teammates(self, player_index: int) -> List[str]:
+        """某只狼人看到的队友信息（不含自己）"""
+        return [line for idx, line in self._wolf_lines if idx != player_index]
+
+
+class ContextCache:
+    """按历史对象与 (历史版本, 天数, 阶段) 缓存最新的上下文快照"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self, game) -> ContextSnapshot:
+        history = game.history
+        # 先取版本再读取内容：生成期间有新事件时，下次调用会因版本变化重新生成
+        key = (history.version, game.current_day, game.current_phase)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.source is history and snapshot.key == key:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.source is not history or snapshot.key != key:
+                self._snapshot = ContextSnapshot(game, key)
+            return self._snapshot
+
+    def invalidate(self):
+        """玩家列表在没有事件的情况下变化（如交换座位）时调用"""
+        with self._lock:
+            self._snapshot = None
@@ -0,0 +1,159 @@
+"""
+进程内事件总线
+
+游戏逻辑运行在 FastAPI 的线程池里，SSE/WebSocket 推送运行在事件循环里。
+EventBus 负责把线程中发布的消息安全地投递给事件循环中的订阅者：
+- publish(topic, message) 可在任意线程调用
+- subscribe(topic) 必须在事件循环中调用，返回可 async for 的订阅对象
+- retain=True 时保留该主题的最新一条消息，新订阅者会先收到它
+
+多进程部署时（见 state_store.py）由 StoreBridge 把本进程发布的消息经状态存储转发给其它 worker，
+连接在任意 worker 上的观战者、发言流与人类玩家输入都能收到，跨进程的延迟约为一个轮询间隔。
+"""
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """一个订阅者的消息队列"""
+
+    def __init__(self, bus, topic: str, loop: asyncio.AbstractEventLoop):
+        self.bus = bus
+        self.topic = topic
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def get(self, timeout: Optional[float] = None):
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._retained: Dict[str, Any] = {}
+        self.bridge: Optional["StoreBridge"] = None
+
+    def subscribe(self, topic: str) -> Subscription:
+        loop = asyncio.get_running_loop()
+        sub = Subscription(self, topic, loop)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(sub)
+            if topic in self._retained:
+                sub.queue.put_nowait(self._retained[topic])
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.topic]
+
+    def publish(self, topic: str, message: Any, retain: bool = False):
+        self.deliver(topic, message, retain)
+        if self.bridge is not None:
+            self.bridge.forward({"topic": topic, "message": message, "retain": retain})
+
+    def deliver(self, topic: str, message: Any, retain: bool = False):
+        """投递给本进程的订阅者"""
+        with self._lock:
+            if retain:
+                self._retained[topic] = message
+            subs = list(self._subscribers.get(topic, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.queue.put_nowait, message)
+            except RuntimeError:
+                # 事件循环已关闭，订阅者随之失效
+                self.unsubscribe(sub)
+
+    def clear_retained(self, topic: str):
+        self.forget(topic)
+        if self.bridge is not None:
+            self.bridge.forward({"topic": topic, "clear": True})
+
+    def forget(self, topic: str):
+        """清除本进程保留的消息"""
+        with self._lock:
+            self._retained.pop(topic, None)
+
+    def has_subscribers(self, topic: str) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(topic))
+
+
+class StoreBridge:
+    """
+    在后台线程中每隔 interval 秒把本进程发布的消息批量写入状态存储，
+    并读取其它 worker 写入的消息投递给本进程的订阅者（跳过本进程自己发布的）
+    """
+
+    def __init__(self, bus: EventBus, store, interval: float = 0.1):
+        self.bus = bus
+        self.store = store
+        self.interval = interval
+        self.origin = uuid.uuid4().hex
+        self._outbox: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "StoreBridge":
+        self.bus.bridge = self
+        self._thread = threading.Thread(target=self._run, daemon=True, name="event-bridge")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.bus.bridge = None
+
+    def forward(self, message: Dict[str, Any]):
+        with self._lock:
+            self._outbox.append(message)
+
+    def _run(self):
+        after = self.store.latest()
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                with self._lock:
+                    outbox, self._outbox = self._outbox, []
+                if outbox:
+                    self.store.post(self.origin, outbox)
+                after, messages = self.store.messages(after)
+                for origin, message in messages:
+                    if origin == self.origin:
+                        continue
+                    if message.get("clear"):
+                        self.bus.forget(message["topic"])
+                    else:
+                        self.bus.deliver(message["topic"], message["message"], message["retain"])
+            except Exception as e:
+                logger.error(f"转发推送消息出错: {e}")
+            if stopping:
+                return
+
+
+# 全局事件总线
+event_bus = EventBus()
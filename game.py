@@ -1,73 +1,512 @@
 from role import *
 from history import *
 
-from score_calculator import ScoreCalculator
-from mvp_selector import MvpSelector
+from scoring import ScoringJob
+from score_calculator import ScoreTracker, ScoreCalculator
+from log import game_log, close_game_log
+from event_bus import event_bus
+from archive import GameArchive
+from metrics import llm_metrics
+from llm import BuildModel, CancelToken, derive_model
+from human_input import human_broker
+from context import ContextCache
+from journal import GameJournal, StoreJournal, journal_key, journal_path, load_journal
+from settings import settings_store, get_settings, parse_settings, ModelSettings, DISPLAY_KEYS, ACTION_TYPES
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+import copy
+import itertools
+import logging
 import random
-import json
 import os
+import threading
+import time
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+
+class PhaseMachine:
+    """
+    对局的行动顺序：夜晚依次为预言家查验、狼人刀人、女巫、胜负判断、天亮；白天依次为各玩家发言、各玩家投票、处决、胜负判断、天黑。
+    前端通过 next_step() 逐个开始行动，plan(n) 给出接下来尚未完成的行动及其依赖是否已全部完成。
+
+    每个行动依赖它之前的全部行动，同一独立组内的行动除外（查验与刀人互不可见，各玩家的投票决策互不可见）。
+    开始一个行动时，它之前的行动都视为已完成；查验、刀人、发言、投票与天亮/天黑在对应接口返回时即完成，
+    因此预取的行动完成后，后续行动也可以继续预取。女巫与处决在死亡结算（resolve_deaths，无人死亡时 deaths 为空）后完成，
+    胜负判断在 check_winner 返回时完成。
+    行动的序号 seq 跨天递增，出局玩家的行动直接跳过
+    """
+    GROUPS = {"divine": "night", "wolf_kill": "night", "vote": "vote"}
+    # 可以提前发出正式请求的行动（由 AI 完成时）
+    PREFETCH = ("divine", "witch", "speak", "vote")
+
+    def __init__(self, game):
+        self.game = game
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.current = -1        # 正在进行的行动序号
+            self.completed = set()   # current 及之后已完成的行动序号
+
+    def steps(self):
+        players = [player.player_index for player in self.game.players]
+        seer = next((p.player_index for p in self.game.players if p.role_type == "预言家"), None)
+        witch = next((p.player_index for p in self.game.players if p.role_type == "女巫"), None)
+        return ([("divine", seer), ("wolf_kill", None), ("witch", witch), ("check_winner", None), ("end_night", None)]
+                + [("speak", idx) for idx in players]
+                + [("vote", idx) for idx in players]
+                + [("execute", None), ("check_winner", None), ("end_day", None)])
+
+    def step(self, seq):
+        steps = self.steps()
+        action, player_idx = steps[seq % len(steps)]
+        return {"seq": seq, "day": seq // len(steps) + 1, "action": action, "player_idx": player_idx}
+
+    def _player(self, step):
+        if step["player_idx"] is None:
+            return None
+        return self.game.players[step["player_idx"] - 1]
+
+    def _skipped(self, step):
+        if step["action"] not in ("divine", "speak", "vote"):
+            return False
+        player = self._player(step)
+        return player is None or not player.is_alive
+
+    def _done(self, seq):
+        return seq < self.current or seq in self.completed or self._skipped(self.step(seq))
+
+    def _ready(self, seq):
+        group = self.GROUPS.get(self.step(seq)["action"])
+        return all(self._done(earlier) for earlier in range(max(self.current, 0), seq)
+                   if group is None or self.GROUPS.get(self.step(earlier)["action"]) != group)
+
+    def _prefetch(self, step):
+        if step["action"] not in self.PREFETCH:
+            return False
+        player = self._player(step)
+        return player is not None and player.is_alive and player.model.model_name != "human"
+
+    def next_step(self):
+        """开始下一个行动并返回它"""
+        with self._lock:
+            seq = self.current + 1
+            while self._skipped(self.step(seq)):
+                seq += 1
+            self.current = seq
+            self.completed = {done for done in self.completed if done >= seq}
+            step = self.step(seq)
+            self.game.checkpoint("begin", **step)
+            return step
+
+    def complete(self, action, player_idx=None):
+        """标记当前或之后第一个匹配的未完成行动为已完成"""
+        with self._lock:
+            start = max(self.current, 0)
+            for seq in range(start, start + len(self.steps())):
+                step = self.step(seq)
+                if (step["action"] == action and seq not in self.completed
+                        and (player_idx is None or step["player_idx"] == player_idx)):
+                    self.completed.add(seq)
+                    self.game.checkpoint("complete", seq=seq)
+                    return
+
+    def complete_current(self, actions):
+        """正在进行的行动属于 actions 时标记为已完成（只在行动内部调用的接口，如死亡结算、胜负判断）"""
+        with self._lock:
+            if self.current < 0 or self.current in self.completed:
+                return
+            if self.step(self.current)["action"] in actions:
+                self.completed.add(self.current)
+                self.game.checkpoint("complete", seq=self.current)
+
+    def plan(self, n):
+        """接下来 n 个未完成的行动：ready 表示依赖已全部完成，prefetch 表示可以提前发出该行动的请求"""
+        if not self.game.players:
+            return []
+        with self._lock:
+            upcoming = []
+            seq = self.current + 1
+            end = seq + 2 * len(self.steps())
+            while len(upcoming) < n and seq < end:
+                step = self.step(seq)
+                if not self._done(seq):
+                    upcoming.append({**step, "ready": self._ready(seq), "prefetch": self._prefetch(step)})
+                seq += 1
+            return upcoming
+
+
 #WerewolfGame负责保存游戏状态，游戏逻辑由前端脚本负责
 class WerewolfGame:
-    def __init__(self):
+    def __init__(self, config=None, game_id=None):
+        """
+        config: 覆盖 config.json 的配置（批量对局时由调度器给出每局的座位、角色与模型）
+        game_id: 固定的对局ID（日志与归档文件名），默认使用开局时间
+        """
+        self.settings_override = parse_settings(config) if config is not None else None
+        self.game_id = game_id
         self.players = []
         self.history = None # 存储游戏的历史记录
         self.current_day = 1
         self.current_phase = "夜晚"
         self.vote_result = []
         self.wolf_want_kill = {}
-        self.start_time = datetime.now().strftime("%Y%m%d%H%M")
+        # 投机执行的女巫决策 {"witch", "target", "version", "future"}（见 wolf_kill）
+        self.witch_speculation = None
+        self.start_time = game_id or datetime.now().strftime("%Y%m%d%H%M")
+        # 推送给观战者的消息序号与上次推送的玩家状态
+        self.push_seq = 0
+        self._pushed_players = {}
+        self.archive = GameArchive(self.start_time)
+        self.context_cache = ContextCache()
+        # 对局结算任务（见 scoring.py）；auto_mvp=False 时结算不调用评审模型，由调用方另行评选
+        self.scoring = None
+        self.auto_mvp = True
+        # 随事件累加的贡献分（见 score_calculator.ScoreTracker），观战时可实时显示
+        self.score_tracker = None
+        # 行动顺序与预取计划（见 PhaseMachine）
+        self.phase = PhaseMachine(self)
+        # 检查点日志（见 journal.py）；resumed 表示对局由 restore 恢复、前端尚未接手
+        self.journal = None
+        self.resumed = False
+        # 反事实分支（见 fork / branch.py）：共享的LLM响应缓存、指定的决策，分支对局不向观战者推送
+        self.llm_cache = None
+        self.forced = []
+        self.publish = True
+        self._fork_ids = itertools.count(1)
+        # 多进程部署时的外部状态存储（见 state_store.py），检查点与积分结算结果写入其中，由各 worker 共享
+        self.store = None
+        # 多进程部署时本进程对该局的锁（见 web.GameLease），只在读写状态时持有
+        self.lease = None
 
         # 创建logs目录（如果不存在）
         if not os.path.exists('logs'):
             os.makedirs('logs')
 
+    def load_settings(self):
+        """当前配置：优先使用构造时传入的配置，否则使用全局配置（config.json）"""
+        if self.settings_override is not None:
+            return self.settings_override
+        return get_settings()
+
     def dump_history(self):
         self.history.dump()
 
+    def result_log(self):
+        """对局结果日志（异步写入 logs/result_*.txt）"""
+        return game_log(f'logs/result_{self.start_time}.txt')
+
+    def llm_log(self):
+        """LLM调用日志（异步写入 logs/llm_*.txt）"""
+        return game_log(f'logs/llm_{self.start_time}.txt')
+
+    def save_archive(self, replay=None):
+        """写出本局的紧凑归档（logs/game_*.wga.*），replay 为回放记录"""
+        try:
+            scores = self.get_game_scores()
+            path = self.archive.save(
+                'logs', self.history,
+                winner=scores.get('winner') if scores else None,
+                scores=scores,
+                replay=replay,
+                metrics=llm_metrics.finish_game(self.start_time)
+            )
+            logger.info(f"对局归档已保存: {path}")
+            return path
+        except Exception as e:
+            logger.error(f"保存对局归档出错: {e}")
+            return None
+
+    def close_logs(self):
+        close_game_log(f'logs/result_{self.start_time}.txt')
+        close_game_log(f'logs/llm_{self.start_time}.txt')
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def checkpoint(self, kind, **data):
+        """追加一条检查点记录（见 journal.py）"""
+        if self.journal is None:
+            return
+        if self.lease is not None:
+            with self.lease.held():
+                self.journal.write(kind, **data)
+        else:
+            self.journal.write(kind, **data)
+
+    def llm_call(self):
+        """请求LLM期间释放对局锁（多进程部署时，见 web.GameLease）"""
+        return self.lease.released() if self.lease is not None else nullcontext()
+
+    def checkpoint_seats(self):
+        self.checkpoint("seats", players=self.seat_records())
+
+    def seat_records(self):
+        # 对冲备用模型一并记录，恢复时不再按座位配置重新推出（随机排序座位、随机分配模型后两者对不上）
+        return [{"index": p.player_index, "role": p.role_type, "model": p.model.model_name,
+                 "backup": getattr(getattr(p.model, "backup", None), "model_name", None)}
+                for p in self.players]
+
     def start(self):
+        # 关闭上一局的日志文件句柄
+        self.close_logs()
+        # 结束上一局仍在等待的人类玩家输入
+        if self.history is not None:
+            human_broker.cancel_all(self.start_time)
         self.history = History()
+        self.scoring = None
         self.vote_result = []
         self.wolf_want_kill = {}
+        self.discard_witch_speculation()
+        self.resumed = False
+        self.phase.reset()
         self.current_day = 1  # 游戏开始时,设置为第1天
         self.current_phase = "夜晚"  # 初始化当前阶段为夜晚
-        self.start_time = datetime.now().strftime("%Y%m%d%H%M")
+        self.start_time = self.game_id or datetime.now().strftime("%Y%m%d%H%M")
+        if self.store is not None:
+            self.start_time = self.register(self.start_time)
+        self.archive = GameArchive(self.start_time)
+        if self.store is not None:
+            self.journal = StoreJournal(self.store, self.start_time)
+            self.checkpoint("start", game=self.start_time)
+        elif self.load_settings().checkpoint:
+            self.journal = GameJournal(journal_path(self.start_time))
+            self.checkpoint("start", game=self.start_time)
         self.initialize_roles()
-        display_config = {
-            "display_role": True,
-            "display_thinking": True,
-            "display_witch_action": True,
-            "display_wolf_action": True,
-            "display_hunter_action": True,
-            "display_divine_action": True,
-            "display_vote_action": True,
-            "display_model": True,
-            "auto_play": True
-        }
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            if "display_role" in config:
-                display_config["display_role"] = config["display_role"]
-            if "display_thinking" in config:
-                display_config["display_thinking"] = config["display_thinking"]
-            if "display_witch_action" in config:
-                display_config["display_witch_action"] = config["display_witch_action"]
-            if "display_wolf_action" in config:
-                display_config["display_wolf_action"] = config["display_wolf_action"]
-            if "display_hunter_action" in config:
-                display_config["display_hunter_action"] = config["display_hunter_action"]
-            if "display_divine_action" in config:
-                display_config["display_divine_action"] = config["display_divine_action"]
-            if "display_vote_action" in config:
-                display_config["display_vote_action"] = config["display_vote_action"]
-            if "auto_play" in config:
-                display_config["auto_play"] = config["auto_play"]
-            if "display_model" in config:
-                display_config["display_model"] = config["display_model"]
-
+        self.attach_listeners(ScoreTracker(self))
+        self.push({"type": "start", "game": self.start_time, **self.get_time()})
+        self.push_player_changes()
+        return self.display_config()
+
+    def register(self, game_id):
+        """在状态存储中登记对局ID，同一分钟内其它 worker 已开始的对局占用时加序号后缀"""
+        candidate = game_id
+        for n in itertools.count(2):
+            if self.store.hsetnx("games", candidate, {"started": time.time()}):
+                return candidate
+            candidate = f"{game_id}_{n}"
+
+    def attach_listeners(self, score_tracker):
+        # 先写检查点，再更新贡献分，最后推送事件与玩家变化
+        if self.journal is not None:
+            self.history.add_listener(lambda event: self.checkpoint("event", **event_to_dict(event)))
+        self.score_tracker = score_tracker
+        self.history.add_listener(self.score_tracker.on_event)
+        self.history.add_listener(self.on_history_event)
+        self._pushed_players = {}
+
+    def display_config(self):
+        settings = self.load_settings()
+        display_config = {key: getattr(settings, key) for key in DISPLAY_KEYS}
+        display_config["request_timeout"] = settings.deadlines.request_timeout()
         return display_config
 
+    def restore(self, path):
+        """
+        从检查点日志恢复对局（见 journal.py）：按顺序重放记录重建座位、历史、玩家状态与行动进度，不调用LLM。
+        最后开始的行动未完成时回退到它开始之前，之后的 next_step() 会重新开始这一行动
+        """
+        return self.restore_records(load_journal(path), path)
+
+    def restore_records(self, records, path=None):
+        """由检查点记录恢复对局，对局ID取自第一条 start 记录；path 为之后继续写入的日志，默认按对局ID生成"""
+        self.close_logs()
+        if self.history is not None:
+            human_broker.cancel_all(self.start_time)
+        score_tracker = self.replay_records(records)
+        # 以保留下来的记录重写日志，之后继续追加
+        path = path or journal_path(self.start_time)
+        if self.load_settings().checkpoint:
+            self.journal = GameJournal(path, records)
+        self.attach_listeners(score_tracker)
+        self.resumed = True
+        self.push({"type": "start", "game": self.start_time, **self.get_time()})
+        self.push_player_changes()
+        logger.info(f"已从 {path} 恢复对局 {self.start_time}（{len(records)} 条记录）："
+                    f"第{self.current_day}天{self.current_phase}，行动 {self.phase.current}")
+        return self.get_time()
+
+    def replay_records(self, records):
+        """清空当前状态后按顺序重放检查点记录，返回重放得到的贡献分统计"""
+        self.history = History()
+        self.scoring = None
+        self.vote_result = []
+        self.wolf_want_kill = {}
+        self.discard_witch_speculation()
+        self.forced = []
+        self.phase.reset()
+        self.current_day = 1
+        self.current_phase = "夜晚"
+        self.start_time = records[0]["game"]
+        self.archive = GameArchive(self.start_time)
+        score_tracker = ScoreTracker(self)
+        for record in records:
+            self.replay_record(record, score_tracker)
+        return score_tracker
+
+    def load_store(self, store, game_id):
+        """
+        由状态存储中的检查点记录加载对局（多进程部署时其它 worker 开始或推进的对局），之后的记录继续写入存储。
+        只是本进程追上对局的进度：不推送、不视为恢复，也不丢弃最后一个未完成的行动（它可能正由其它请求执行）
+        """
+        records = store.read(journal_key(game_id))
+        if not records:
+            raise KeyError(game_id)
+        self.close_logs()
+        self.store = store
+        score_tracker = self.replay_records(records)
+        self.journal = StoreJournal(store, self.start_time, len(records))
+        self.attach_listeners(score_tracker)
+        self._pushed_players = self.get_players()
+
+    def sync(self):
+        """重放其它 worker 追加到状态存储的记录，返回重放的记录数；本进程的写入与存储不一致时重新加载整局"""
+        if not isinstance(self.journal, StoreJournal):
+            return 0
+        if self.journal.diverged:
+            self.load_store(self.store, self.start_time)
+            return self.journal.length
+        count = self.journal.follow(lambda record: self.replay_record(record, self.score_tracker))
+        if count:
+            # 这些变化已由写入它们的 worker 推送过
+            self._pushed_players = self.get_players()
+        return count
+
+    def snapshot_records(self, game_id=None):
+        """当前状态的检查点记录（格式同 journal.py），可以交给其它进程用 restore_records 还原"""
+        records = [{"t": "start", "game": game_id or self.start_time},
+                   {"t": "seats", "players": self.seat_records()}]
+        last = len(self.history.rounds) - 1
+        for round_idx, round_obj in enumerate(self.history.rounds):
+            # 第0回合只有首夜，之后每个回合先切换到白天，再（已入夜时）切换到夜晚
+            if round_idx > 0:
+                records.append({"t": "toggle"})
+                records.extend({"t": "event", **event_to_dict(e)} for e in round_obj.day_events)
+                if round_idx < last or not self.history.is_daytime:
+                    records.append({"t": "toggle"})
+            records.extend({"t": "event", **event_to_dict(e)} for e in round_obj.night_events)
+        records.extend({"t": "wolf_want_kill", "player_idx": idx, **info} for idx, info in self.wolf_want_kill.items())
+        records.extend({"t": "vote_result", **vote} for vote in self.vote_result)
+        if self.phase.current >= 0:
+            records.append({"t": "begin", **self.phase.step(self.phase.current)})
+        records.extend({"t": "complete", "seq": seq} for seq in sorted(self.phase.completed))
+        return records
+
+    def fork(self, game_id=None):
+        """
+        复制当前对局用于反事实分支（写时复制）：之前的回合与全部事件对象和原对局共享，只复制当前回合的事件列表；
+        玩家对象浅复制并共享模型，各自复制可变的状态（查验结果、模型档位表）。
+        分支对局不写检查点日志、不向观战者推送；用 force() 指定分支中的决策，再由 HeadlessRunner.play(resume=True) 继续
+        """
+        branch = WerewolfGame(game_id=game_id or f"{self.start_time}_fork{next(self._fork_ids)}")
+        branch.settings_override = self.settings_override
+        branch.auto_mvp = self.auto_mvp
+        branch.llm_cache = self.llm_cache
+        branch.publish = False
+        branch.history = self.history.fork()
+        branch.players = []
+        for player in self.players:
+            clone = copy.copy(player)
+            clone.game = branch
+            clone.tier_models = dict(player.tier_models)
+            if isinstance(player, Seer):
+                clone.divine_result = list(player.divine_result)
+            branch.players.append(clone)
+        branch.current_day = self.current_day
+        branch.current_phase = self.current_phase
+        branch.vote_result = list(self.vote_result)
+        branch.wolf_want_kill = dict(self.wolf_want_kill)
+        branch.phase.current = self.phase.current
+        branch.phase.completed = set(self.phase.completed)
+        branch.archive.set_players(branch.players)
+        branch.score_tracker = ScoreTracker.replay(branch)
+        branch.history.add_listener(branch.score_tracker.on_event)
+        return branch
+
+    def force(self, player_idx, prompt_type, response):
+        """指定某名玩家下一次该类行动（提示词类型，如 cure_or_poison）的决策，不调用LLM；response 需包含该行动的必要字段"""
+        self.forced.append({"player_idx": player_idx, "prompt_type": prompt_type, "response": response})
+
+    def drop_resumed_forced(self):
+        """崩溃恢复时由未完成行动中的决策转成的指定决策只在当前阶段有效，切换昼夜时丢弃未用到的"""
+        self.forced = [forced for forced in self.forced if not forced.get("resume")]
+
+    def has_forced(self, player_idx, prompt_type):
+        return any(forced["player_idx"] == player_idx and forced["prompt_type"] == prompt_type for forced in self.forced)
+
+    def take_forced(self, player_idx, prompt_type):
+        for i, forced in enumerate(self.forced):
+            if forced["player_idx"] == player_idx and forced["prompt_type"] == prompt_type:
+                return dict(self.forced.pop(i)["response"])
+        return None
+
+    def replay_record(self, record, score_tracker):
+        kind = record["t"]
+        if kind == "seats":
+            self.restore_seats(record["players"])
+        elif kind == "event":
+            event = event_from_dict(record)
+            self.history.restore_event(event)
+            self.replay_event(event)
+            score_tracker.on_event(event)
+        elif kind == "toggle":
+            self.history.toggle_day_night()
+            self.switch_phase()
+            self.drop_resumed_forced()
+        elif kind == "wolf_want_kill":
+            self.wolf_want_kill[record["player_idx"]] = {"kill": record["kill"], "reason": record["reason"]}
+        elif kind == "reset_wolf_want_kill":
+            self.wolf_want_kill = {}
+        elif kind == "vote_result":
+            self.vote_result.append({"player_idx": record["player_idx"], "vote_id": record["vote_id"]})
+        elif kind == "reset_vote_result":
+            self.vote_result = []
+        elif kind == "begin":
+            self.phase.current = record["seq"]
+            self.phase.completed = {done for done in self.phase.completed if done >= record["seq"]}
+        elif kind == "complete":
+            self.phase.completed.add(record["seq"])
+        elif kind == "forced":
+            self.forced.append({"player_idx": record["player_idx"], "prompt_type": record["prompt_type"],
+                                "response": record["response"], "resume": True})
+
+    def restore_seats(self, seats):
+        """按检查点中的座位重建玩家，api_key 与 base_url 按模型名从当前配置中查找（检查点不保存密钥）"""
+        role_classes = {'狼人': Wolf, '村民': Villager, '预言家': Seer, '女巫': Witch, '猎人': Hunter}
+        settings = self.load_settings()
+        configured = {}
+        for model in list(settings.models) + list(settings.players):
+            if model.model_name:
+                configured[model.model_name] = (model.api_key, model.base_url)
+        self.players = []
+        for seat in seats:
+            api_key, base_url = configured.get(seat["model"], ("", None))
+            self.players.append(role_classes[seat["role"]](seat["index"], seat["model"], api_key, self, base_url))
+        # 旧的检查点没有记录备用模型，按座位配置推出
+        backups = {seat["index"]: seat["backup"] for seat in seats if "backup" in seat}
+        self.attach_models(settings, backups if backups else None)
+        self.context_cache.invalidate()
+        self.archive.set_players(self.players)
+
+    def replay_event(self, event):
+        """由事件推出玩家状态的变化（与 role.py 中写入这些事件的方法一致）"""
+        player = self.players[event.player_idx - 1] if 1 <= event.player_idx <= len(self.players) else None
+        if isinstance(event, (KillEvent, ExecuteEvent, AttackEvent)):
+            player.is_alive = False
+        elif isinstance(event, CureEvent):
+            player.is_alive = True
+        elif isinstance(event, DivineEvent):
+            player.divine_result.append(f"【{event.target_idx}号玩家】是 {event.result}.")
+        elif isinstance(event, WitchActionEvent):
+            if event.action_type == "cure":
+                if player.cured_someone == 0:
+                    player.cured_someone = event.target_idx
+            else:
+                player.poisoned_someone = event.target_idx
+
 
     def initialize_roles(self):
         roles = [Wolf, Wolf, Wolf, Seer, Witch, Hunter, Villager, Villager, Villager]
@@ -81,15 +520,15 @@ class WerewolfGame:
             '猎人': Hunter
         }
 
-        # 读取配置文件决定每个玩家使用的模型
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        # 读取配置决定每个玩家使用的模型：(model_name, api_key, base_url)
+        settings = self.load_settings()
+        player_models = [(p.model_name, p.api_key, p.base_url) for p in settings.players]
 
         # 新增：模型分配逻辑
-        if config.get("random_model") and config.get("models"):
-            models = config["models"]
+        if settings.random_model and settings.models:
+            models = settings.models
             n_models = len(models)
-            n_players = len(config["players"])
+            n_players = len(settings.players)
             # 先确保每个模型至少分配一次
             assigned = [i for i in range(n_models)]
             # 多余玩家随机分配
@@ -97,58 +536,183 @@ class WerewolfGame:
                 assigned += random.choices(range(n_models), k=n_players - n_models)
             random.shuffle(assigned)
             assign_idx = 0
-            for idx, player in enumerate(config["players"]):
+            for idx, player in enumerate(settings.players):
                 # 如果原本配置的是human则不分配模型
-                if str(player.get("model_name", "")).lower() == "human":
-                    player["model_name"] = "human"
-                    player["api_key"] = ""
+                if str(player.model_name or "").lower() == "human":
+                    player_models[idx] = ("human", "", player.base_url)
                 else:
                     model = models[assigned[assign_idx]]
-                    player["model_name"] = model["model_name"]
-                    player["api_key"] = model["api_key"]
-                    if "base_url" in model:
-                        player["base_url"] = model["base_url"]
+                    base_url = model.base_url if model.base_url is not None else player.base_url
+                    player_models[idx] = (model.model_name, model.api_key, base_url)
                     assign_idx += 1
 
-        if config["randomize_roles"]:
+        if settings.randomize_roles:
             random.shuffle(roles)
         else:
             for i in range(len(roles)):
-                role_str = config["players"][i].get("role")
+                role_str = settings.players[i].role
                 if not role_str:
                     raise ValueError(f"玩家 {i} 没有设置角色")
-                role_class = role_classes.get(role_str.lower())
+                role_class = role_classes.get(role_str)
                 if not role_class:
                     raise ValueError(f"无效的角色 '{role_str}' 对玩家 {i}")
                 roles[i] = role_class
 
-        # 使用配置文件中的模型、API key和base_url
+        # 使用配置中的模型、API key和base_url
         self.players = [
-            role(i + 1, config["players"][i]["model_name"], config["players"][i]["api_key"], self,
-                 config["players"][i].get("base_url"))
+            role(i + 1, player_models[i][0], player_models[i][1], self, player_models[i][2])
             for i, role in enumerate(roles)
         ]
 
-        if config["randomize_position"]:
-            print("随机排序玩家")
+        self.attach_models(settings)
+
+        if settings.randomize_position:
+            logger.info("随机排序玩家")
             random.shuffle(self.players)
             for i, player in enumerate(self.players):
                 player.player_index = i + 1
+        self.checkpoint_seats()
 
-        with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
+        with self.result_log() as log_file:
             for player in self.players:
                 log_file.write(f"{player.player_index}号玩家的角色是{player.role_type}, 模型使用{player.model.model_name}\n")
-                print(f"{player.player_index}号玩家的角色是{player.role_type}, 模型使用{player.model.model_name}")
+                logger.info(f"{player.player_index}号玩家的角色是{player.role_type}, 模型使用{player.model.model_name}")
+        self.archive.set_players(self.players)
 
 
+    def attach_models(self, settings, backups=None):
+        """
+        为各座位（按 self.players 的顺序对应 settings.players）配置对冲备用模型与按行动选择的模型档位；
+        backups 为检查点中记录的各座位备用模型名 {座位号: 模型名或 None}，给出时优先使用
+        """
+        tier_cache = {}
+        for i, player in enumerate(self.players):
+            if player.model.model_name == "human":
+                continue
+            # 对冲备用模型：座位单独配置的优先，其次为全局配置（是否启用对冲在每次调用时按当前配置判断）
+            if backups is not None and player.player_index in backups:
+                backup = self.configured_backup(settings, backups[player.player_index])
+            else:
+                seat = settings.players[i] if i < len(settings.players) else None
+                backup = (seat.backup if seat else None) or settings.hedging.backup
+            if backup and backup.model_name and player.model.model_name != backup.model_name:
+                player.model.backup = BuildModel(backup.model_name, backup.api_key, force_json=True,
+                                                 base_url=backup.base_url)
+
+            # 模型档位：指定了模型的档位各座位共用一个模型对象，未指定模型的档位在座位模型上覆盖参数
+            player.tier_models = {}
+            for prompt_type in ACTION_TYPES:
+                tier_name = settings.tiering.tier(player.role_type, prompt_type)
+                if tier_name is None:
+                    continue
+                tier = settings.tiering.tiers[tier_name]
+                if tier.model_name:
+                    model = tier_cache.get(tier_name)
+                    if model is None:
+                        model = derive_model(BuildModel(tier.model_name, tier.api_key, force_json=True,
+                                                        base_url=tier.base_url), tier.overrides())
+                        # 多个座位共用，只使用全局的对冲备用模型
+                        shared_backup = settings.hedging.backup
+                        if shared_backup and shared_backup.model_name and shared_backup.model_name != tier.model_name:
+                            model.backup = BuildModel(shared_backup.model_name, shared_backup.api_key, force_json=True,
+                                                      base_url=shared_backup.base_url)
+                        tier_cache[tier_name] = model
+                else:
+                    model = derive_model(player.model, tier.overrides())
+                player.tier_models[prompt_type] = (tier_name, model)
+
+    @staticmethod
+    def configured_backup(settings, model_name):
+        """按模型名在座位与全局的备用模型配置中查找（api_key、base_url 取自配置），没有配置时只有模型名"""
+        if not model_name:
+            return None
+        candidates = [seat.backup for seat in settings.players if seat.backup] + [settings.hedging.backup]
+        candidates += list(settings.models)
+        for candidate in candidates:
+            if candidate is not None and candidate.model_name == model_name:
+                return candidate
+        return ModelSettings(model_name=model_name)
+
     def toggle_day_night(self):
+        ending = "end_day" if self.current_phase == "白天" else "end_night"
         self.history.toggle_day_night()
+        self.switch_phase()
+        self.checkpoint("toggle")
+        self.drop_resumed_forced()
+        self.phase.complete(ending)
+        self.push({"type": "phase", **self.get_time()})
+
+    def switch_phase(self):
         if self.current_phase == "白天":
             self.current_phase = "夜晚"
         else:
             self.current_phase = "白天"
             self.current_day += 1  # 每当从夜晚切换到白天时,天数加1
 
+    def next_step(self):
+        """开始下一个行动，返回 {"seq", "day", "action", "player_idx"}"""
+        return self.phase.next_step()
+
+    def get_plan(self, n=3):
+        """当前行动与接下来 n 个未完成的行动（见 PhaseMachine.plan）"""
+        current = self.phase.step(self.phase.current) if self.phase.current >= 0 else None
+        return {"current": current, "upcoming": self.phase.plan(n)}
+
+    def get_time(self):
+        return {
+            "current_day": self.current_day,
+            "current_phase": self.current_phase
+        }
+
+    def push(self, message, public=True):
+        """
+        推送给观战者（WebSocket）。game/all 收到全部消息，game/public 只收到公开消息
+        """
+        if not self.publish:
+            return
+        self.push_seq += 1
+        message["seq"] = self.push_seq
+        message.setdefault("game", self.start_time)
+        event_bus.publish("game/all", message)
+        if public:
+            event_bus.publish("game/public", message)
+
+    def on_history_event(self, event):
+        self.push({
+            "type": "event",
+            "day": self.history.day_count,
+            "is_daytime": self.history.is_daytime,
+            "event_type": event.event_type,
+            "player_idx": event.player_idx,
+            "desc": event.desc(),
+            "is_public": event.is_public
+        }, public=event.is_public)
+        self.push_player_changes()
+
+    def push_player_changes(self):
+        """只推送与上次相比发生变化的玩家字段"""
+        players = self.get_players()
+        changes = {}
+        for idx, info in players.items():
+            previous = self._pushed_players.get(idx, {})
+            diff = {k: v for k, v in info.items() if previous.get(k) != v}
+            if diff:
+                changes[idx] = diff
+        self._pushed_players = players
+        if changes:
+            self.push({"type": "players", "changes": changes})
+
+    def get_snapshot(self, show_all=False):
+        """观战者连接时的完整状态"""
+        return {
+            "type": "snapshot",
+            "seq": self.push_seq,
+            "game": self.start_time,
+            "players": self.get_players() if self.players else {},
+            "history": self.history.get_history(show_all) if self.history else [],
+            **self.get_time()
+        }
+
     def get_players(self):
         players = {}
         for player in self.players:
@@ -158,23 +722,22 @@ class WerewolfGame:
                 "role_type": player.role_type,
                 "is_alive": player.is_alive,
                 "model": player.model.model_name,
-                "is_human": True if player.model.model_name == "human" else False
+                "is_human": True if player.model.model_name == "human" else False,
+                "contribution_score": self.score_tracker.contribution_score(player.player_index) if self.score_tracker else 0
             }
         return players
 
+    def context(self):
+        """当前阶段的提示词上下文快照（见 context.py），各玩家共享"""
+        return self.context_cache.get(self)
+
     def get_wolves(self):
-        wolfs = []
-        for player in self.players:
-            if player.role_type == "狼人":
-                wolfs.append({
-                    "player_index": player.player_index,
-                    "is_alive": player.is_alive
-                })
-        return wolfs
+        return [dict(wolf) for wolf in self.context().wolves]
 
     def divine(self, player_idx):
         # 预言家揭示身份逻辑
         resp = self.players[player_idx-1].divine()
+        self.phase.complete("divine")
         return resp
 
     def decide_kill(self, player_idx, kill_id, is_second_vote=False):
@@ -191,6 +754,7 @@ class WerewolfGame:
             "kill": result["kill"],
             "reason": result["reason"]
         }
+        self.checkpoint("wolf_want_kill", player_idx=player_idx, **self.wolf_want_kill[player_idx])
 
         return result
 
@@ -206,7 +770,7 @@ class WerewolfGame:
                     vote_count[target] = 1
 
         if not vote_count:  # 如果没有有效投票
-            print("没有有效投票")
+            logger.info("没有有效投票")
             return -1
 
         # 找出最高票数
@@ -219,8 +783,7 @@ class WerewolfGame:
         if len(candidates) == 1:
             return candidates[0]
 
-        print("多人投票一致")
-        print(candidates)
+        logger.info(f"多人投票一致: {candidates}")
         return -1
 
     def kill(self, player_idx):
@@ -229,10 +792,96 @@ class WerewolfGame:
         # 狼人杀人
         self.players[player_idx-1].be_killed()
 
+    def wolf_kill(self):
+        """
+        由服务端完成狼人当晚的刀人投票，返回 {"rounds": [[{player_idx, kill, reason}]], "wolf_want_kill": 目标}：
+        第一轮各狼人互不可见，并发决策；出现唯一最高票即为结果，全票一致（包括一致不杀）时不再进行第二轮，
+        否则第二轮依次参考第一轮结果重新决定。
+        投票中领先目标一旦不可能被反超，就以该目标提前开始女巫的决策，女巫行动时目标与历史均未变化则直接使用
+        """
+        self.reset_wolf_want_kill()
+        wolves = [player for player in self.players if player.role_type == "狼人" and player.is_alive]
+        rounds = []
+
+        # 第一轮
+        votes = []
+        with ThreadPoolExecutor(max_workers=max(len(wolves), 1)) as pool:
+            futures = [pool.submit(self.decide_kill, wolf.player_index, -100) for wolf in wolves]
+            for future in as_completed(futures):
+                votes.append(future.result()["kill"])
+                self.speculate_witch(votes, len(wolves) - len(votes))
+        rounds.append(self.wolf_round(wolves))
+
+        target = self.get_wolf_want_kill()
+        unanimous = len(set(votes)) <= 1
+        if target == -1 and not unanimous:
+            # 第二轮：没有唯一最高票
+            votes = []
+            for wolf in wolves:
+                votes.append(self.decide_kill(wolf.player_index, -100, is_second_vote=True)["kill"])
+                self.speculate_witch(votes, len(wolves) - len(votes))
+            rounds.append(self.wolf_round(wolves))
+            target = self.get_wolf_want_kill()
+        self.phase.complete("wolf_kill")
+        return {"rounds": rounds, "wolf_want_kill": target}
+
+    def wolf_round(self, wolves):
+        return [{"player_idx": wolf.player_index, **self.wolf_want_kill[wolf.player_index]}
+                for wolf in wolves if wolf.player_index in self.wolf_want_kill]
+
+    def speculate_witch(self, votes, remaining):
+        """
+        领先目标的票数超过第二名加上未投票数时，以该目标投机执行女巫的决策（人类女巫、有指定决策时不投机）。
+        投机决策的LLM日志与归档记录先缓存，决策被采用时才写入（见 decide_cure_or_poison），作废时取消其请求。
+        多进程部署时不投机：后台的决策不属于任何请求，不能持有对局锁（见 web.GameLease）
+        """
+        if self.witch_speculation is not None or not votes or self.lease is not None:
+            return
+        witch = next((p for p in self.players if p.role_type == "女巫" and p.is_alive), None)
+        if (witch is None or witch.model.model_name == "human"
+                or self.has_forced(witch.player_index, "cure_or_poison")):
+            return
+        counts = sorted(((votes.count(v), v) for v in set(votes)), reverse=True)
+        top_count, target = counts[0]
+        runner_up = counts[1][0] if len(counts) > 1 else 0
+        if top_count <= runner_up + remaining:
+            return
+        logger.info(f"狼人目标已确定为 {target}，提前开始女巫决策")
+        executor = ThreadPoolExecutor(max_workers=1)
+        deferred = []
+        cancel = CancelToken()
+        self.witch_speculation = {
+            "witch": witch.player_index,
+            "target": target,
+            "version": self.history.version,
+            "deferred": deferred,
+            "cancel": cancel,
+            "future": executor.submit(witch.plan_cure_or_poison, target, deferred, cancel)
+        }
+        executor.shutdown(wait=False)
+
     def decide_cure_or_poison(self, player_idx):
         someone_will_be_killed = self.get_wolf_want_kill()
-        result = self.players[player_idx-1].decide_cure_or_poison(someone_will_be_killed)
-        return result
+        witch = self.players[player_idx-1]
+        speculation, self.witch_speculation = self.witch_speculation, None
+        if (speculation is not None and speculation["witch"] == player_idx
+                and speculation["target"] == someone_will_be_killed
+                and speculation["version"] == self.history.version):
+            plan = speculation["future"].result()
+            for record in speculation["deferred"]:
+                record()
+        else:
+            if speculation is not None:
+                logger.info(f"女巫投机决策作废（目标 {speculation['target']}，实际 {someone_will_be_killed}）")
+                speculation["cancel"].set()
+            plan = witch.plan_cure_or_poison(someone_will_be_killed)
+        return witch.commit_cure_or_poison(plan, someone_will_be_killed)
+
+    def discard_witch_speculation(self):
+        """作废进行中的女巫投机决策（见 speculate_witch），取消其LLM请求"""
+        speculation, self.witch_speculation = self.witch_speculation, None
+        if speculation is not None:
+            speculation["cancel"].set()
 
     def poison(self, player_idx):
         self.players[player_idx-1].be_poisoned()
@@ -254,6 +903,7 @@ class WerewolfGame:
 
     def speak(self, player_idx, content=None):
         resp = self.players[player_idx-1].speak(content)
+        self.phase.complete("speak", player_idx)
         return resp
 
     def vote(self, player_idx, vote_id) -> int:
@@ -264,6 +914,7 @@ class WerewolfGame:
                 "player_idx": player_idx,
                 "vote_id": -1
             })
+            self.checkpoint("vote_result", **self.vote_result[-1])
             return safe_result
 
         # 发起投票（AI或人类）
@@ -296,12 +947,15 @@ class WerewolfGame:
             "player_idx": player_idx,
             "vote_id": chosen
         })
+        self.checkpoint("vote_result", **self.vote_result[-1])
+        self.phase.complete("vote", player_idx)
 
         return result
 
 
     def reset_vote_result(self):
         self.vote_result = []
+        self.checkpoint("reset_vote_result")
 
     def get_vote_result(self):
         return self.vote_result
@@ -315,12 +969,65 @@ class WerewolfGame:
         resp = self.players[player_idx-1].revenge(death_reason)
         return resp
 
+    def last_words_allowed(self, death_reason):
+        """第一夜死亡的玩家与白天被投票处决的玩家可以发表遗言"""
+        return self.current_day == 1 or (self.current_phase == "白天" and death_reason == "被投票处决")
+
+    def resolve_deaths(self, deaths):
+        """
+        结算一个阶段内的全部死亡（deaths 为 [{"player_idx", "death_reason"}]，玩家已被标记死亡）。
+        遗言与猎人开枪互不依赖，基于同一份历史并发生成；全部生成后按规则顺序写入历史：
+        依次为每名死者记录遗言、猎人开枪及被带走的玩家，被猎人带走的玩家作为下一轮死亡继续结算。
+        返回按写入顺序排列的结算结果
+        """
+        resolutions = []
+        pending = []
+        for death in deaths:
+            same = next((item for item in pending if item[0] == death["player_idx"]), None)
+            if same is None:
+                pending.append([death["player_idx"], death["death_reason"]])
+            elif death["death_reason"] == "被女巫毒杀":
+                # 同一晚被刀又被毒：只结算一次，按毒杀处理（猎人不能开枪）
+                same[1] = death["death_reason"]
+        while pending:
+            jobs = []
+            for player_idx, death_reason in pending:
+                player = self.players[player_idx - 1]
+                speaks = self.last_words_allowed(death_reason)
+                # 猎人被毒杀时不能开枪
+                shoots = isinstance(player, Hunter) and death_reason != "被女巫毒杀"
+                jobs.append((player, death_reason, speaks, shoots))
+
+            with ThreadPoolExecutor(max_workers=2 * len(jobs)) as pool:
+                futures = [(pool.submit(player.compose_last_words, death_reason) if speaks else None,
+                            pool.submit(player.decide_revenge, death_reason) if shoots else None)
+                           for player, death_reason, speaks, shoots in jobs]
+
+            pending = []
+            for (player, death_reason, _, _), (words, revenge) in zip(jobs, futures):
+                resolution = {"player_idx": player.player_index, "death_reason": death_reason,
+                              "last_words": None, "revenge": None}
+                if words is not None:
+                    resolution["last_words"] = player.commit_last_words(words.result())
+                if revenge is not None:
+                    resp = player.commit_revenge(revenge.result())
+                    resolution["revenge"] = resp
+                    target = resp.get('attack', -1) if resp else -1
+                    if isinstance(target, int) and 1 <= target <= len(self.players) and self.players[target - 1].is_alive:
+                        self.attack(target)
+                        pending.append((target, "被猎人杀死"))
+                resolutions.append(resolution)
+        self.phase.complete_current(("witch", "execute"))
+        return {"resolutions": resolutions}
+
     def execute(self, player_idx, vote_result):
         # 处决玩家
         self.players[player_idx-1].be_executed(vote_result)
 
     def reset_wolf_want_kill(self):
         self.wolf_want_kill = {}
+        self.discard_witch_speculation()
+        self.checkpoint("reset_wolf_want_kill")
 
 
     def attack(self, player_idx):
@@ -339,115 +1046,122 @@ class WerewolfGame:
         alive_villagers = sum(1 for p in self.players if p.role_type == '村民' and p.is_alive)
         alive_specials = sum(1 for p in self.players if p.role_type in ['预言家', '女巫', '猎人'] and p.is_alive)
 
-        print("--- 检查胜负 ----")
-        print(f"存活 - 狼人:{alive_wolves} 村民:{alive_villagers} 神职:{alive_specials}")
+        logger.info(f"检查胜负 存活 - 狼人:{alive_wolves} 村民:{alive_villagers} 神职:{alive_specials}")
 
         if alive_wolves == 0:
             winner = '村民胜利'
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
+            with self.result_log() as log_file:
                 log_file.write(f"【{self.current_day} {self.current_phase}】 村民胜利\n")
         elif alive_villagers == 0 or alive_specials == 0:
             winner = '狼人胜利'
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
+            with self.result_log() as log_file:
                 log_file.write(f"【{self.current_day} {self.current_phase}】 狼人胜利\n")
         else:
             winner = '胜负未分'
 
-        # 如果游戏结束，计算积分
-        if winner != '胜负未分':
+        # 如果游戏结束，在后台计算积分（同一局只结算一次）
+        if winner != '胜负未分' and (self.scoring is None or self.scoring.winner != winner) and self.claim_scoring(winner):
+            self.push({"type": "winner", "winner": winner})
             self.calculate_and_save_scores(winner)
 
+        self.phase.complete_current(("check_winner",))
         return winner
 
-    def calculate_and_save_scores(self, winner: str):
-        """计算并保存积分"""
-        try:
-            # 创建积分计算器，先计算不含 MVP 的基础分
-            score_calculator = ScoreCalculator(self)
-            player_scores = score_calculator.calculate_scores(winner)
-            ranking = score_calculator.get_ranking()
-
-            # 自动评选 MVP（使用评审模型）
-            auto_mvp = None
-            try:
-                selector = MvpSelector()
-                auto_mvp = selector.select(self, winner, precomputed_ranking=ranking)
-                # 若返回了有效的 mvp_player_index，则基于该 MVP 重算积分与排名
-                if auto_mvp and isinstance(auto_mvp.get('mvp_player_index'), int):
-                    score_calculator = ScoreCalculator(self)
-                    player_scores = score_calculator.calculate_scores(winner, mvp_player_index=auto_mvp['mvp_player_index'])
-                    ranking = score_calculator.get_ranking()
-            except Exception as _e:
-                # 自动评选失败不影响结算
-                auto_mvp = None
-
-            # 保存积分到日志文件
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
-                log_file.write(f"\n=== 积分统计 ===\n")
-                log_file.write(f"游戏结果：{winner}\n\n")
-
-                for i, player_data in enumerate(ranking, 1):
-                    log_file.write(f"第{i}名：{player_data['player_index']}号玩家 ({player_data['role_type']})\n")
-                    log_file.write(f"  总分：{player_data['total_score']}分\n")
-                    log_file.write(f"  阵营分：{player_data['camp_score']}分\n")
-                    log_file.write(f"  贡献分：{player_data['contribution_score']}分\n")
-                    log_file.write(f"  MVP分：{player_data['mvp_score']}分\n")
-                    if player_data['contributions']:
-                        log_file.write(f"  贡献详情：{', '.join(player_data['contributions'])}\n")
-                    log_file.write("\n")
-
-            # 保存积分数据供前端使用
-            self.game_scores = {
-                'winner': winner,
-                'ranking': ranking,
-                'player_scores': {str(k): v.get_score_detail() for k, v in player_scores.items()},
-                'auto_mvp': auto_mvp  # 形如 {mvp_player_index, reason, model, auto}
-            }
+    def claim_scoring(self, winner):
+        """多进程部署时只由第一个判出胜负的 worker 结算，其它 worker 从状态存储读取结果"""
+        if self.store is None:
+            return True
+        return self.store.hsetnx("scores", self.start_time, {'status': 'pending', 'winner': winner})
 
-            print("=== 积分计算完成 ===")
-            for i, player_data in enumerate(ranking, 1):
-                print(f"第{i}名：{player_data['player_index']}号 {player_data['role_type']} - {player_data['total_score']}分")
-            if auto_mvp and isinstance(auto_mvp.get('mvp_player_index'), int):
-                print(f"自动MVP：{auto_mvp['mvp_player_index']}号，理由：{auto_mvp.get('reason','')}")
+    def calculate_and_save_scores(self, winner: str) -> ScoringJob:
+        """在后台结算积分与自动MVP（见 scoring.py），立即返回结算任务"""
+        scoring = self.scoring = ScoringJob(self, winner, select_mvp=self.auto_mvp).start()
+        if self.store is not None:
+            scoring.add_done_callback(lambda: self.store.hset("scores", self.start_time, scoring.result))
+        return scoring
 
-        except Exception as e:
-            print(f"积分计算出错：{e}")
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
-                log_file.write(f"\n积分计算出错：{e}\n")
+    def write_scores_log(self, winner, ranking, auto_mvp=None):
+        """保存积分到日志文件"""
+        with self.result_log() as log_file:
+            log_file.write(f"\n=== 积分统计 ===\n")
+            log_file.write(f"游戏结果：{winner}\n\n")
 
-    def get_game_scores(self):
-        """获取游戏积分数据"""
-        return getattr(self, 'game_scores', None)
+            for i, player_data in enumerate(ranking, 1):
+                log_file.write(f"第{i}名：{player_data['player_index']}号玩家 ({player_data['role_type']})\n")
+                log_file.write(f"  总分：{player_data['total_score']}分\n")
+                log_file.write(f"  阵营分：{player_data['camp_score']}分\n")
+                log_file.write(f"  贡献分：{player_data['contribution_score']}分\n")
+                log_file.write(f"  MVP分：{player_data['mvp_score']}分\n")
+                if player_data['contributions']:
+                    log_file.write(f"  贡献详情：{', '.join(player_data['contributions'])}\n")
+                log_file.write("\n")
+
+        logger.info("=== 积分计算完成 ===")
+        for i, player_data in enumerate(ranking, 1):
+            logger.info(f"第{i}名：{player_data['player_index']}号 {player_data['role_type']} - {player_data['total_score']}分")
+        if auto_mvp and isinstance(auto_mvp.get('mvp_player_index'), int):
+            logger.info(f"自动MVP：{auto_mvp['mvp_player_index']}号，理由：{auto_mvp.get('reason','')}")
+
+    def get_game_scores(self, wait: float = 0):
+        """
+        获取游戏积分数据；结算未完成时最多等待 wait 秒，仍未完成则返回 {"status": "pending"}，
+        游戏尚未结束时返回 None
+        """
+        if self.scoring is None or (self.store is not None and self.scoring.done):
+            # 多进程部署时以状态存储中的结果为准（可能已由其它 worker 更换MVP）
+            return self.stored_scores(wait)
+        if wait > 0:
+            self.scoring.wait(wait)
+        if not self.scoring.done:
+            return {'status': 'pending', 'winner': self.scoring.winner}
+        return self.scoring.result
+
+    def stored_scores(self, wait: float = 0):
+        """其它 worker 结算的积分（见 claim_scoring），结算未完成时最多等待 wait 秒"""
+        if self.store is None:
+            return None
+        deadline = time.monotonic() + wait
+        while True:
+            scores = self.store.hget("scores", self.start_time)
+            if scores is None or scores.get('status') != 'pending' or time.monotonic() >= deadline:
+                return scores
+            time.sleep(0.2)
 
     def set_mvp(self, mvp_player_index: int):
         """设置MVP玩家"""
-        if hasattr(self, 'game_scores') and self.game_scores:
-            # 重新计算积分，这次包含MVP
-            score_calculator = ScoreCalculator(self)
-            player_scores = score_calculator.calculate_scores(
-                self.game_scores['winner'],
-                mvp_player_index
-            )
-
-            # 更新积分数据
-            ranking = score_calculator.get_ranking()
-            self.game_scores['ranking'] = ranking
-            self.game_scores['player_scores'] = {str(k): v.get_score_detail() for k, v in player_scores.items()}
-
-            # 更新日志
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
-                log_file.write(f"\n=== MVP更新 ===\n")
-                log_file.write(f"MVP玩家：{mvp_player_index}号玩家\n\n")
+        scoring = self.scoring
+        if scoring is not None and scoring.done and scoring.calculator is not None:
+            calculator, result = scoring.calculator, scoring.result
+        else:
+            # 由其它 worker 结算时，按同样的历史在本进程重算积分（不含MVP）
+            result = self.stored_scores()
+            if result is None or result.get('status') != 'done':
+                return False
+            calculator = ScoreCalculator(self)
+            calculator.calculate_scores(result['winner'])
+        # 积分的其它分项不变，只更换MVP
+        player_scores = calculator.apply_mvp(mvp_player_index)
+
+        # 更新积分数据
+        ranking = calculator.get_ranking()
+        result['ranking'] = ranking
+        result['player_scores'] = {str(k): v.get_score_detail() for k, v in player_scores.items()}
+        if self.store is not None:
+            self.store.hset("scores", self.start_time, result)
+
+        # 更新日志
+        with self.result_log() as log_file:
+            log_file.write(f"\n=== MVP更新 ===\n")
+            log_file.write(f"MVP玩家：{mvp_player_index}号玩家\n\n")
 
-                for i, player_data in enumerate(ranking, 1):
-                    log_file.write(f"第{i}名：{player_data['player_index']}号玩家 ({player_data['role_type']})\n")
-                    log_file.write(f"  总分：{player_data['total_score']}分\n")
-                    if player_data['mvp_score'] > 0:
-                        log_file.write(f"  ★ MVP加分：{player_data['mvp_score']}分\n")
-                    log_file.write("\n")
+            for i, player_data in enumerate(ranking, 1):
+                log_file.write(f"第{i}名：{player_data['player_index']}号玩家 ({player_data['role_type']})\n")
+                log_file.write(f"  总分：{player_data['total_score']}分\n")
+                if player_data['mvp_score'] > 0:
+                    log_file.write(f"  ★ MVP加分：{player_data['mvp_score']}分\n")
+                log_file.write("\n")
 
-            return True
-        return False
+        return True
 
     def set_manual_position(self, position_mapping):
         """手动设置玩家位置和角色分配
@@ -468,9 +1182,8 @@ class WerewolfGame:
                 '猎人': Hunter
             }
 
-            # 读取配置文件获取默认API密钥
-            with open('config.json', 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            # 未指定的字段使用配置中的默认值
+            settings = self.load_settings()
 
             # 验证位置映射的有效性
             if not isinstance(position_mapping, dict):
@@ -498,9 +1211,10 @@ class WerewolfGame:
 
             for position, player_data in position_mapping.items():
                 role_name = player_data.get("role")
-                model_name = player_data.get("model_name", config["players"][position-1]["model_name"])
-                api_key = player_data.get("api_key", config["players"][position-1]["api_key"])
-                base_url = player_data.get("base_url", config["players"][position-1].get("base_url"))
+                default = settings.players[position-1]
+                model_name = player_data.get("model_name", default.model_name)
+                api_key = player_data.get("api_key", default.api_key)
+                base_url = player_data.get("base_url", default.base_url)
 
                 role_class = role_classes[role_name]
                 new_players[position-1] = role_class(position, model_name, api_key, self, base_url)
@@ -509,24 +1223,29 @@ class WerewolfGame:
             for i in range(9):
                 if new_players[i] is None:
                     # 使用原有配置
-                    original_config = config["players"][i]
-                    role_name = original_config.get("role", "村民")
+                    original_config = settings.players[i]
+                    role_name = original_config.role or "村民"
                     role_class = role_classes[role_name]
                     new_players[i] = role_class(
                         i + 1,
-                        original_config["model_name"],
-                        original_config["api_key"],
+                        original_config.model_name,
+                        original_config.api_key,
                         self
                     )
 
             # 更新玩家列表
             self.players = new_players
+            self.attach_models(settings)
+            self.context_cache.invalidate()
+            self.push_player_changes()
+            self.archive.set_players(self.players)
+            self.checkpoint_seats()
 
             # 更新配置文件以持久化更改
             self.update_config_file(position_mapping)
 
             # 记录日志
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
+            with self.result_log() as log_file:
                 log_file.write("\n=== 手动位置调整 ===\n")
                 for player in self.players:
                     log_file.write(f"{player.player_index}号玩家的角色是{player.role_type}, 模型使用{player.model.model_name}\n")
@@ -546,11 +1265,7 @@ class WerewolfGame:
         Args:
             position_mapping: dict, 位置映射
         """
-        try:
-            # 读取当前配置
-            with open('config.json', 'r', encoding='utf-8') as f:
-                config = json.load(f)
-
+        def apply(config):
             # 更新玩家配置
             for position_str, player_data in position_mapping.items():
                 position = int(position_str)
@@ -565,14 +1280,11 @@ class WerewolfGame:
             config["randomize_position"] = False
             config["randomize_roles"] = False
 
-            # 保存配置文件
-            with open('config.json', 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-
-            print("配置文件已更新，禁用了位置随机化")
-
+        try:
+            settings_store.update(apply)
+            logger.info("配置文件已更新，禁用了位置随机化")
         except Exception as e:
-            print(f"更新配置文件时出错: {e}")
+            logger.error(f"更新配置文件时出错: {e}")
 
     def update_config_after_swap(self, position1, position2):
         """交换位置后更新配置文件
@@ -581,11 +1293,7 @@ class WerewolfGame:
             position1: int, 第一个位置
             position2: int, 第二个位置
         """
-        try:
-            # 读取当前配置
-            with open('config.json', 'r', encoding='utf-8') as f:
-                config = json.load(f)
-
+        def apply(config):
             # 交换配置中的角色
             player1_config = config["players"][position1-1].copy()
             player2_config = config["players"][position2-1].copy()
@@ -597,14 +1305,11 @@ class WerewolfGame:
             config["randomize_position"] = False
             config["randomize_roles"] = False
 
-            # 保存配置文件
-            with open('config.json', 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-
-            print(f"配置文件已更新，交换了位置{position1}和{position2}")
-
+        try:
+            settings_store.update(apply)
+            logger.info(f"配置文件已更新，交换了位置{position1}和{position2}")
         except Exception as e:
-            print(f"交换后更新配置文件时出错: {e}")
+            logger.error(f"交换后更新配置文件时出错: {e}")
 
     def swap_players_position(self, position1, position2):
         """交换两个位置的玩家
@@ -634,12 +1339,16 @@ class WerewolfGame:
             # 交换在数组中的位置
             self.players[position1-1] = player2
             self.players[position2-1] = player1
+            self.context_cache.invalidate()
+            self.push_player_changes()
+            self.archive.set_players(self.players)
+            self.checkpoint_seats()
 
             # 更新配置文件
             self.update_config_after_swap(position1, position2)
 
             # 记录日志
-            with open(f'logs/result_{self.start_time}.txt', 'a', encoding='utf-8') as log_file:
+            with self.result_log() as log_file:
                 log_file.write(f"\n=== 位置交换 ===\n")
                 log_file.write(f"交换 {position1}号位置({player2.role_type}) 和 {position2}号位置({player1.role_type})\n")
 
@@ -1,18 +1,42 @@
 from datetime import datetime
+from array import array
+
+# 事件类型编码（归档文件中的 type 列同样使用该编码）
+EVENT_TYPES = ["speak", "vote", "execute", "attack", "last_word", "kill", "cure",
+               "poison", "divine", "witch_action", "hunter_revenge"]
+EVENT_TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+WITCH_ACTIONS = ["cure", "poison"]
+DIVINE_RESULTS = ["好人", "狼人"]
+
 
 class Event:
-    def __init__(self, event_type, player_idx):
-        self.event_type = event_type  # 事件类型
+    """
+    历史事件：批量模拟时需要在内存中保留大量对局，事件使用 __slots__ 并只保存整数编码与原始文本，
+    描述文字在需要时（提示词、界面）才由 desc() 生成。
+    子类通过 CODE 指定事件类型，is_public 为类属性（是否公开事件）。
+    """
+    __slots__ = ("player_idx",)
+    CODE = -1
+    is_public = True
+
+    def __init__(self, player_idx):
         self.player_idx = player_idx
-        self.is_public = True  # 是否公开事件
+
+    @property
+    def event_type(self) -> str:
+        return EVENT_TYPES[self.CODE]
 
     def desc(self)->str:
         pass
 
 
 class SpeakEvent(Event):
+    __slots__ = ("description",)
+    CODE = EVENT_TYPE_CODES["speak"]
+
     def __init__(self, player_idx, description):
-        super().__init__("speak", player_idx)
+        super().__init__(player_idx)
         self.description = description
 
     def desc(self)->str:
@@ -20,10 +44,13 @@ class SpeakEvent(Event):
 
 
 class VoteEvent(Event):
+    __slots__ = ("target_idx",)
+    CODE = EVENT_TYPE_CODES["vote"]
+    is_public = False
+
     def __init__(self, player_idx, target_idx):
-        super().__init__("vote", player_idx)
+        super().__init__(player_idx)
         self.target_idx = target_idx
-        self.is_public = False
 
     def desc(self)->str:
         if self.target_idx == -1:
@@ -31,16 +58,27 @@ class VoteEvent(Event):
         return f'【{self.player_idx}号玩家】投票给: 【{self.target_idx}号玩家】'
 
 class ExecuteEvent(Event):
+    # votes 依次保存 (投票人, 投票目标) 的整数对，-1 表示弃票
+    __slots__ = ("votes",)
+    CODE = EVENT_TYPE_CODES["execute"]
+
     def __init__(self, player_idx,  vote_result):
-        super().__init__("execute", player_idx)
-        self.vote_result = []
+        super().__init__(player_idx)
+        self.votes = array('b')
         for vote in vote_result:
-            vote_id = vote["vote_id"]
+            self.votes.append(vote["player_idx"])
+            self.votes.append(vote["vote_id"])
+
+    @property
+    def vote_result(self):
+        result = []
+        for voter, vote_id in zip(self.votes[::2], self.votes[1::2]):
             if vote_id == -1:
-                self.vote_result.append(f'【{vote["player_idx"]}号玩家】弃票.')
+                result.append(f'【{voter}号玩家】弃票.')
             else:
-                self.vote_result.append(f'【{vote["player_idx"]}号玩家】 投票给 {vote["vote_id"]}号玩家.')
-        
+                result.append(f'【{voter}号玩家】 投票给 {vote_id}号玩家.')
+        return result
+
     def desc(self)->str:
         desc_str = '白天投票结果:'
         for vote in self.vote_result:
@@ -49,75 +87,124 @@ class ExecuteEvent(Event):
         return desc_str
 
 class AttackEvent(Event):
-    def __init__(self, player_idx):
-        super().__init__("attack", player_idx)
+    __slots__ = ()
+    CODE = EVENT_TYPE_CODES["attack"]
 
     def desc(self)->str:
         return f'【{self.player_idx}号玩家】被猎人反击杀死'
 
 class LastWordEvent(Event):
+    __slots__ = ("description",)
+    CODE = EVENT_TYPE_CODES["last_word"]
+
     def __init__(self, player_idx, description):
-        super().__init__("last_word", player_idx)
+        super().__init__(player_idx)
         self.description = description
     def desc(self)->str:
         return f'【{self.player_idx}号玩家】最后发言: "{self.description}"'
 
 class KillEvent(Event):
-    def __init__(self, player_idx):
-        super().__init__("kill", player_idx)
+    __slots__ = ()
+    CODE = EVENT_TYPE_CODES["kill"]
 
     def desc(self)->str:
         return f'【{self.player_idx}号玩家】被杀死'
 
 class CureEvent(Event):
-    def __init__(self, player_idx):
-        super().__init__("cure", player_idx)
-        self.is_public = False
+    __slots__ = ()
+    CODE = EVENT_TYPE_CODES["cure"]
+    is_public = False
 
     def desc(self)->str:
         return f'{self.player_idx}号玩家】被女巫救治'
     
 class PoisonEvent(Event):
-    def __init__(self, player_idx):
-        super().__init__("poison", player_idx)
-        self.is_public = False
+    __slots__ = ()
+    CODE = EVENT_TYPE_CODES["poison"]
+    is_public = False
 
     def desc(self)->str:
         return f'【{self.player_idx}号玩家】被投毒'
 
 class DivineEvent(Event):
+    __slots__ = ("target_idx", "result_code")
+    CODE = EVENT_TYPE_CODES["divine"]
+    is_public = False
+
     def __init__(self, seer_idx, target_idx, result):
-        super().__init__("divine", seer_idx)
+        super().__init__(seer_idx)
         self.target_idx = target_idx
-        self.result = result  # "狼人" 或 "好人"
-        self.is_public = False
+        self.result_code = DIVINE_RESULTS.index(result)
+
+    @property
+    def result(self) -> str:
+        """查验结果：好人 或 狼人"""
+        return DIVINE_RESULTS[self.result_code]
 
     def desc(self)->str:
         return f'【{self.player_idx}号预言家】查验【{self.target_idx}号玩家】，结果是{self.result}'
 
 class WitchActionEvent(Event):
+    __slots__ = ("action_code", "target_idx")
+    CODE = EVENT_TYPE_CODES["witch_action"]
+    is_public = False
+
     def __init__(self, witch_idx, action_type, target_idx):
-        super().__init__("witch_action", witch_idx)
-        self.action_type = action_type  # "cure" 或 "poison"
+        super().__init__(witch_idx)
+        self.action_code = WITCH_ACTIONS.index(action_type)
         self.target_idx = target_idx
-        self.is_public = False
+
+    @property
+    def action_type(self) -> str:
+        """用药类型：cure 或 poison"""
+        return WITCH_ACTIONS[self.action_code]
 
     def desc(self)->str:
         if self.action_type == "cure":
             return f'【{self.player_idx}号女巫】救治了【{self.target_idx}号玩家】'
-        elif self.action_type == "poison":
-            return f'【{self.player_idx}号女巫】毒杀了【{self.target_idx}号玩家】'
-        return f'【{self.player_idx}号女巫】进行了{self.action_type}操作'
+        return f'【{self.player_idx}号女巫】毒杀了【{self.target_idx}号玩家】'
 
 class HunterRevengeEvent(Event):
+    __slots__ = ("target_idx",)
+    CODE = EVENT_TYPE_CODES["hunter_revenge"]
+
     def __init__(self, hunter_idx, target_idx):
-        super().__init__("hunter_revenge", hunter_idx)
+        super().__init__(hunter_idx)
         self.target_idx = target_idx
 
     def desc(self)->str:
         return f'【{self.player_idx}号猎人】开枪反击【{self.target_idx}号玩家】'
 
+EVENT_CLASSES = {cls.CODE: cls for cls in (SpeakEvent, VoteEvent, ExecuteEvent, AttackEvent, LastWordEvent, KillEvent,
+                                           CureEvent, PoisonEvent, DivineEvent, WitchActionEvent, HunterRevengeEvent)}
+
+
+def _event_slots(cls):
+    return [name for klass in reversed(cls.__mro__) for name in getattr(klass, "__slots__", ())]
+
+
+def event_to_dict(event) -> dict:
+    """事件的全部字段（检查点日志使用，见 journal.py）"""
+    data = {"code": event.CODE}
+    for name in _event_slots(type(event)):
+        value = getattr(event, name)
+        data[name] = value.tolist() if isinstance(value, array) else value
+    return data
+
+
+def event_from_dict(data) -> Event:
+    """由 event_to_dict 的结果还原事件"""
+    cls = EVENT_CLASSES[data["code"]]
+    event = cls.__new__(cls)
+    for name in _event_slots(cls):
+        value = data[name]
+        setattr(event, name, array('b', value) if name == "votes" else value)
+    return event
+
+
 class Round:
+    __slots__ = ("day_count", "day_events", "night_events")
+
     def __init__(self, day_count):
         self.day_count = day_count
         self.day_events = []
@@ -150,6 +237,12 @@ class Round:
             del events["夜晚事件"]
         return events
     
+    def copy(self):
+        copied = Round(self.day_count)
+        copied.day_events = list(self.day_events)
+        copied.night_events = list(self.night_events)
+        return copied
+
     def add_event(self, is_daytime, event):
         if is_daytime:
             self.day_events.append(event)
@@ -162,6 +255,11 @@ class History:
         self.rounds = []  # 存储所有事件
         self.rounds.append(Round(self.day_count)) #创建第一个回合
         self.is_daytime = False  # 从晚上开始
+        self.listeners = []  # 事件监听回调 fn(event)，在事件记录后调用
+        self.version = 0  # 每记录一个事件或切换昼夜加一，用于判断上下文快照是否过期
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
 
     def dump(self):
         for round in self.rounds:
@@ -169,6 +267,27 @@ class History:
 
     def add_event(self, event):
         self.rounds[self.day_count].add_event(self.is_daytime, event)
+        self.version += 1
+        for listener in self.listeners:
+            listener(event)
+
+    def fork(self):
+        """
+        复制历史用于分支对局：之前的回合不会再被修改，与原历史共享；事件对象同样共享，
+        只复制当前回合的事件列表。监听者不复制
+        """
+        history = History.__new__(History)
+        history.day_count = self.day_count
+        history.rounds = self.rounds[:-1] + [self.rounds[-1].copy()]
+        history.is_daytime = self.is_daytime
+        history.listeners = []
+        history.version = self.version
+        return history
+
+    def restore_event(self, event):
+        """重放检查点日志时记录事件，不通知监听者"""
+        self.rounds[self.day_count].add_event(self.is_daytime, event)
+        self.version += 1
 
     def get_history(self, show_all = False):
         '''
@@ -181,6 +300,7 @@ class History:
 
     def toggle_day_night(self):
         self.is_daytime = not self.is_daytime
+        self.version += 1
         if self.is_daytime:
             self.day_count += 1
             #新的一天开始新回合
@@ -0,0 +1,215 @@
+"""
+人类玩家输入中转
+
+人类玩家与AI玩家走同一条行动流程：轮到人类行动时，HumanLlm 调用 human_broker.request()
+登记一个待处理的输入请求并在当前线程等待（其它AI玩家的请求在各自线程中照常进行）；
+浏览器通过 /human/poll 长轮询拿到请求，玩家输入后经 /human/submit 提交，校验通过即唤醒等待的行动。
+等待超过行动时限（见 config.json 的 deadlines.human）时返回 None，由角色采用默认决策；
+新开一局时（cancel_all）等待中的请求抛出 InputCancelled，角色不再重试，直接采用默认决策。
+
+多进程部署时（见 state_store.py）请求登记在状态存储的 human 哈希中，任意 worker 都能查到并校验提交，
+校验通过的输入写入 human_input 哈希，等待中的 worker 轮询取走。
+"""
+from typing import Any, Dict, List, Optional
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from event_bus import event_bus
+
+logger = logging.getLogger(__name__)
+
+class InputCancelled(Exception):
+    """输入请求被取消（所属对局已结束或重新开始）"""
+
+
+# 各类行动的输入提示
+HINTS = {
+    'speak': "请输入你的发言",
+    'lastword': "请输入你的遗言",
+    'vote': "请输入你的投票 1~9\n如果弃票输入-1",
+    'kill': "请输入你的杀人目标 1~9\n输入-1代表放弃",
+    'divine': "请输入你要查验的玩家 1~9",
+    'cure_or_poison': "是否使用解药(1/0)与毒杀目标(-1表示不用毒药)，用空格分隔，如: 0 -1",
+    'hunter_revenge': "请输入你要带走的玩家 1~9\n输入-1代表放弃",
+}
+
+# 提示中附带的行动上下文（来自提示词中的额外信息）
+CONTEXT_KEYS = ('今晚发生了什么', '第一轮投票结果', '你已经掌握的信息', '你的狼人队友', '出局的原因', 'reason')
+
+
+def parse_input(prompt_type: str, text: str) -> Dict[str, Any]:
+    """把玩家输入的文本转换为与模型输出相同格式的字典，输入不合法时抛出 ValueError"""
+    text = (text or "").strip()
+    if not text:
+        raise ValueError("输入不能为空")
+    if prompt_type in ('speak', 'lastword'):
+        return {'thinking': '', 'speak': text}
+    if prompt_type == 'cure_or_poison':
+        parts = text.replace(',', ' ').replace('，', ' ').split()
+        if len(parts) != 2:
+            raise ValueError("请输入两个数字：是否使用解药(1/0)与毒杀目标(-1表示不用毒药)")
+        cure, poison = _parse_int(parts[0]), _parse_int(parts[1])
+        if cure not in (0, 1) or not (poison == -1 or 1 <= poison <= 9):
+            raise ValueError("解药只能输入1或0，毒杀目标为1~9或-1")
+        return {'thinking': '', 'cure': cure, 'poison': poison}
+
+    target = _parse_int(text)
+    minimum = 1 if prompt_type == 'divine' else -1
+    if target == 0 or not (minimum <= target <= 9):
+        raise ValueError(f"请输入{minimum}~9之间的玩家编号")
+    field = {'vote': 'vote', 'kill': 'kill', 'divine': 'divine', 'hunter_revenge': 'attack'}.get(prompt_type)
+    if field is None:
+        raise ValueError(f"不支持的行动类型: {prompt_type}")
+    return {'thinking': '', 'reason': '', field: target}
+
+
+def _parse_int(text: str) -> int:
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"'{text}' 不是有效的数字")
+
+
+POLL_INTERVAL = 0.3
+
+
+class HumanInputBroker:
+    """人类玩家的待处理输入请求（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._prefix = ""
+        self.store = None
+
+    def use_store(self, store):
+        """多进程部署：请求与提交经状态存储在各 worker 间共享，请求ID加上本进程的前缀以免重复"""
+        self.store = store
+        self._prefix = uuid.uuid4().hex[:6] + "-"
+
+    def request(self, player_idx: int, prompt_type: str, prompt: Dict[str, Any],
+                timeout: Optional[float] = None, game: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """登记一个输入请求并等待玩家提交，超时返回 None，被取消时抛出 InputCancelled；game 为对局ID"""
+        request_id = f"{player_idx}-{self._prefix}{next(self._ids)}"
+        info = {
+            "id": request_id,
+            "game": game,
+            "player_idx": player_idx,
+            "prompt_type": prompt_type,
+            "hint": HINTS.get(prompt_type, "请输入"),
+            "context": {key: prompt[key] for key in CONTEXT_KEYS if key in prompt},
+        }
+        entry = {"info": info, "event": threading.Event(), "response": None, "cancelled": False}
+        with self._lock:
+            self._pending[request_id] = entry
+        if self.store is not None:
+            # 登记的 worker 崩溃时请求留在存储中，超过时限后不再返回
+            expires = None if timeout is None else time.time() + timeout
+            self.store.hset("human", request_id, {**info, "expires": expires})
+        logger.info(f"等待{player_idx}号人类玩家输入（{prompt_type}）")
+        self._publish(player_idx, {"type": "request", "request": info})
+
+        if self.store is None:
+            entry["event"].wait(timeout)
+        else:
+            self._wait_store(entry, timeout)
+        with self._lock:
+            self._pending.pop(request_id, None)
+        if entry["cancelled"]:
+            logger.info(f"{player_idx}号人类玩家的输入请求已取消（{prompt_type}）")
+            raise InputCancelled(request_id)
+        if entry["response"] is None:
+            logger.warning(f"{player_idx}号人类玩家未在时限内输入（{prompt_type}）")
+            self._publish(player_idx, {"type": "closed", "id": request_id})
+        return entry["response"]
+
+    def _wait_store(self, entry: Dict[str, Any], timeout: Optional[float]):
+        """等待本进程或其它 worker 收到的提交"""
+        request_id = entry["info"]["id"]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not entry["event"].wait(POLL_INTERVAL):
+                response = self.store.hget("human_input", request_id)
+                if response is not None:
+                    entry["response"] = response
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        finally:
+            self.store.hdel("human", request_id)
+            self.store.hdel("human_input", request_id)
+
+    def pending(self, player_idx: Optional[int] = None, game: Optional[str] = None) -> List[Dict[str, Any]]:
+        if self.store is not None:
+            submitted = self.store.hgetall("human_input")
+            now = time.time()
+            infos = [info for request_id, info in self.store.hgetall("human").items()
+                     if request_id not in submitted and (info.get("expires") is None or info["expires"] > now)]
+        else:
+            with self._lock:
+                infos = [dict(entry["info"]) for entry in self._pending.values()]
+        return [info for info in infos
+                if (player_idx is None or info["player_idx"] == player_idx) and (game is None or info["game"] == game)]
+
+    def is_pending(self, request_id: str) -> bool:
+        if self.store is not None:
+            return self.store.hget("human", request_id) is not None and self.store.hget("human_input", request_id) is None
+        with self._lock:
+            return request_id in self._pending
+
+    def submit(self, request_id: str, text: str) -> Dict[str, Any]:
+        """提交玩家输入，返回 {"ok": True} 或 {"ok": False, "error": 原因}"""
+        with self._lock:
+            entry = self._pending.get(request_id)
+        if entry is None:
+            if self.store is not None:
+                return self._submit_store(request_id, text)
+            return {"ok": False, "error": "该输入请求已结束"}
+        try:
+            response = parse_input(entry["info"]["prompt_type"], text)
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        with self._lock:
+            if self._pending.pop(request_id, None) is None:
+                return {"ok": False, "error": "该输入请求已结束"}
+            entry["response"] = response
+        entry["event"].set()
+        self._publish(entry["info"]["player_idx"], {"type": "closed", "id": request_id})
+        return {"ok": True}
+
+    def _submit_store(self, request_id: str, text: str) -> Dict[str, Any]:
+        """提交由其它 worker 登记的请求"""
+        info = self.store.hget("human", request_id)
+        if info is None:
+            return {"ok": False, "error": "该输入请求已结束"}
+        try:
+            response = parse_input(info["prompt_type"], text)
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        if not self.store.hsetnx("human_input", request_id, response):
+            return {"ok": False, "error": "该输入请求已结束"}
+        self._publish(info["player_idx"], {"type": "closed", "id": request_id})
+        return {"ok": True}
+
+    def cancel_all(self, game: Optional[str] = None):
+        """结束某局（不指定则所有对局）等待中的请求（新开一局时调用）"""
+        with self._lock:
+            entries = [entry for entry in self._pending.values() if game is None or entry["info"]["game"] == game]
+            for entry in entries:
+                del self._pending[entry["info"]["id"]]
+                entry["cancelled"] = True
+        for entry in entries:
+            entry["event"].set()
+            self._publish(entry["info"]["player_idx"], {"type": "closed", "id": entry["info"]["id"]})
+
+    def _publish(self, player_idx: int, message: Dict[str, Any]):
+        event_bus.publish(f"human/{player_idx}", message)
+        event_bus.publish("human/all", message)
+
+
+# 全局输入中转
+human_broker = HumanInputBroker()
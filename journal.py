@@ -0,0 +1,143 @@
+"""
+对局检查点日志
+
+对局进行中的状态以事件溯源的方式追加写入 logs/journal_{start_time}.jsonl，每条记录一行 JSON，
+在状态变化后同步写出（不经过异步日志队列），进程崩溃时最多丢失正在写的一行：
+- start: 对局ID
+- seats: 各座位的角色、模型与对冲备用模型（不含 api_key，恢复时按模型名从当前配置中查找）
+- event: 一条历史事件（见 history.event_to_dict）
+- toggle: 昼夜切换
+- wolf_want_kill / vote_result: 一名狼人的刀人意向、一名玩家的白天投票结果；reset_wolf_want_kill / reset_vote_result: 清空
+- begin / complete: 行动的开始（含天数、行动类型与玩家）与完成（见 game.PhaseMachine）
+- decision: 一次采用的决策（玩家、提示词类型与LLM的响应）；forced: 恢复时由未完成行动中的决策转成的指定决策
+
+WerewolfGame.restore(path) 按顺序重放记录即可恢复对局，玩家状态（存活、查验结果、用药情况）全部由事件推出，
+不调用LLM。最后开始的行动尚未完成时，该行动开始之后的记录被丢弃，恢复后重新执行这一行动；
+其间已做出的决策保留为 forced 记录，重新执行时直接采用（见 WerewolfGame.force），不再重发LLM请求。
+
+多进程部署时（见 state_store.py）记录改为追加到外部存储的 journal:{对局ID} 列表（StoreJournal），
+各 worker 用 WerewolfGame.sync() 重放其它 worker 追加的记录。
+"""
+from typing import Any, Dict, List
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def journal_path(game_id: str) -> str:
+    return f'logs/journal_{game_id}.jsonl'
+
+
+class GameJournal:
+    def __init__(self, path: str, records: List[Dict[str, Any]] = None):
+        """records 不为空时以这些记录重写日志（恢复时丢弃未完成行动的记录），否则新建日志"""
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records or []:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, kind: str, **data):
+        line = json.dumps({"t": kind, **data}, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def journal_key(game_id: str) -> str:
+    return f'journal:{game_id}'
+
+
+class StoreJournal:
+    """写入外部状态存储的检查点日志，length 为本进程已写入或已重放的记录数"""
+
+    def __init__(self, store, game_id: str, length: int = 0):
+        self.store = store
+        self.key = journal_key(game_id)
+        self.length = length
+        # 写入时发现中间夹着其它进程的记录（本应持有对局锁），之后需要重新加载整局
+        self.diverged = False
+        self._lock = threading.Lock()
+
+    def write(self, kind: str, **data):
+        with self._lock:
+            length = self.store.append(self.key, [{"t": kind, **data}])
+            if length != self.length + 1:
+                logger.warning(f"检查点 {self.key} 中有其它进程同时写入的记录，将重新加载对局")
+                self.diverged = True
+            self.length = length
+
+    def follow(self, apply) -> int:
+        """把其它进程追加的记录依次交给 apply 重放，返回重放的记录数；重放期间本进程不会写入"""
+        with self._lock:
+            records = self.store.read(self.key, self.length)
+            for record in records:
+                apply(record)
+            self.length += len(records)
+            return len(records)
+
+    def close(self):
+        pass
+
+
+def load_journal(path: str) -> List[Dict[str, Any]]:
+    """
+    读取检查点日志，忽略崩溃时写了一半的最后一行；
+    最后开始的行动没有完成记录时，丢弃它开始之后的全部记录
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            if i < len(lines) - 1 and any(rest.strip() for rest in lines[i + 1:]):
+                raise
+            logger.warning(f"检查点日志 {path} 的最后一行不完整，已忽略")
+    if not records or records[0].get("t") != "start":
+        raise ValueError(f"{path} 不是有效的检查点日志")
+    return drop_unfinished(records)
+
+
+def drop_unfinished(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    最后开始的行动没有完成记录时，丢弃它开始之后的全部记录（崩溃恢复时重新执行这一行动），
+    其中的决策转为 forced 记录追加在末尾，重新执行时直接采用
+    """
+    begin = next((i for i in range(len(records) - 1, -1, -1) if records[i]["t"] == "begin"), None)
+    if begin is not None:
+        seq = records[begin]["seq"]
+        if not any(record["t"] == "complete" and record["seq"] == seq for record in records[begin:]):
+            decisions = [{**record, "t": "forced"} for record in records[begin:] if record["t"] == "decision"]
+            logger.info(f"行动 {seq} 未完成，恢复后重新执行（丢弃 {len(records) - begin} 条记录，"
+                        f"保留 {len(decisions)} 个决策）")
+            records = records[:begin] + decisions
+    return records
+
+
+def records_before(records: List[Dict[str, Any]], seq: int) -> List[Dict[str, Any]]:
+    """行动 seq 开始之前的记录（反事实分支的起点，见 branch.py）"""
+    begin = next((i for i, record in enumerate(records) if record["t"] == "begin" and record["seq"] == seq), None)
+    if begin is None:
+        raise ValueError(f"检查点日志中没有行动 {seq}")
+    return records[:begin]
@@ -0,0 +1,182 @@
+"""
+流式 JSON 增量解析
+
+LLM 以流的形式返回形如 {"thinking": "...", "speak": "..."} 的 JSON，
+JsonFieldExtractor 逐块喂入文本，实时解出指定顶层字符串字段的内容，
+无需等待整段 JSON 结束。顶层对象之前的 ```json 等前缀会被跳过。
+
+JsonCompletionDetector 复用同一个扫描器判断顶层对象是否已结束且包含全部必要字段，
+此时流式请求即可中止，不必等模型在 JSON 之后继续输出多余内容。
+"""
+from typing import Iterable, List, Optional, Tuple
+import re
+
+_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class JsonFieldExtractor:
+    """增量提取顶层对象中某个字符串字段的值"""
+
+    def __init__(self, field):
+        self.field = field
+        self.value = ""          # 目标字段目前已解出的内容
+        self.closed = False      # 顶层对象是否已结束
+        self.keys = []           # 已出现的顶层字段名（按出现顺序）
+        self.end = None          # 顶层对象结束时，结束的右括号之后在该次喂入文本中的位置
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = None      # None / "" (刚读到反斜杠) / "uXXX" (正在读\u转义)
+        self._is_key = False     # 当前字符串是否为顶层字段名
+        self._expect_key = False
+        self._key_buf = []
+        self._current_key = None
+        self._capture = False    # 当前字符串是否为目标字段的值
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> str:
+        """喂入一段文本，返回本次新解出的目标字段内容"""
+        out = []
+        for i, ch in enumerate(chunk):
+            if self.closed:
+                break
+            if self._in_string:
+                self._string_char(ch, out)
+                continue
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._is_key = self._depth == 1 and self._expect_key
+                self._capture = (self._depth == 1 and not self._expect_key
+                                 and self._current_key == self.field)
+                self._key_buf = []
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+                    self.end = i + 1
+            elif self._depth == 1:
+                if ch == ':':
+                    self._expect_key = False
+                elif ch == ',':
+                    self._expect_key = True
+        text = ''.join(out)
+        self.value += text
+        return text
+
+    def _string_char(self, ch, out):
+        if self._escape is not None:
+            if self._escape == "":
+                if ch == 'u':
+                    self._escape = "u"
+                    return
+                decoded = _ESCAPES.get(ch, ch)
+                self._escape = None
+                self._emit(decoded, out)
+                return
+            # \uXXXX
+            self._escape += ch
+            if len(self._escape) == 5:
+                try:
+                    code = int(self._escape[1:], 16)
+                except ValueError:
+                    code = None
+                self._escape = None
+                if code is None:
+                    return
+                if 0xD800 <= code < 0xDC00:
+                    # 代理对的高位，等待低位一起解码
+                    self._high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._high_surrogate = None
+                self._emit(chr(code), out)
+            return
+        if ch == '\\':
+            self._escape = ""
+        elif ch == '"':
+            self._in_string = False
+            if self._is_key:
+                self._current_key = ''.join(self._key_buf)
+                self.keys.append(self._current_key)
+            self._is_key = False
+            self._capture = False
+        else:
+            self._emit(ch, out)
+
+    def _emit(self, text, out):
+        if self._is_key:
+            self._key_buf.append(text)
+        elif self._capture:
+            out.append(text)
+
+
+class JsonCompletionDetector:
+    """检测流式输出的顶层 JSON 对象是否已结束并包含全部 required_fields"""
+
+    def __init__(self, required_fields: Iterable[str]):
+        self.required_fields = list(required_fields)
+        self.complete = False
+        self._scanner = JsonFieldExtractor(None)
+        # <think>...</think> 中的草稿可能含有完整的 JSON，等推理结束后再开始扫描
+        self._head = ""
+        self._in_think = None
+
+    def feed(self, chunk: str) -> Optional[int]:
+        """
+        喂入一段文本，对象尚未完整时返回 None；完整时返回对象在 chunk 中结束的位置，
+        chunk[:位置] 之后的内容是模型在 JSON 之后多余的输出（对象在之前喂入的文本中已结束时可能为 0 或负数）
+        """
+        if self.complete:
+            return 0
+        if self._scanner.closed or not chunk:
+            return None
+        if self._in_think is None:
+            self._head += chunk
+            head = self._head.lstrip()
+            if not head or "<think>".startswith(head):
+                return None
+            self._in_think = head.startswith("<think>")
+            text, self._head = self._head, ""
+        else:
+            text = chunk
+        if self._in_think:
+            self._head += text
+            end = self._head.find("</think>")
+            if end < 0:
+                self._head = self._head[-len("</think>"):]
+                return None
+            self._in_think = False
+            text, self._head = self._head[end + len("</think>"):], ""
+        # 扫描的文本与 chunk 末尾对齐（可能包含之前缓存的开头部分）
+        self._scanner.feed(text)
+        if not self._scanner.closed:
+            return None
+        self.complete = all(field in self._scanner.keys for field in self.required_fields)
+        if not self.complete:
+            return None
+        return len(chunk) - (len(text) - self._scanner.end)
+
+
+_FIELD_PATTERN = re.compile(r'^\s*"([^"]+)"\s*:\s*(\S)', re.MULTILINE)
+
+
+def output_fields(output_format: str) -> List[Tuple[str, bool]]:
+    """解析提示词中 output_format 示例的顶层字段，返回 [(字段名, 是否为文本字段)]"""
+    return [(name, first == '"') for name, first in _FIELD_PATTERN.findall(output_format or "")]
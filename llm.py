@@ -1,26 +1,171 @@
-from openai import OpenAI
-from dashscope import Generation
 from http import HTTPStatus
-from zhipuai import ZhipuAI
 import json
-import dashscope
-import requests
 import http.client
 import re
 import logging
 import socket
+import copy
 import datetime
 import os
+import threading
+import time
+import fnmatch
+from typing import Optional
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from metrics import llm_metrics
+from settings import get_settings
+from human_input import human_broker, InputCancelled
+from json_stream import JsonCompletionDetector
 
 
 logger = logging.getLogger(__name__)
 
+
+# 各提供商的SDK在首次构建对应模型时才导入，启动时只加载实际用到的SDK
+def _openai_client(**kwargs):
+    from openai import OpenAI
+    return OpenAI(**kwargs)
+
+
+# 请求被取消（人类玩家的输入请求被取消、调用方置位了 cancel）时 get_response 返回的原因：行动不再重试，直接采用默认决策
+CANCELLED = "请求已取消"
+
+
+class CallCancelled(Exception):
+    """调用被取消：对冲请求中落败，或超出行动的时间预算"""
+
+
+class CancelToken:
+    """取消标记；父标记被置位时所有子标记一并置位。deadline 为截止时刻（time.monotonic()），子标记沿用父标记的"""
+
+    def __init__(self, parent=None, deadline=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._children = []
+        self.deadline = deadline
+        if parent is not None:
+            if self.deadline is None:
+                self.deadline = parent.deadline
+            parent._add_child(self)
+
+    def _add_child(self, child):
+        with self._lock:
+            self._children.append(child)
+            cancelled = self._event.is_set()
+        if cancelled:
+            child.set()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            children = list(self._children)
+        for child in children:
+            child.set()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def remaining(self):
+        """距截止时刻的秒数，没有截止时刻时为 None"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+
+def _run_in_thread(fn, *args):
+    """在独立线程中运行，返回 Future；不使用线程池，避免无法中止的阻塞调用占满工作线程"""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True, name="llm-hedge").start()
+    return future
+
+
 class BaseLlm():
     def __init__(self, model_name, force_json=False):
         
         self.model_name = model_name
         self.force_json = force_json
         self.timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        # 单次调用的指标（首token耗时、token用量），按线程隔离，避免并发预取互相覆盖
+        self._call_local = threading.local()
+        # 对冲请求使用的备用模型（见 get_response）
+        self.backup = None
+
+    def _reset_call_stats(self):
+        self._call_local.start = time.monotonic()
+        self._call_local.ttft = None
+        self._call_local.prompt_tokens = None
+        self._call_local.completion_tokens = None
+        self._call_local.streamed = False
+        stop_fields = getattr(self._call_local, 'stop_fields', None)
+        self._call_local.detector = JsonCompletionDetector(stop_fields) if stop_fields else None
+        on_delta = getattr(self._call_local, 'on_delta', None)
+        if on_delta:
+            # 新一次尝试开始，通知订阅方丢弃之前收到的片段
+            on_delta(None)
+
+    def _emit_delta(self, text) -> Optional[int]:
+        """
+        流式后端每收到一段内容调用一次；调用已被取消时抛出异常以中止流。
+        输出的 JSON 已包含全部必要字段（见 stop_fields）时返回对象在 text 中结束的位置，
+        后端应截掉之后的多余内容（见 truncate_output），停止读取并关闭流；否则返回 None
+        """
+        cancel = getattr(self._call_local, 'cancel', None)
+        if cancel is not None and cancel.is_set():
+            raise CallCancelled()
+        self._note_first_token()
+        on_delta = getattr(self._call_local, 'on_delta', None)
+        if on_delta and text:
+            self._call_local.streamed = True
+            on_delta(text)
+        detector = getattr(self._call_local, 'detector', None)
+        end = detector.feed(text) if detector is not None else None
+        if end is not None:
+            self._call_local.stopped_early = True
+        return end
+
+    @staticmethod
+    def truncate_output(full_response, content, end):
+        """full_response 以刚收到的 content 结尾，截掉 JSON 对象结束（content 中的 end 处）之后的内容"""
+        return full_response[:len(full_response) - len(content) + end]
+
+    def request_timeout(self, default=None):
+        """
+        本次调用的请求超时：不超过行动剩余的时间预算。取消标记只在流式输出的片段之间检查，
+        非流式请求以此为超时，超出时限后连接随之断开，不会在后台继续生成
+        """
+        cancel = getattr(self._call_local, 'cancel', None)
+        remaining = cancel.remaining() if cancel is not None else None
+        if remaining is None:
+            return default
+        remaining = max(remaining, 1)
+        return remaining if default is None else min(default, remaining)
+
+    def _note_first_token(self):
+        if getattr(self._call_local, 'ttft', None) is None and hasattr(self._call_local, 'start'):
+            self._call_local.ttft = time.monotonic() - self._call_local.start
+
+    def _note_usage(self, prompt_tokens, completion_tokens):
+        if prompt_tokens is not None:
+            self._call_local.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            self._call_local.completion_tokens = completion_tokens
+
+    def _note_openai_usage(self, usage):
+        if usage:
+            self._note_usage(getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
 
     def prepare_messages(self, message, chat_history):
         messages = []
@@ -29,61 +174,92 @@ class BaseLlm():
         messages.append({"role": "user", "content": message})
         return messages
 
-    def openai_like_generate(self, messages, stream=True, extra_body=None, **kwargs):
+    def openai_like_generate(self, messages, stream=True, extra_body=None, with_reasoning=False, **kwargs):
+        """
+        with_reasoning: 同时收集 reasoning_content（DeepSeek-R1、vLLM 推理解析器等），作为第二个返回值
+        """
         try:
             params = {"model": self.model_name, "messages": messages, "stream": stream}
             if extra_body:
                 params["extra_body"] = extra_body
             params.update(kwargs)
+            # 按输出格式估算的长度上限（见 settings.OutputSettings），与模型自身的配置取较小值
+            cap = getattr(self._call_local, 'max_tokens', None)
+            if cap:
+                params["max_tokens"] = min(params.get("max_tokens") or cap, cap)
+            timeout = self.request_timeout()
+            if timeout is not None:
+                params["timeout"] = timeout
             response = self.client.chat.completions.create(**params)
             if stream:
                 full_response = ""
-                for chunk in response:
-                    if chunk.choices and hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_response += content
-                        print(content, end="", flush=True)
-                return full_response, None
+                reasoning = ""
+                try:
+                    for chunk in response:
+                        if with_reasoning and chunk.choices:
+                            reasoning += getattr(chunk.choices[0].delta, 'reasoning_content', None) or ""
+                        # 部分服务商在最后一个chunk中返回用量
+                        self._note_openai_usage(getattr(chunk, 'usage', None))
+                        if chunk.choices and hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
+                            content = chunk.choices[0].delta.content
+                            full_response += content
+                            end = self._emit_delta(content)
+                            if end is not None:
+                                # JSON 已完整，不再等待模型的多余输出
+                                full_response = self.truncate_output(full_response, content, end)
+                                break
+                finally:
+                    # 提前结束或被取消（_emit_delta 抛出 CallCancelled）时关闭连接，服务端随之停止生成
+                    close = getattr(response, 'close', None)
+                    if close:
+                        close()
+                return full_response, (reasoning or None)
             else:
-                return response.choices[0].message.content, None
+                self._note_openai_usage(getattr(response, 'usage', None))
+                message = response.choices[0].message
+                reasoning = getattr(message, 'reasoning_content', None) if with_reasoning else None
+                return message.content, reasoning
         except Exception as e:
             return None, str(e)
 
     def generate(self, message, chat_history=[]):
         pass
 
-    def get_response(self, message, chat_history=[]):
-        max_retries = 3
-        retry_count = 0
-        print(f" ---  请求LLM {self.model_name} ---")
-        print(message)
-        print("---")
-        
-        while retry_count < max_retries:
-            try:
-                resp, reason = self.generate(message, chat_history)
-                if resp is None:
-                    raise Exception(reason if reason else "未知错误")
-                break
-            except Exception as e:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    logger.error(f"在尝试{max_retries}次后仍然失败。错误: {str(e)}")
-                    resp = None
-                    reason = str(e)
-                    break
-                logger.warning(f"发生错误: {str(e)}。正在进行第{retry_count}次重试...")
-                import time
-                time.sleep(retry_count * 2)  # 指数退避
-        
-        if reason:
-            print(" --- 推理内容 ---")
-            print(reason)
-            print("-------")
-        
-        print(" --- LLM 响应 ---")
-        print(resp)
-        print("-------")
+    def hedge_deadline(self, hedging):
+        """对冲等待时间：本模型近期成功调用耗时的分位数（样本不足时用默认值），限制在上下限之间"""
+        deadline = llm_metrics.latency_quantile(self.model_name, hedging.quantile, hedging.min_samples)
+        if deadline is None:
+            deadline = hedging.default_deadline
+        return min(max(deadline, hedging.min_deadline), hedging.max_deadline)
+
+    def get_response(self, message, chat_history=[], tags=None, on_delta=None, deadline=None,
+                     stop_fields=None, max_tokens=None, cancel=None):
+        '''
+        tags: 指标标签，如 {"game": ..., "player": ..., "role": ..., "prompt_type": ...}
+        on_delta: 可选回调，流式后端每收到一段原始文本调用 on_delta(text)；
+                  每次(重)试开始时调用 on_delta(None)；非流式后端在成功后一次性回调完整文本
+        deadline: 可选截止时刻（time.monotonic()），到期仍未返回时取消进行中的请求并返回 (None, "超时")
+        配置了备用模型（self.backup）且开启对冲时，主模型超过截止时间仍未返回或最终失败，
+        会向备用模型发出同样的请求，先返回有效结果的一方胜出，另一方被取消
+        stop_fields: 提示词的 required_fields；流式输出的顶层 JSON 对象结束且包含这些字段后立即中止请求
+        max_tokens: 本次调用的输出长度上限（OpenAI 兼容后端），与模型自身的配置取较小值
+        cancel: 可选取消标记（CancelToken），置位后进行中的请求在下一个片段处中止，返回 (None, CANCELLED)
+        '''
+        if deadline is None:
+            resp, reason = self._respond(message, chat_history, tags, on_delta, cancel, stop_fields, max_tokens)
+        else:
+            token = CancelToken(cancel, deadline=deadline)
+            future = _run_in_thread(self._respond, message, chat_history, tags, on_delta, token,
+                                    stop_fields, max_tokens)
+            done, _ = wait([future], timeout=max(deadline - time.monotonic(), 0))
+            if done:
+                resp, reason = future.result()
+            else:
+                token.set()
+                logger.warning(f"LLM {self.model_name} 超过行动时限未返回，已取消请求")
+                resp, reason = None, "超时"
+        if cancel is not None and cancel.is_set():
+            return None, CANCELLED
 
         if self.force_json:
             resp_dict = None
@@ -107,7 +283,132 @@ class BaseLlm():
             finally:
                 return resp_dict, reason
         return resp, reason
-    
+
+    def _respond(self, message, chat_history, tags, on_delta, cancel=None, stop_fields=None, max_tokens=None):
+        hedging = get_settings().hedging
+        if self.backup is not None and hedging.enabled:
+            return self._hedged_call(message, chat_history, tags, on_delta, hedging, cancel, stop_fields, max_tokens)
+        return self._call(message, chat_history, tags, on_delta, cancel, stop_fields, max_tokens)
+
+    def _call(self, message, chat_history=[], tags=None, on_delta=None, cancel=None, stop_fields=None, max_tokens=None):
+        """带重试的单模型调用，返回原始 (resp, reason)；cancel 被置位后流式输出在下一个片段处中止"""
+        max_retries = 3
+        retry_count = 0
+        logger.info(f"请求LLM {self.model_name}")
+        logger.debug(f"请求内容:\n{message}")
+
+        call_start = time.monotonic()
+        self._call_local.on_delta = on_delta
+        self._call_local.cancel = cancel
+        self._call_local.stop_fields = stop_fields
+        self._call_local.max_tokens = max_tokens
+        self._call_local.stopped_early = False
+        while retry_count < max_retries:
+            try:
+                self._reset_call_stats()
+                resp, reason = self.generate(message, chat_history)
+                if resp is None:
+                    raise Exception(reason if reason else "未知错误")
+                break
+            except Exception as e:
+                if cancel is not None and cancel.is_set():
+                    resp, reason = None, "已取消"
+                    break
+                retry_count += 1
+                if retry_count >= max_retries:
+                    logger.error(f"在尝试{max_retries}次后仍然失败。错误: {str(e)}")
+                    resp = None
+                    reason = str(e)
+                    break
+                logger.warning(f"发生错误: {str(e)}。正在进行第{retry_count}次重试...")
+                # 指数退避，被取消时立即结束等待
+                if cancel is not None:
+                    cancel.wait(retry_count * 2)
+                else:
+                    time.sleep(retry_count * 2)
+
+        cancelled = cancel is not None and cancel.is_set()
+        if on_delta and resp is not None and not cancelled and not getattr(self._call_local, 'streamed', False):
+            on_delta(resp)
+        self._call_local.on_delta = None
+        self._call_local.cancel = None
+        self._call_local.stop_fields = None
+        self._call_local.max_tokens = None
+
+        if reason:
+            logger.debug(f"推理内容:\n{reason}")
+        logger.debug(f"LLM {self.model_name} 响应:\n{resp}")
+
+        record = dict(tags or {})
+        record.update({
+            "model": self.model_name,
+            "latency": time.monotonic() - call_start,
+            "ttft": getattr(self._call_local, 'ttft', None),
+            "prompt_tokens": getattr(self._call_local, 'prompt_tokens', None),
+            "completion_tokens": getattr(self._call_local, 'completion_tokens', None),
+            "retries": min(retry_count, max_retries - 1),
+            "ok": resp is not None,
+            "cancelled": cancelled,
+            "stopped_early": getattr(self._call_local, 'stopped_early', False)
+        })
+        llm_metrics.record(record)
+        return resp, reason
+
+    def _hedged_call(self, message, chat_history, tags, on_delta, hedging, cancel=None,
+                     stop_fields=None, max_tokens=None):
+        backup = self.backup
+        deadline = self.hedge_deadline(hedging)
+        primary_cancel = CancelToken(cancel)
+        backup_cancel = CancelToken(cancel)
+        winner = {"name": None}
+
+        def primary_delta(text):
+            # 备用模型胜出后不再转发主模型的片段
+            if winner["name"] in (None, "primary"):
+                on_delta(text)
+
+        primary = _run_in_thread(self._call, message, chat_history, tags,
+                                 primary_delta if on_delta else None, primary_cancel, stop_fields, max_tokens)
+        done, _ = wait([primary], timeout=deadline)
+        if done and primary.result()[0] is not None:
+            return primary.result()
+        if cancel is not None and cancel.is_set():
+            return None, "已取消"
+
+        if done:
+            logger.warning(f"{self.model_name} 调用失败，改用备用模型 {backup.model_name}")
+        else:
+            logger.warning(f"{self.model_name} 超过 {deadline:.1f} 秒未返回，向备用模型 {backup.model_name} 发出对冲请求")
+        llm_metrics.record_hedge(self.model_name, backup.model_name, "fired")
+        backup_future = _run_in_thread(backup._call, message, chat_history, tags, None, backup_cancel,
+                                       stop_fields, max_tokens)
+
+        pending = {backup_future} if done else {primary, backup_future}
+        result = (None, None)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                resp, reason = future.result()
+                if resp is not None and winner["name"] is None:
+                    winner["name"] = "primary" if future is primary else "backup"
+                    result = (resp, reason)
+                elif result[0] is None:
+                    result = (None, reason)
+            if winner["name"]:
+                break
+
+        if winner["name"] == "backup":
+            primary_cancel.set()
+            if on_delta:
+                on_delta(None)
+                on_delta(result[0])
+        elif winner["name"] == "primary":
+            backup_cancel.set()
+        llm_metrics.record_hedge(self.model_name, backup.model_name,
+                                 f"{winner['name']}_won" if winner["name"] else "both_failed")
+        return result
+
+
 class M302Llm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False, timeout=30):
         super().__init__(model_name, force_json)
@@ -122,7 +423,7 @@ class M302Llm(BaseLlm):
             "messages": messages
         })
         try:
-            conn = http.client.HTTPSConnection("api.302.ai", timeout=self.timeout)  
+            conn = http.client.HTTPSConnection("api.302.ai", timeout=self.request_timeout(self.timeout))  
             headers = {
                 'Accept': 'application/json',
                 'Authorization': 'Bearer ' + self.api_key,
@@ -132,6 +433,8 @@ class M302Llm(BaseLlm):
             res = conn.getresponse()
             data = res.read().decode("utf-8")
             response = json.loads(data)
+            usage = response.get("usage") or {}
+            self._note_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
             content = response["choices"][0]["message"]["content"]
             # 提取推理内容
             reasoning_patterns = [
@@ -171,7 +474,7 @@ class DeepSeekLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key, base_url="https://api.deepseek.com", timeout=1800)
+        self.client = _openai_client(api_key=self.api_key, base_url="https://api.deepseek.com", timeout=1800)
 
     def generate(self, message, chat_history=[]):
         messages = self.prepare_messages(message, chat_history)
@@ -182,9 +485,11 @@ class QwenLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
+        import dashscope
         dashscope.api_key = self.api_key
 
     def generate(self, message, chat_history=[]):
+        from dashscope import Generation
         messages = self.prepare_messages(message, chat_history)
         response = Generation.call(
             self.model_name,
@@ -195,12 +500,25 @@ class QwenLlm(BaseLlm):
         )
 
         full_response = ""
-        for partial_response in response:
-            if partial_response.status_code == HTTPStatus.OK:
-                content = partial_response.output.choices[0]['message']['content']
-                full_response += content
-            else:
-                print(f'请求 ID: {partial_response.request_id}, 状态码: {partial_response.status_code}, 错误代码: {partial_response.code}, 错误信息: {partial_response.message}')
+        try:
+            for partial_response in response:
+                if partial_response.status_code == HTTPStatus.OK:
+                    content = partial_response.output.choices[0]['message']['content']
+                    full_response += content
+                    usage = getattr(partial_response, 'usage', None)
+                    if usage:
+                        self._note_usage(usage.get('input_tokens'), usage.get('output_tokens'))
+                    end = self._emit_delta(content) if content else None
+                    if end is not None:
+                        full_response = self.truncate_output(full_response, content, end)
+                        break
+                else:
+                    logger.error(f'请求 ID: {partial_response.request_id}, 状态码: {partial_response.status_code}, 错误代码: {partial_response.code}, 错误信息: {partial_response.message}')
+        finally:
+            # 提前结束或被取消时关闭流
+            close = getattr(response, 'close', None)
+            if close:
+                close()
         return full_response, None
 
 class BaichuanLlm(BaseLlm):
@@ -223,10 +541,13 @@ class BaichuanLlm(BaseLlm):
             "top_p": 0.9
         }
 
-        response = requests.post(self.api_url, headers=headers, json=data, timeout=30)
+        import requests
+        response = requests.post(self.api_url, headers=headers, json=data, timeout=self.request_timeout(30))
 
         if response.status_code == 200:
             result = response.json()
+            usage = result.get('usage') or {}
+            self._note_usage(usage.get('prompt_tokens'), usage.get('completion_tokens'))
             return result['choices'][0]['message']['content'], None
         else:
             raise Exception(f"请求失败: {response.status_code}, {response.text}")
@@ -236,6 +557,7 @@ class ZhipuLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
+        from zhipuai import ZhipuAI
         self.client = ZhipuAI(api_key=self.api_key)
 
     def generate(self, message, chat_history=[]):
@@ -247,7 +569,7 @@ class KimiLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key, base_url="https://api.moonshot.cn/v1", timeout=1800)
+        self.client = _openai_client(api_key=self.api_key, base_url="https://api.moonshot.cn/v1", timeout=1800)
 
     def generate(self, message, chat_history=[]):
         messages = self.prepare_messages(message, chat_history)
@@ -258,7 +580,7 @@ class DouBaoLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(
+        self.client = _openai_client(
                 base_url='https://ark.cn-beijing.volces.com/api/v3/',
                 api_key=self.api_key
             )
@@ -272,7 +594,7 @@ class HunyuanLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(
+        self.client = _openai_client(
             api_key=self.api_key,
             base_url="https://api.hunyuan.cloud.tencent.com/v1",
             timeout=1800
@@ -287,7 +609,7 @@ class SiliconReasoner(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         
-        self.client = OpenAI(
+        self.client = _openai_client(
                 base_url='https://api.siliconflow.cn/v1/',
                 api_key=api_key,
                 timeout=1800
@@ -299,10 +621,21 @@ class SiliconReasoner(BaseLlm):
 
 
 class HumanLlm(BaseLlm):
+    """人类玩家：把行动请求交给 human_broker，等待浏览器提交输入（见 human_input.py）"""
     def __init__(self, model_name):
         super().__init__(model_name)
-        pass
-    
+
+    def get_response(self, message, chat_history=[], tags=None, on_delta=None, deadline=None,
+                     stop_fields=None, max_tokens=None, cancel=None):
+        tags = tags or {}
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            resp = human_broker.request(tags.get("player"), tags.get("prompt_type"), json.loads(message), timeout,
+                                        game=tags.get("game"))
+        except InputCancelled:
+            return None, CANCELLED
+        return resp, None
+
     def generate(self, message, chat_history=[]):
         pass
 
@@ -312,15 +645,50 @@ class OpenAILlm(BaseLlm):
         self.api_key = api_key
         # 如果提供了自定义base_url，使用它；否则使用默认的OpenAI API地址
         if base_url:
-            self.client = OpenAI(api_key=self.api_key, base_url=base_url, timeout=1800)
+            self.client = _openai_client(api_key=self.api_key, base_url=base_url, timeout=1800)
         else:
-            self.client = OpenAI(api_key=self.api_key, timeout=1800)
+            self.client = _openai_client(api_key=self.api_key, timeout=1800)
 
     def generate(self, message, chat_history=[]):
         messages = self.prepare_messages(message, chat_history)
         return self.openai_like_generate(messages, stream=True)
 
 
+class OpenAICompatibleLlm(BaseLlm):
+    """
+    任意兼容 OpenAI Chat Completions 接口的服务（vLLM、llama.cpp server、各类代理等），
+    连接参数与生成参数由路由表（config.json 的 model_routes）给出
+    """
+    def __init__(self, model_name, api_key, force_json=False, base_url=None, upstream_model=None,
+                 timeout=None, temperature=None, stream=True, reasoning=False, reasoning_effort=None,
+                 max_tokens=None, extra_body=None):
+        super().__init__(model_name, force_json)
+        self.api_key = api_key
+        self.upstream_model = upstream_model or model_name
+        self.temperature = temperature
+        self.stream = stream
+        self.reasoning = reasoning
+        self.reasoning_effort = reasoning_effort
+        self.max_tokens = max_tokens
+        self.extra_body = extra_body
+        # 兼容把完整接口地址写进 base_url 的配置
+        if base_url and base_url.rstrip('/').endswith('/chat/completions'):
+            base_url = base_url.rstrip('/')[:-len('/chat/completions')]
+        self.client = _openai_client(api_key=api_key or "EMPTY", base_url=base_url or None, timeout=timeout or 1800)
+
+    def generate(self, message, chat_history=[]):
+        messages = self.prepare_messages(message, chat_history)
+        kwargs = {"model": self.upstream_model}
+        if self.temperature is not None:
+            kwargs["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            kwargs["max_tokens"] = self.max_tokens
+        if self.reasoning_effort:
+            kwargs["reasoning_effort"] = self.reasoning_effort
+        return self.openai_like_generate(messages, stream=self.stream, extra_body=self.extra_body,
+                                         with_reasoning=self.reasoning, **kwargs)
+
+
 M302LLM_SUPPORTED_MODELS = [
     "m302/o3-mini",
     "m302/o3-mini-2025-01-31",
@@ -367,7 +735,7 @@ class XAiLlm(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(
+        self.client = _openai_client(
             api_key=self.api_key,
             base_url="https://api.x.ai/v1",
             timeout=1800
@@ -382,7 +750,7 @@ class XAIReason(BaseLlm):
     def __init__(self, model_name, api_key, force_json=False):
         super().__init__(model_name, force_json)
         self.api_key = api_key
-        self.client = OpenAI(
+        self.client = _openai_client(
             api_key=self.api_key,
             base_url="https://api.x.ai/v1",
             timeout=1800
@@ -396,9 +764,11 @@ class XAIReason(BaseLlm):
                 messages=messages,
                 reasoning_effort="high",
                 stream=False,
-                temperature=0.7
+                temperature=0.7,
+                timeout=self.request_timeout()
             )
             
+            self._note_openai_usage(getattr(response, 'usage', None))
             # 获取主要响应内容
             content = response.choices[0].message.content
             
@@ -406,9 +776,7 @@ class XAIReason(BaseLlm):
             reasoning_content = None
             if hasattr(response.choices[0].message, 'reasoning_content'):
                 reasoning_content = response.choices[0].message.reasoning_content
-                print("\n--- 推理过程 ---")
-                print(reasoning_content)
-                print("---------------")
+                logger.debug(f"推理过程:\n{reasoning_content}")
             
             return content, reasoning_content
         except Exception as e:
@@ -420,7 +788,7 @@ class OpenRouterLlm(BaseLlm):
         if model_name.startswith("openrouter/"):
             model_name = model_name[11:]
         super().__init__(model_name, force_json)
-        self.client = OpenAI(
+        self.client = _openai_client(
             api_key=api_key, 
             base_url="https://openrouter.ai/api/v1", 
             timeout=1800)
@@ -430,34 +798,150 @@ class OpenRouterLlm(BaseLlm):
         return self.openai_like_generate(messages, stream=True)
     
 
+# 内置路由：模型名 -> 提供商类；火山方舟的接入点统一以 ep- 开头
+MODEL_PROVIDERS = {}
+PREFIX_PROVIDERS = [("ep-", DouBaoLlm)]
+
+
+def register_models(provider, model_names):
+    for name in model_names:
+        MODEL_PROVIDERS[name] = provider
+
+
+register_models(M302Llm, M302LLM_SUPPORTED_MODELS)
+register_models(SiliconReasoner, SILICONFLOW_SUPPORTED_MODELS)
+register_models(DeepSeekLlm, ["deepseek-reasoner", "deepseek-chat"])
+register_models(QwenLlm, ["qwen-max", "qwen-max-longcontext", "qwen-plus", "qwen-long", "qwen-max-2025-01-25"])
+register_models(BaichuanLlm, ["Baichuan4", "Baichuan3-Turbo", "Baichuan3-Turbo-128k", "Baichuan2-Turbo", "Baichuan2-Turbo-192k"])
+register_models(ZhipuLlm, ["glm-3-turbo", "glm-4", "glm-4v", "glm-4-plus"])
+register_models(KimiLlm, ["moonshot-v1-32k"])
+register_models(HunyuanLlm, ["hunyuan-large", "hunyuan-turbo-latest"])
+register_models(XAiLlm, XAI_SUPPORTED_MODELS)
+register_models(XAIReason, XAIREASON_SUPPORTED_MODELS)
+register_models(OpenAILlm, OPENAI_SUPPORTED_MODELS)
+register_models(OpenRouterLlm, OPENROUTER_SUPPORTED_MODELS)
+
+# 路由表中 provider 字段可用的名称
+PROVIDER_NAMES = {
+    "openai_compatible": OpenAICompatibleLlm,
+    "openai": OpenAILlm,
+    "m302": M302Llm,
+    "siliconflow": SiliconReasoner,
+    "deepseek": DeepSeekLlm,
+    "qwen": QwenLlm,
+    "baichuan": BaichuanLlm,
+    "zhipu": ZhipuLlm,
+    "kimi": KimiLlm,
+    "doubao": DouBaoLlm,
+    "hunyuan": HunyuanLlm,
+    "xai": XAiLlm,
+    "xai_reason": XAIReason,
+    "openrouter": OpenRouterLlm,
+}
+
+
+def find_provider(model_name):
+    provider = MODEL_PROVIDERS.get(model_name)
+    if provider is None:
+        provider = next((p for prefix, p in PREFIX_PROVIDERS if model_name.startswith(prefix)), None)
+    return provider
+
+
+class ModelRouter:
+    """
+    模型路由表（config.json 的 model_routes），按顺序匹配，优先于内置路由：
+    - match 不含通配符时为精确匹配（字典查找）
+    - 只在末尾有一个 * 时为前缀匹配，其余情况按 glob 匹配（fnmatch）
+    每个模型名的匹配结果会缓存，配置热加载后缓存随之失效
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = None
+        self._exact = {}
+        self._patterns = []
+        self._cache = {}
+
+    def _rebuild(self, settings):
+        exact, patterns = {}, []
+        for route in settings.model_routes:
+            if not any(ch in route.match for ch in '*?['):
+                exact.setdefault(route.match, route)
+            elif route.match.endswith('*') and not any(ch in route.match[:-1] for ch in '*?['):
+                prefix = route.match[:-1]
+                patterns.append((lambda name, prefix=prefix: name.startswith(prefix), route))
+            else:
+                patterns.append((lambda name, pattern=route.match: fnmatch.fnmatchcase(name, pattern), route))
+        self._exact, self._patterns, self._cache = exact, patterns, {}
+        self._settings = settings
+
+    def route(self, model_name):
+        """返回匹配的路由配置，没有匹配时返回 None"""
+        settings = get_settings()
+        with self._lock:
+            if settings is not self._settings:
+                self._rebuild(settings)
+            if model_name in self._cache:
+                return self._cache[model_name]
+            route = self._exact.get(model_name)
+            if route is None:
+                route = next((r for matches, r in self._patterns if matches(model_name)), None)
+            self._cache[model_name] = route
+            return route
+
+
+model_router = ModelRouter()
+
+
+def _build_from_route(route, model_name, api_key, force_json, base_url):
+    provider = PROVIDER_NAMES.get(route.provider)
+    if provider is None:
+        raise ValueError(f"路由 {route.match} 的提供商未知: {route.provider}")
+    api_key = api_key or route.api_key or (os.getenv(route.api_key_env) if route.api_key_env else None) or ""
+    base_url = route.base_url or base_url
+    if provider is OpenAICompatibleLlm:
+        upstream_model = route.model
+        if upstream_model is None and route.strip_prefix and model_name.startswith(route.strip_prefix):
+            upstream_model = model_name[len(route.strip_prefix):]
+        return OpenAICompatibleLlm(
+            model_name, api_key, force_json, base_url=base_url, upstream_model=upstream_model,
+            timeout=route.timeout, temperature=route.temperature, stream=route.stream,
+            reasoning=route.reasoning, reasoning_effort=route.reasoning_effort,
+            max_tokens=route.max_tokens, extra_body=route.extra_body
+        )
+    if provider is OpenAILlm:
+        return OpenAILlm(model_name, api_key, force_json, base_url)
+    return provider(model_name, api_key, force_json)
+
+
 def BuildModel(model_name, api_key, force_json=False, base_url=None):
-    if model_name in M302LLM_SUPPORTED_MODELS:
-        return M302Llm(model_name, api_key, force_json)
-    elif model_name in SILICONFLOW_SUPPORTED_MODELS:
-        return SiliconReasoner(model_name, api_key, force_json)
-    elif model_name in ["deepseek-reasoner", "deepseek-chat"]:
-        return DeepSeekLlm(model_name, api_key, force_json)
-    elif model_name in ["qwen-max", "qwen-max-longcontext", "qwen-plus", "qwen-long", "qwen-max-2025-01-25"]:
-        return QwenLlm(model_name, api_key, force_json)
-    elif model_name in ["Baichuan4", "Baichuan3-Turbo", "Baichuan3-Turbo-128k", "Baichuan2-Turbo", "Baichuan2-Turbo-192k"]:
-        return BaichuanLlm(model_name, api_key, force_json)
-    elif model_name in ["glm-3-turbo", "glm-4", "glm-4v", "glm-4-plus"]:
-        return ZhipuLlm(model_name, api_key, force_json)
-    elif model_name in ["moonshot-v1-32k"]:
-        return KimiLlm(model_name, api_key, force_json)
-    elif model_name.startswith("ep-"):
-        return DouBaoLlm(model_name, api_key, force_json)
-    elif model_name in ["hunyuan-large", "hunyuan-turbo-latest"]:
-        return HunyuanLlm(model_name, api_key, force_json)
-    elif model_name == "human":
+    if model_name == "human":
         return HumanLlm(model_name)
-    elif model_name in XAI_SUPPORTED_MODELS:
-        return XAiLlm(model_name, api_key, force_json)
-    elif model_name in XAIREASON_SUPPORTED_MODELS:
-        return XAIReason(model_name, api_key, force_json)
-    elif model_name in OPENAI_SUPPORTED_MODELS:
+    route = model_router.route(model_name)
+    if route is not None:
+        return _build_from_route(route, model_name, api_key, force_json, base_url)
+    provider = find_provider(model_name)
+    if provider is OpenAILlm:
         return OpenAILlm(model_name, api_key, force_json, base_url)
-    elif model_name in OPENROUTER_SUPPORTED_MODELS:
-        return OpenRouterLlm(model_name, api_key, force_json)
-    else:
-        raise ValueError("未知的模型名称:", model_name)
\ No newline at end of file
+    if provider is not None:
+        return provider(model_name, api_key, force_json)
+    # 未知模型：玩家配置了 base_url 时按 OpenAI 兼容接口访问
+    if base_url:
+        return OpenAICompatibleLlm(model_name, api_key, force_json, base_url=base_url)
+    raise ValueError("未知的模型名称:", model_name)
+
+
+def derive_model(model, overrides):
+    """
+    复制一个模型对象并覆盖生成参数（reasoning_effort、temperature、max_tokens），用于模型档位；
+    只有 OpenAI 兼容路由的模型支持这些参数，其它模型忽略并记录警告
+    """
+    if not overrides:
+        return model
+    derived = copy.copy(model)
+    derived._call_local = threading.local()
+    for key, value in overrides.items():
+        if hasattr(derived, key):
+            setattr(derived, key, value)
+        else:
+            logger.warning(f"模型 {model.model_name} 不支持参数 {key}，已忽略")
+    return derived
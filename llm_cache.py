@@ -0,0 +1,81 @@
+"""
+多进程共享的LLM响应缓存
+
+反事实分支（见 branch.py）从同一局面出发，分歧之前各分支的提示词完全相同。SharedLlmCache 以
+(模型名, 档位, 提示词) 的哈希为键，把响应保存在 SQLite 文件中（WAL 模式，多个工作进程同时读写）：
+- 已有响应时直接返回，不调用模型
+- 还没有时先写入一条占位记录再请求模型，其它进程遇到占位记录就等待结果，同一提示词只请求一次
+- 请求失败时删除占位记录，等待中的进程随后自行请求；占位超过 claim_timeout 秒视为持有进程已退出
+"""
+from typing import Callable, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2
+
+
+class SharedLlmCache:
+    def __init__(self, path: str, claim_timeout: float = 1800.0):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS llm_cache ("
+                     "key TEXT PRIMARY KEY, response TEXT, reasoning TEXT, claimed_at REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return conn
+
+    @staticmethod
+    def key(model_name: str, tier: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model_name}\n{tier}\n{prompt}".encode('utf-8')).hexdigest()
+
+    def get_or_call(self, key: str, call: Callable[[], Tuple[Optional[dict], Optional[str]]]):
+        """返回 (响应, 推理过程)；缓存未命中时由 call() 请求模型，只缓存成功的响应"""
+        conn = self._conn()
+        while True:
+            row = conn.execute("SELECT response, reasoning, claimed_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] is not None:
+                self.hits += 1
+                return json.loads(row[0]), row[1]
+            now = time.time()
+            if row is None:
+                claimed = conn.execute("INSERT OR IGNORE INTO llm_cache (key, claimed_at) VALUES (?, ?)",
+                                       (key, now)).rowcount == 1
+            elif now - row[2] > self.claim_timeout:
+                claimed = conn.execute("UPDATE llm_cache SET claimed_at = ? WHERE key = ? AND response IS NULL "
+                                       "AND claimed_at = ?", (now, key, row[2])).rowcount == 1
+            else:
+                claimed = False
+            if claimed:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        self.misses += 1
+        try:
+            resp, reasoning = call()
+        except BaseException:
+            conn.execute("DELETE FROM llm_cache WHERE key = ? AND response IS NULL", (key,))
+            raise
+        if resp is None:
+            conn.execute("DELETE FROM llm_cache WHERE key = ? AND response IS NULL", (key,))
+        else:
+            conn.execute("UPDATE llm_cache SET response = ?, reasoning = ? WHERE key = ?",
+                         (json.dumps(resp, ensure_ascii=False), reasoning, key))
+        return resp, reasoning
@@ -1,8 +1,190 @@
 from colorama import Fore, Back, Style, init
+import logging
+import logging.handlers
+import queue
+import threading
+import atexit
+import os
 
 # 初始化 colorama
 init(autoreset=True)
 
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+# 对局日志（result_*.txt / llm_*.txt）使用的logger，记录通过 extra={"game_file": 路径} 指定写入的文件
+game_logger = logging.getLogger('wolf.game')
+game_logger.setLevel(logging.INFO)
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class GameFileHandler(logging.Handler):
+    """按 record.game_file 分发到对应文件，每个文件只打开一次，运行在后台写线程中"""
+    def __init__(self):
+        super().__init__()
+        self._files = {}
+
+    def emit(self, record):
+        try:
+            path = record.game_file
+            f = self._files.get(path)
+            if f is None:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                f = self._files[path] = open(path, 'a', encoding='utf-8')
+            f.write(record.getMessage())
+            f.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close_file(self, path):
+        f = self._files.pop(path, None)
+        if f:
+            f.close()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        super().close()
+
+
+class _GameFileFilter(logging.Filter):
+    def __init__(self, want_game_file):
+        super().__init__()
+        self.want_game_file = want_game_file
+
+    def filter(self, record):
+        return hasattr(record, 'game_file') == self.want_game_file
+
+
+class _CloseFile(logging.LogRecord):
+    """通知后台写线程关闭某个对局文件"""
+
+
+class _GameQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 对局日志内容原样写入，不需要格式化
+        if hasattr(record, 'game_file'):
+            return record
+        return super().prepare(record)
+
+
+class _GameQueueListener(logging.handlers.QueueListener):
+    def __init__(self, q, file_handler, *handlers):
+        super().__init__(q, file_handler, *handlers, respect_handler_level=True)
+        self.file_handler = file_handler
+
+    def handle(self, record):
+        if isinstance(record, _CloseFile):
+            self.file_handler.close_file(record.game_file)
+            return
+        super().handle(record)
+
+
+def _load_log_level():
+    level = os.getenv('WOLF_LOG_LEVEL')
+    if level:
+        return level
+    try:
+        from settings import get_settings
+        return get_settings().log_level
+    except Exception:
+        return 'INFO'
+
+
+def setup_logging(level=None):
+    """
+    初始化异步日志：所有日志先进入队列，由后台线程写控制台和对局日志文件。
+    level 为控制台日志级别（DEBUG 会输出完整的提示词和响应），默认读取 config.json 的 log_level。
+    可重复调用，仅首次生效。
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        if level is None:
+            level = _load_log_level()
+        level = logging.getLevelName(str(level).upper()) if isinstance(level, str) else level
+        if not isinstance(level, int):
+            level = logging.INFO
+
+        console = logging.StreamHandler()
+        console.setLevel(level)
+        console.setFormatter(logging.Formatter(LOG_FORMAT))
+        console.addFilter(_GameFileFilter(False))
+
+        file_handler = GameFileHandler()
+        file_handler.addFilter(_GameFileFilter(True))
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_GameQueueHandler(log_queue))
+        root.setLevel(min(level, logging.INFO))
+
+        _listener = _GameQueueListener(log_queue, file_handler, console)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台写线程，写完队列中剩余日志并关闭文件"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener.file_handler.close()
+        _listener = None
+
+
+def write_game_log(path, text):
+    """异步追加写入对局日志文件（text 需自带换行）"""
+    if _listener is None:
+        setup_logging()
+    game_logger.info(text, extra={'game_file': path})
+
+
+class GameLogBuffer:
+    """
+    收集一段对局日志，退出 with 时作为一条记录交给后台线程写入，用法与文件对象一致：
+        with game_log(path) as log_file:
+            log_file.write("...\\n")
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.parts:
+            write_game_log(self.path, ''.join(self.parts))
+            self.parts = []
+        return False
+
+
+def game_log(path):
+    return GameLogBuffer(path)
+
+
+def close_game_log(path):
+    """对局结束后关闭对应的文件句柄"""
+    if _listener is None:
+        return
+    record = _CloseFile('wolf.game', logging.INFO, __file__, 0, '', None, None)
+    record.game_file = path
+    _listener.queue.put_nowait(record)
+
+
 def print_red(message, bg=False):
     color = f"{Fore.RED}{Back.YELLOW}" if bg else Fore.RED
     print(f"{color}{message}{Style.RESET_ALL}")
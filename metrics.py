@@ -0,0 +1,244 @@
+"""
+LLM 调用指标采集
+
+每次 LLM 调用记录一条指标：
+- latency: 整次调用耗时（含重试），秒
+- ttft: 首个 token 到达耗时（仅流式后端），秒
+- prompt_tokens / completion_tokens: token 用量（后端返回时才有）
+- retries: 重试次数
+- ok: 是否最终成功
+- cancelled: 对冲请求中落败、被取消的调用（不计为失败）
+- stopped_early: 流式输出的 JSON 已完整、提前中止读取的调用
+
+指标按 player / role / model / prompt_type / tier（模型档位，见 settings.TieringSettings）聚合，
+导出为 Prometheus 文本格式（/metrics）；导出的标签不含对局，序列数不随对局数增长。
+逐次调用记录按对局保留，用于对局汇总（写入回放文件与归档）；对局归档时 finish_game 把记录换成汇总，
+未结束的对局最多保留 MAX_GAMES 局的记录。
+另外按模型保留最近 LATENCY_WINDOW 次成功调用的耗时，用于计算对冲请求的截止时间（见 llm.BaseLlm.get_response）。
+"""
+from typing import Dict, Any, List, Optional
+from collections import deque, OrderedDict
+import threading
+
+# 耗时直方图分桶（秒）
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600]
+
+LABEL_NAMES = ("player", "role", "model", "prompt_type", "tier")
+
+# 每个模型保留的最近成功调用耗时样本数
+LATENCY_WINDOW = 200
+
+# 保留逐次调用记录的对局数，以及已结束对局保留汇总的局数（均为最早的先淘汰）
+MAX_GAMES = 32
+MAX_FINISHED = 256
+
+
+class _Aggregate:
+    """一组标签下的累计指标"""
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.stopped_early = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.ttft_sum = 0.0
+        self.ttft_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, record: Dict[str, Any]):
+        self.calls += 1
+        if record.get("cancelled"):
+            self.cancelled += 1
+        elif not record.get("ok"):
+            self.errors += 1
+        if record.get("stopped_early"):
+            self.stopped_early += 1
+        self.retries += record.get("retries", 0)
+        latency = record.get("latency", 0.0)
+        self.latency_sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[i] += 1
+        if record.get("ttft") is not None:
+            self.ttft_sum += record["ttft"]
+            self.ttft_count += 1
+        self.prompt_tokens += record.get("prompt_tokens") or 0
+        self.completion_tokens += record.get("completion_tokens") or 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "stopped_early": self.stopped_early,
+            "retries": self.retries,
+            "latency_sum": round(self.latency_sum, 3),
+            "latency_avg": round(self.latency_sum / self.calls, 3) if self.calls else 0.0,
+            "ttft_avg": round(self.ttft_sum / self.ttft_count, 3) if self.ttft_count else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens
+        }
+
+
+class LlmMetrics:
+    """LLM 调用指标收集器（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aggregates: Dict[tuple, _Aggregate] = {}
+        self._calls: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._finished: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._recent_latency: Dict[str, deque] = {}
+        self._hedges: Dict[tuple, int] = {}
+
+    def record(self, record: Dict[str, Any]):
+        """记录一次调用，record 需包含 game 与 LABEL_NAMES 中的标签（缺失时记为空串）"""
+        labels = tuple(str(record.get(name, "") or "") for name in LABEL_NAMES)
+        game_id = str(record.get("game", "") or "")
+        with self._lock:
+            agg = self._aggregates.get(labels)
+            if agg is None:
+                agg = self._aggregates[labels] = _Aggregate()
+            agg.add(record)
+            # 已结束的对局只保留汇总，之后的零星调用只计入聚合
+            if game_id not in self._finished:
+                calls = self._calls.get(game_id)
+                if calls is None:
+                    calls = self._calls[game_id] = []
+                    while len(self._calls) > MAX_GAMES:
+                        self._calls.popitem(last=False)
+                calls.append(dict(record))
+            if record.get("ok") and not record.get("cancelled"):
+                model = labels[LABEL_NAMES.index("model")]
+                window = self._recent_latency.get(model)
+                if window is None:
+                    window = self._recent_latency[model] = deque(maxlen=LATENCY_WINDOW)
+                window.append(record.get("latency", 0.0))
+
+    def latency_quantile(self, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """某模型最近成功调用耗时的 q 分位数，样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(self._recent_latency.get(str(model), ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def record_hedge(self, model: str, backup_model: str, outcome: str):
+        """记录一次对冲：outcome 为 fired / primary_won / backup_won / both_failed"""
+        key = (str(model), str(backup_model), outcome)
+        with self._lock:
+            self._hedges[key] = self._hedges.get(key, 0) + 1
+
+    def game_calls(self, game_id: str) -> List[Dict[str, Any]]:
+        """获取某局游戏的逐次调用记录"""
+        with self._lock:
+            return list(self._calls.get(str(game_id), []))
+
+    def finish_game(self, game_id: str) -> Dict[str, Any]:
+        """对局结束（归档）时调用：汇总并释放该局的逐次调用记录，之后 game_summary 返回这份汇总"""
+        game_id = str(game_id)
+        summary = self.game_summary(game_id)
+        with self._lock:
+            self._calls.pop(game_id, None)
+            self._finished[game_id] = summary
+            self._finished.move_to_end(game_id)
+            while len(self._finished) > MAX_FINISHED:
+                self._finished.popitem(last=False)
+        return summary
+
+    def game_summary(self, game_id: str) -> Dict[str, Any]:
+        """按玩家、模型、提示词类型、模型档位汇总某局游戏的调用指标"""
+        game_id = str(game_id)
+        with self._lock:
+            finished = self._finished.get(game_id)
+        if finished is not None:
+            return finished
+        by_player: Dict[str, _Aggregate] = {}
+        by_model: Dict[str, _Aggregate] = {}
+        by_prompt: Dict[str, _Aggregate] = {}
+        by_tier: Dict[str, _Aggregate] = {}
+        total = _Aggregate()
+        for record in self.game_calls(game_id):
+            total.add(record)
+            by_player.setdefault(str(record.get("player", "")), _Aggregate()).add(record)
+            by_model.setdefault(str(record.get("model", "")), _Aggregate()).add(record)
+            by_prompt.setdefault(str(record.get("prompt_type", "")), _Aggregate()).add(record)
+            by_tier.setdefault(str(record.get("tier", "")), _Aggregate()).add(record)
+        return {
+            "game": game_id,
+            "total": total.to_dict(),
+            "by_player": {k: v.to_dict() for k, v in by_player.items()},
+            "by_model": {k: v.to_dict() for k, v in by_model.items()},
+            "by_prompt_type": {k: v.to_dict() for k, v in by_prompt.items()},
+            "by_tier": {k: v.to_dict() for k, v in by_tier.items()}
+        }
+
+    def render_prometheus(self) -> str:
+        """导出 Prometheus 文本格式"""
+        with self._lock:
+            items = [(labels, agg.to_dict(), list(agg.latency_buckets), agg.ttft_sum, agg.ttft_count)
+                     for labels, agg in self._aggregates.items()]
+            hedges = sorted(self._hedges.items())
+
+        lines = []
+
+        def label_str(labels, extra=None):
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(LABEL_NAMES, labels)]
+            if extra:
+                pairs.append(extra)
+            return "{" + ",".join(pairs) + "}"
+
+        simple_metrics = [
+            ("wolf_llm_calls_total", "counter", "LLM 调用次数", "calls"),
+            ("wolf_llm_errors_total", "counter", "LLM 调用最终失败次数", "errors"),
+            ("wolf_llm_cancelled_total", "counter", "对冲落败被取消的 LLM 调用次数", "cancelled"),
+            ("wolf_llm_stopped_early_total", "counter", "JSON 完整后提前中止流式输出的 LLM 调用次数", "stopped_early"),
+            ("wolf_llm_retries_total", "counter", "LLM 调用重试次数", "retries"),
+            ("wolf_llm_prompt_tokens_total", "counter", "输入 token 数", "prompt_tokens"),
+            ("wolf_llm_completion_tokens_total", "counter", "输出 token 数", "completion_tokens"),
+        ]
+        for name, metric_type, help_text, key in simple_metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, data, _, _, _ in items:
+                lines.append(f"{name}{label_str(labels)} {data[key]}")
+
+        name = "wolf_llm_latency_seconds"
+        lines.append(f"# HELP {name} LLM 调用耗时（含重试）")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, data, buckets, _, _ in items:
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                bucket_labels = label_str(labels, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+            inf_labels = label_str(labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{inf_labels} {data['calls']}")
+            lines.append(f"{name}_sum{label_str(labels)} {data['latency_sum']}")
+            lines.append(f"{name}_count{label_str(labels)} {data['calls']}")
+
+        name = "wolf_llm_ttft_seconds"
+        lines.append(f"# HELP {name} 流式后端首 token 耗时")
+        lines.append(f"# TYPE {name} summary")
+        for labels, _, _, ttft_sum, ttft_count in items:
+            if ttft_count:
+                lines.append(f"{name}_sum{label_str(labels)} {round(ttft_sum, 3)}")
+                lines.append(f"{name}_count{label_str(labels)} {ttft_count}")
+
+        name = "wolf_llm_hedges_total"
+        lines.append(f"# HELP {name} 对冲请求次数（fired 为发出次数，其余为结果）")
+        lines.append(f"# TYPE {name} counter")
+        for (model, backup_model, outcome), count in hedges:
+            lines.append(f'{name}{{model="{_escape(model)}",backup_model="{_escape(backup_model)}",'
+                         f'outcome="{outcome}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# 全局指标实例
+llm_metrics = LlmMetrics()
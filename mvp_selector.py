@@ -4,18 +4,21 @@
 - 输出：{"mvp_player_index": int, "reason": str, "model": str}
 
 实现思路：
-1) 从 config.json 读取用于评审的模型（优先使用 judge 字段），否则回退到第一个 models 配置
+1) 从配置（config.json）读取用于评审的模型（优先使用 judge 字段），否则回退到第一个 models 配置
 2) 汇总玩家身份、生存状态、贡献（用 ScoreCalculator 先算不含 MVP 的分，便于给大模型量化参考）
 3) 提供完整事件历史（History.get_history(show_all=True)）作为上下文
 4) 让大模型只输出 JSON，包含 mvp_player_index 和简明理由 reason（不超过120字）
 5) 失败时回退为当前总分最高的玩家，并给出回退理由
+build_prompt / judge 分开，锦标赛中各工作进程只构造提示词，由主进程攒批后用 select_batch 并发评选
 """
 from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 
 from llm import BuildModel
 from score_calculator import ScoreCalculator
+from settings import get_settings
 
 
 class MvpSelector:
@@ -28,25 +31,20 @@ class MvpSelector:
         self.model = BuildModel(self.model_name, self.api_key, force_json=True, base_url=self.base_url)
 
     def _load_model_from_config(self):
-        cfg = {}
-        try:
-            with open('config.json', 'r', encoding='utf-8') as f:
-                cfg = json.load(f)
-        except Exception:
-            cfg = {}
+        settings = get_settings()
         # 优先使用 judge 模型
-        judge = (cfg or {}).get('judge') or {}
-        if judge.get('model_name') and judge.get('api_key'):
-            self.model_name = judge.get('model_name')
-            self.api_key = judge.get('api_key')
-            self.base_url = judge.get('base_url')
+        judge = settings.judge
+        if judge and judge.model_name and judge.api_key:
+            self.model_name = judge.model_name
+            self.api_key = judge.api_key
+            self.base_url = judge.base_url
             return
         # 其次使用 models 列表第一个
-        models = (cfg or {}).get('models') or []
+        models = settings.models
         if models:
-            self.model_name = models[0].get('model_name')
-            self.api_key = models[0].get('api_key')
-            self.base_url = models[0].get('base_url')
+            self.model_name = models[0].model_name
+            self.api_key = models[0].api_key
+            self.base_url = models[0].base_url
         else:
             # 最后回退：占位，调用时很可能失败，但保持字段存在
             self.model_name = 'gpt-4.1'
@@ -54,10 +52,24 @@ class MvpSelector:
             self.base_url = None
 
     def select(self, game, winner: str, precomputed_ranking: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
-        # 1) 构造量化信息：不含 MVP 的基础积分/排名
-        calculator = ScoreCalculator(game)
-        base_scores = calculator.calculate_scores(winner, mvp_player_index=None)
-        base_ranking = calculator.get_ranking()
+        return self.judge(self.build_prompt(game, winner, precomputed_ranking), game_id=game.start_time)
+
+    def select_batch(self, prompts: List[Dict[str, Any]], game_ids: Optional[List[str]] = None,
+                     workers: int = 4) -> List[Dict[str, Any]]:
+        """并发评选多局（锦标赛结束的对局攒成一批后统一评选），返回顺序与 prompts 一致"""
+        game_ids = game_ids or [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(prompts)))) as pool:
+            return list(pool.map(lambda args: self.judge(*args), zip(prompts, game_ids)))
+
+    @staticmethod
+    def build_prompt(game, winner: str, precomputed_ranking: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """构造评审提示词（纯数据，可序列化后在其它进程中评选）"""
+        # 1) 构造量化信息：不含 MVP 的基础积分/排名（已有时直接复用）
+        base_ranking = precomputed_ranking
+        if base_ranking is None:
+            calculator = ScoreCalculator(game)
+            calculator.calculate_scores(winner, mvp_player_index=None)
+            base_ranking = calculator.get_ranking()
 
         # 2) 玩家与身份、生存
         players_brief = []
@@ -115,9 +127,15 @@ class MvpSelector:
             'events_history': history,
             'speeches_full': speeches_full  # 每位玩家的发言/遗言全文（结构化）
         }
+        return prompt
+
+    def judge(self, prompt: Dict[str, Any], game_id: Optional[str] = None) -> Dict[str, Any]:
+        """调用评审模型评选 MVP，失败时回退为不含 MVP 时总分最高的玩家"""
+        base_ranking = prompt.get('base_ranking_without_mvp') or []
 
         # 5) 调用大模型
-        content, _reasoning = self.model.generate(json.dumps(prompt, ensure_ascii=False))
+        tags = {"game": game_id, "role": "评审", "prompt_type": "mvp"}
+        content, _reasoning = self.model.get_response(json.dumps(prompt, ensure_ascii=False), tags=tags)
 
         # 6) 解析
         mvp_index = None
@@ -52,101 +52,55 @@ class WolfAction extends Action {
         super(game);
     }
 
-    async handleWolfVote(wolf, is_second_vote, wolves, index) {
-        let kill_id = -100;
-        if (this.game.display_wolf_action) {
-            await this.game.ui.showPlayer(wolf.index);
-        }
-        if (wolf.is_human) {
-            while (true) {
-                const input = await this.game.ui.showHumanInput(`请输入你的杀人目标 :1~9\n 输入-1代表放弃`);
-                kill_id = parseInt(input);
-                if (!isNaN(kill_id) && (kill_id >= -1 && kill_id <= 9)) {
-                    break;
-                }
-                alert("请输入正确的数字！");
-            }
-        }
-        // 先拉取当前狼的决策（命中缓存或真实请求）
-        const response = await this.game.gameData.decideKill({ player_idx: wolf.index, kill_id, is_second_vote });
-        console.log(response);
-        // 在展示当前狼的思考/发言之前，预取下一只存活狼的决策，以便重叠网络/计算时间
-        const nextWolf = this._findNextAliveWolf(wolves, index);
-        if (nextWolf && !nextWolf.is_human) {
-            this.game.gameData.prefetchDecideKill({ player_idx: nextWolf.index, kill_id: -100, is_second_vote });
-        }
+    async showWolfDecision(decision) {
+        const wolf_idx = decision.player_idx;
         let killWho = "我决定今晚不杀人！"
-        if (-1 !== response.kill) {
-            killWho = `我决定杀掉【${response.kill}】 号玩家!`;
+        if (-1 !== decision.kill) {
+            killWho = `我决定杀掉【${decision.kill}】 号玩家!`;
         }
-        const role = this.get_role(wolf.index);
+        const role = this.get_role(wolf_idx);
         if (this.game.display_wolf_action) {
+            await this.game.ui.showPlayer(wolf_idx);
             if (this.game.display_thinking) {
-                // 开始播放前预取下一有效行动（非女巫）
-                this.game.prefetchNextAction();
-                await this.game.ui.speak(`${wolf.index}号 ${role} 思考中：`, this.game.auto_play,response.reason, true);
+                await this.game.ui.speak(`${wolf_idx}号 ${role} 思考中：`, this.game.auto_play, decision.reason, true);
                 // 记录狼人思考过程到历史记录面板
                 if (window.historyPanel && typeof window.historyPanel.addThinking === 'function') {
-                    window.historyPanel.addThinking(wolf.index, response.reason, role);
+                    window.historyPanel.addThinking(wolf_idx, decision.reason, role);
                 }
             }
-            await this.game.ui.speak(`${wolf.index}号 ${role} `, this.game.auto_play, killWho);
+            await this.game.ui.speak(`${wolf_idx}号 ${role} `, this.game.auto_play, killWho);
             // 记录狼人行动到历史记录面板
             if (window.historyPanel && typeof window.historyPanel.addAction === 'function') {
-                window.historyPanel.addAction(wolf.index, killWho, role);
+                window.historyPanel.addAction(wolf_idx, killWho, role);
             }
             await this.game.ui.hidePlayer();
         }
     }
 
-    _findNextAliveWolf(wolves, startIndex) {
-        for (let j = startIndex + 1; j < wolves.length; j++) {
-            if (wolves[j] && wolves[j].is_alive) return wolves[j];
-        }
-        return null;
-    }
-
     async do() {
         console.log("== 狼人开始行动 ==");
-        //重置投票
-        await this.game.gameData.resetWolfWantKill();
-        const wolves = this.game.get_wolves();
-
-        // 第一轮投票
-        for (let i = 0; i < wolves.length; i++) {
-            const wolf = wolves[i];
-            if (wolf.is_alive) {
-                await this.handleWolfVote(wolf, false, wolves, i);
-            }
-        }
-
-        // 获取投票结果
-        const result = await this.game.gameData.getWolfWantKill();
+        // 投票由服务端完成：第一轮并发决策，全票一致时不进行第二轮；
+        // 人类狼人的目标由服务端通过输入请求获取（见 human-input.js）
+        const result = await this.game.gameData.wolfKill();
         console.log("狼人投票结果：", result);
-        const killedPlayer = result.wolf_want_kill;
 
-        if (killedPlayer != -1) {
-            console.log(`被杀死的玩家是：${killedPlayer} 号玩家`);
-        } else {
-            //无效投票，继续下一轮投票
-            console.log("无效投票，继续下一轮投票");
-            for (let i = 0; i < wolves.length; i++) {
-                const wolf = wolves[i];
-                if (wolf.is_alive) {
-                    await this.handleWolfVote(wolf, true, wolves, i);
-                }
-            }
+        // 目标已最终确定，展示狼人决策期间预取女巫的决策（服务端可能已提前开始）
+        this.game.prefetchNextAction();
 
-            // 获取第二轮投票结果
-            const result = await this.game.gameData.getWolfWantKill();
-            console.log("狼人投票结果：", result);
-            const killedPlayer = result.wolf_want_kill;
-            if (killedPlayer != -1) {
-                console.log(`被杀死的玩家是：${killedPlayer}`);
-            } else {
-                console.log("投票无效，今晚狼人不杀人");
+        for (let round = 0; round < result.rounds.length; round++) {
+            if (round > 0) {
+                console.log("无效投票，继续下一轮投票");
+            }
+            for (const decision of result.rounds[round]) {
+                await this.showWolfDecision(decision);
             }
         }
+
+        if (result.wolf_want_kill != -1) {
+            console.log(`被杀死的玩家是：${result.wolf_want_kill} 号玩家`);
+        } else {
+            console.log("投票无效，今晚狼人不杀人");
+        }
         return false;
     }
 }
@@ -162,10 +116,12 @@ class WitchAction extends Action {
         const killedPlayer = result.wolf_want_kill;
         if (!witch.is_alive) {
             //女巫已经死了
+            const deaths = [];
             if (killedPlayer != -1) {
                 await this.game.gameData.kill({ player_idx: killedPlayer });
-                await this.game.someone_die(killedPlayer, "被狼人杀死");
+                deaths.push({ player_idx: killedPlayer, death_reason: "被狼人杀死" });
             }
+            await this.game.resolve_deaths(deaths);
         } else {
             console.log("== 女巫开始行动 ==");
             const result = await this.game.gameData.decideCureOrPoison({ player_idx: witch.index });
@@ -201,22 +157,24 @@ class WitchAction extends Action {
                 }
                 await this.game.ui.hidePlayer();
             }
-            //根据女巫的决策结果进行操作
+            //根据女巫的决策结果进行操作，当晚的死者一并结算遗言
+            const deaths = [];
             if (1 != result.cure) {
                 //不治疗，玩家死
                 const result = await this.game.gameData.getWolfWantKill();
                 const killedPlayer = result.wolf_want_kill;
                 if (killedPlayer != -1) {
                     await this.game.gameData.kill({ player_idx: killedPlayer });
-                    await this.game.someone_die(killedPlayer, "被狼人杀死");
+                    deaths.push({ player_idx: killedPlayer, death_reason: "被狼人杀死" });
                 }
             }
 
             if (-1 != result.poison) {
                 //不毒杀，玩家死
                 await this.game.gameData.poison({ player_idx: result.poison });
-                await this.game.someone_die(result.poison, "被女巫毒杀");
+                deaths.push({ player_idx: result.poison, death_reason: "被女巫毒杀" });
             }
+            await this.game.resolve_deaths(deaths);
         }
         return false;
     }
@@ -293,16 +251,21 @@ class SpeakAction extends Action {
             const role = this.get_role(this.player_idx);
             await this.game.ui.showPlayer(this.player_idx);
 
-            let speak_content = "";
-            if (this.get_is_human(this.player_idx)) {
-                // 人类玩家输入发言
-                speak_content = await this.game.ui.showHumanInput("请输入你的发言");
+            // 人类玩家的发言由服务端通过输入请求获取（见 human-input.js）
+            const speak_content = "";
+            let stopStream = () => {};
+            if (!this.get_is_human(this.player_idx)) {
+                // AI发言：生成过程中实时显示已生成的内容
+                stopStream = this.game.gameData.streamSpeech(this.player_idx, (text) => {
+                    this.game.ui.showStreamingSpeech(`${this.player_idx}号 ${role} 发言生成中：`, text);
+                });
             }
             // 发送发言到后端
             const result = await this.game.gameData.speak({
                 player_idx: this.player_idx,
                 content: speak_content
             });
+            stopStream();
             if (this.game.display_thinking && result.thinking != "") {
                 // 开始播放前预取下一行动
                 this.game.prefetchNextAction();
@@ -369,39 +332,19 @@ class VoteAction extends Action {
 
     async do() {
         if (this.get_is_alive(this.player_idx)) {
-            let human_vote_id = -100;
-            if (this.get_is_human(this.player_idx)) {
-                while (true) {
-                    const input = await this.game.ui.showHumanInput("请输入你的投票 1~9\n如果弃票输入-1 ");
-                    human_vote_id = parseInt(input);
-                    if (!isNaN(human_vote_id) && (human_vote_id >= -1 && human_vote_id <= 9)) {
-                        break;
-                    }
-                    alert("请输入正确的数字！");
-                }
-            }
             const role = this.get_role(this.player_idx);
-            // 在显示“投票中”前，预取下一位存活AI玩家的“投票决策”（无副作用），以重叠网络/计算时间
-            const nextVoter = this._findNextAliveAIVoter();
-            if (nextVoter) {
-                this.game.gameData.prefetchDecideVote({ player_idx: nextVoter });
-            }
+            // 各玩家的投票决策互不依赖，行动计划会给出之后几位AI玩家的投票决策以便预取
+            this.game.prefetchNextAction();
 
             await this.game.ui.showPlayer(this.player_idx);
-            // 开始播放前预取下一行动（可能是下一位玩家投票或后续结算）
-            this.game.prefetchNextAction();
 
-            // 决策阶段：人类直接使用输入，AI先尝试用预取的决策（若无，实时计算一次）
-            let decidedVote = human_vote_id;
+            // 决策阶段：AI先尝试用预取的决策（若无，实时计算一次），人类玩家由服务端通过输入请求获取
+            let decidedVote = -1;
             let thinking = '';
-            if (human_vote_id === -100 && !this.get_is_human(this.player_idx)) {
-                const decision = await this.game.gameData.decideVote({ player_idx: this.player_idx });
-                if (decision && typeof decision.vote === 'number') {
-                    decidedVote = decision.vote;
-                    thinking = decision.thinking || '';
-                } else {
-                    decidedVote = -1;
-                }
+            const decision = await this.game.gameData.decideVote({ player_idx: this.player_idx });
+            if (decision && typeof decision.vote === 'number') {
+                decidedVote = decision.vote;
+                thinking = decision.thinking || '';
             }
 
             await this.game.ui.speak(`${this.player_idx}号 ${role} 投票：`, this.game.auto_play, "投票中");
@@ -433,20 +376,6 @@ class VoteAction extends Action {
         }
         return false;
     }
-
-    _findNextAliveAIVoter() {
-        const players = this.game.players;
-        // 使用当前玩家在 this.players 中的实际位置，避免 index 与数组位置不一致导致的预取失败
-        const currentPos = players.findIndex(p => p && p.index === this.player_idx);
-        if (currentPos === -1) return null;
-        // 仅在本轮剩余顺序中查找下一个存活AI（不wrap，以免预取到已完成投票的玩家）
-        for (let pos = currentPos + 1; pos < players.length; pos++) {
-            const p = players[pos];
-            if (p && p.is_alive && !p.is_human) return p.index;
-        }
-        return null;
-    }
-
 }
 
 class ExecuteAction extends Action {
@@ -486,6 +415,8 @@ class ExecuteAction extends Action {
         ///玩家发表遗言
         if (-1 != result.executed_player) {
             await this.game.someone_die(result.executed_player, "被投票处决");
+        } else {
+            await this.game.resolve_deaths([]);
         }
     }
 }
@@ -506,7 +437,7 @@ class CheckWinnerAction extends Action {
             // 显示积分界面
             try {
                 const { default: ScoreDisplay } = await import('./score-display.js');
-                const scoreDisplay = new ScoreDisplay();
+                const scoreDisplay = new ScoreDisplay(this.game.gameData.gameId);
                 await scoreDisplay.show(result.winner);
             } catch (error) {
                 console.error("加载积分展示模块失败:", error);
@@ -2,6 +2,21 @@ class GameData {
     constructor() {
         // 简单的基于请求签名的预取缓存
         this._prefetchCache = new Map();
+        // WebSocket 推送通道（可选），可用时状态查询不再走 HTTP 轮询
+        this.pushChannel = null;
+        // 请求超时（毫秒），开局后按服务端的行动时间预算设置
+        this.requestTimeout = 1000 * 1800;
+        // 当前对局ID，开局后随每个请求发送（多进程部署时服务端据此找到对局）
+        this.gameId = null;
+    }
+
+    // 附加在 SSE / WebSocket 地址上的对局参数（这两类请求无法设置请求头）
+    gameQuery() {
+        return this.gameId ? `&game_id=${encodeURIComponent(this.gameId)}` : '';
+    }
+
+    usePushChannel(channel) {
+        this.pushChannel = channel;
     }
 
     _getCacheKey(url, options = {}) {
@@ -11,11 +26,14 @@ class GameData {
     }
 
     async fetchData(url, options = {}) {
-        const timeout = 1000 * 1800; // 30秒超时（原注释）
+        const timeout = this.requestTimeout;
         const timeoutPromise = new Promise((_, reject) => {
             setTimeout(() => reject(new Error('请求超时')), timeout);
         });
 
+        if (this.gameId) {
+            options = { ...options, headers: { ...(options.headers || {}), 'X-Game-Id': this.gameId } };
+        }
         const fetchPromise = fetch(url, options);
         const response = await Promise.race([fetchPromise, timeoutPromise]);
         return response.json();
@@ -83,27 +101,68 @@ class GameData {
         });
     }
 
-    prefetchDecideKill(action) {
-        this.prefetch('/decide_kill', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(action)
-        });
-    }
-
     prefetchCheckWinner() {
         this.prefetch('/check_winner');
     }
 
-    prefetchCurrentTime() {
-        this.prefetch('/current_time');
+    // 订阅某位玩家正在生成的发言（SSE），onText 收到目前已生成的全文；返回关闭函数
+    streamSpeech(player_idx, onText) {
+        if (typeof EventSource === 'undefined') {
+            return () => {};
+        }
+        const source = new EventSource(`/speak_stream?player_idx=${player_idx}${this.gameQuery()}`);
+        source.onmessage = (event) => {
+            try {
+                const message = JSON.parse(event.data);
+                if (message.done) {
+                    source.close();
+                    return;
+                }
+                if (message.text) {
+                    onText(message.text);
+                }
+            } catch (e) {
+                console.warn('解析发言流失败（忽略）：', e);
+            }
+        };
+        source.onerror = () => source.close();
+        return () => source.close();
     }
 
     async startGame() {
-        return this.fetchData('/start', { method: 'GET' });
+        const result = await this.fetchData('/start', { method: 'GET' });
+        this.gameId = result.game_id || null;
+        return result;
+    }
+
+    // 开始下一个行动，返回 { seq, day, action, player_idx }
+    async nextStep() {
+        return this.fetchData('/next_step', { method: 'POST' });
+    }
+
+    // 接下来 n 个未完成的行动，ready 表示依赖已全部完成，prefetch 表示可以提前发出请求
+    async getPlan(n = 3) {
+        return this.fetchData(`/plan?n=${n}`);
+    }
+
+    // 长轮询人类玩家的输入请求，没有请求时返回 {request: null}
+    async pollHumanInput(timeout = 25) {
+        return this.fetchData(`/human/poll?timeout=${timeout}${this.gameQuery()}`);
+    }
+
+    async submitHumanInput(request_id, text) {
+        return this.fetchData('/human/submit', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ request_id, text })
+        });
     }
 
     async getStatus() {
+        if (this.pushChannel) {
+            const players = await this.pushChannel.sync('status');
+            if (players) return players;
+        }
         return this.fetchData('/status');
     }
 
@@ -124,6 +183,11 @@ class GameData {
         });
     }
 
+    // 服务端完成狼人当晚的全部投票，返回 { rounds: [[{ player_idx, kill, reason }]], wolf_want_kill }
+    async wolfKill() {
+        return this.fetchData('/wolf_kill', { method: 'POST' });
+    }
+
     async resetWolfWantKill() {
         return this.fetchData('/reset_wolf_want_kill', { method: 'POST' });
     }
@@ -149,6 +213,10 @@ class GameData {
     }
 
     async getCurrentTime() {
+        if (this.pushChannel) {
+            const time = await this.pushChannel.sync('current_time');
+            if (time) return time;
+        }
         return this._fetchWithCache('/current_time');
     }
 
@@ -168,6 +236,15 @@ class GameData {
         });
     }
 
+    // 一次结算多名玩家的死亡（遗言、猎人开枪），action 为 { deaths: [{ player_idx, death_reason }] }
+    async resolveDeaths(action) {
+        return this.fetchData('/resolve_deaths', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(action)
+        });
+    }
+
     async attack(action) {
         return this.fetchData('/attack', {
             method: 'POST',
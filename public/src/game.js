@@ -1,4 +1,6 @@
 import GameData from "./data.js";
+import PushChannel from "./push-channel.js";
+import HumanInputClient from "./human-input.js";
 import {
     DivineAction,
     EndDayAction,
@@ -16,7 +18,8 @@ class Game {
         this.gameData = new GameData();
         this.players = {}
         this.ui = ui;
-        this.current_action_index  = 0;
+        this.current_step = -1; // 正在执行的行动序号（由服务端的行动计划给出）
+        this.prefetch_depth = 3; // 每次预取时向后查看的行动数
         this.deaths = []; //死亡名单
         this.display_role = true;
         this.display_thinking = true;
@@ -33,41 +36,57 @@ class Game {
     }
 
     async someone_die(player_idx, death_reason) {
-        console.log(`被杀死的玩家是：${player_idx}`);
-        this.deaths.push(player_idx);
+        await this.resolve_deaths([{ player_idx: player_idx, death_reason: death_reason }]);
+    }
 
-        await this.ui.killPlayer(player_idx);
-        const result = await this.gameData.getCurrentTime();
-        console.log(result);
-        if (1 == result.current_day || (result.current_phase == "白天" && death_reason=="被投票处决")) {
-            let speak_content = "";
-            if (this.players[player_idx - 1].is_human) {
-                speak_content = await this.ui.showHumanInput(`请输入你的遗言`);
-            }
+    // 结算本阶段的全部死亡：服务端并发生成遗言与猎人开枪，按规则顺序写入历史后一并返回；
+    // 无人死亡时也通知服务端，女巫与处决行动在结算后才算完成（见 game.PhaseMachine）
+    async resolve_deaths(deaths) {
+        if (deaths.length == 0) {
+            await this.gameData.resolveDeaths({ deaths: deaths });
+            return;
+        }
+        for (const death of deaths) {
+            console.log(`被杀死的玩家是：${death.player_idx}`);
+            this.deaths.push(death.player_idx);
+            await this.ui.killPlayer(death.player_idx);
+        }
 
-            //如果是第一夜，允许发表遗言
-            const result = await this.gameData.lastWords({ player_idx: player_idx, speak: speak_content,  death_reason: death_reason });
-            console.log(result);
+        // 人类玩家的遗言由服务端通过输入请求获取（见 human-input.js）；
+        // 多名死者的遗言同时生成，只实时显示第一位AI死者的生成过程
+        let stopStream = () => {};
+        const streaming = deaths.find((death) => !this.players[death.player_idx - 1].is_human);
+        if (streaming) {
+            const role = this.display_role ? this.players[streaming.player_idx - 1].role_type : "玩家";
+            stopStream = this.gameData.streamSpeech(streaming.player_idx, (text) => {
+                this.ui.showStreamingSpeech(`${streaming.player_idx}号 ${role} 遗言生成中：`, text);
+            });
+        }
+        const result = await this.gameData.resolveDeaths({ deaths: deaths });
+        stopStream();
+        console.log(result);
 
-            await this.ui.showPlayer(player_idx);
-            const role = this.display_role ? this.players[player_idx - 1].role_type : "玩家";
-            if (this.display_thinking) {
-                await this.ui.speak(`${player_idx}号 ${role} 思考中：`, this.auto_play,result.thinking, true);
+        for (const resolution of result.resolutions) {
+            const player_idx = resolution.player_idx;
+            if (resolution.death_reason == "被猎人杀死") {
+                this.deaths.push(player_idx);
+                await this.ui.killPlayer(player_idx);
             }
-            await this.ui.speak(`${player_idx}号 ${role} 发表遗言：`, this.auto_play,result.speak);
-            await this.ui.hidePlayer();
-        }
-        //如果是猎人，并且不是被毒杀，允许反击
-        const  hunter = this.get_hunter();
-        if (hunter.index == player_idx && death_reason != "被女巫毒杀") {
-            const result = await this.gameData.revenge({ player_idx: player_idx, death_reason: death_reason });
-            console.log(result);
-            if (result.attack !== -1) {
-                await this.gameData.attack({ player_idx: player_idx, target_idx: result.attack });
-                await this.someone_die(result.attack, "被猎人杀死");
-                console.log(`猎人发动反击，杀死了：${result.attack}号玩家`);
-            } else {
-                console.log(`猎人决定不反击`);
+            if (resolution.last_words) {
+                await this.ui.showPlayer(player_idx);
+                const role = this.display_role ? this.players[player_idx - 1].role_type : "玩家";
+                if (this.display_thinking) {
+                    await this.ui.speak(`${player_idx}号 ${role} 思考中：`, this.auto_play, resolution.last_words.thinking, true);
+                }
+                await this.ui.speak(`${player_idx}号 ${role} 发表遗言：`, this.auto_play, resolution.last_words.speak);
+                await this.ui.hidePlayer();
+            }
+            if (resolution.revenge) {
+                if (resolution.revenge.attack !== -1) {
+                    console.log(`猎人发动反击，杀死了：${resolution.revenge.attack}号玩家`);
+                } else {
+                    console.log(`猎人决定不反击`);
+                }
             }
         }
     }
@@ -85,6 +104,17 @@ class Game {
         this.display_vote_action = result.display_vote_action;
         this.display_model = result.display_model;
         this.auto_play = result.auto_play;
+        if (result.request_timeout) {
+            this.gameData.requestTimeout = result.request_timeout * 1000;
+        }
+
+        // 服务端支持推送通道时，用 WebSocket 代替状态轮询
+        if (result.push_channel) {
+            const channel = new PushChannel(false, this.gameData.gameId);
+            if (await channel.connect()) {
+                this.gameData.usePushChannel(channel);
+            }
+        }
 
 
         ///获取玩家列表
@@ -92,6 +122,14 @@ class Game {
         this.players = Object.values(playersData);
         console.log(this.players);
 
+        // 有人类玩家时开始接收服务端发出的输入请求
+        if (this.players.some((player) => player.is_human)) {
+            if (!this.humanInput) {
+                this.humanInput = new HumanInputClient(this.gameData, this.ui);
+            }
+            this.humanInput.start();
+        }
+
         ///设置模型logo
         const model_name = {
             "o3-mini": "gpt",
@@ -116,24 +154,30 @@ class Game {
             }
         }
 
-        ///按顺序设置行动类
-        this.actions = []
-        this.actions.push(new DivineAction(this));
-        this.actions.push(new WolfAction(this));
-        this.actions.push(new WitchAction(this));
-        this.actions.push(new CheckWinnerAction(this));//检查胜利
-        this.actions.push(new EndNightAction(this));
-        for (const player of this.players) {
-            this.actions.push(new SpeakAction(this, player.index));
-        }
-        for (const player of this.players) {
-            this.actions.push(new VoteAction(this, player.index));
+        // 接手服务端从检查点恢复的对局：行动进度由服务端给出，这里只恢复昼夜画面
+        if (result.resumed) {
+            console.log(`继续恢复的对局：第${result.current_day}天${result.current_phase}`);
+            if (result.current_phase == "白天") {
+                await this.ui.showDayBackground();
+                await this.ui.showDay(result.current_day);
+            }
         }
+    }
 
-        ///白天最后一个环节是处决投票
-        this.actions.push(new ExecuteAction(this));
-        this.actions.push(new CheckWinnerAction(this));//检查胜利
-        this.actions.push(new EndDayAction(this));
+    // 服务端的行动类型对应的行动类
+    createAction(step) {
+        switch (step.action) {
+            case "divine": return new DivineAction(this);
+            case "wolf_kill": return new WolfAction(this);
+            case "witch": return new WitchAction(this);
+            case "check_winner": return new CheckWinnerAction(this);
+            case "end_night": return new EndNightAction(this);
+            case "speak": return new SpeakAction(this, step.player_idx);
+            case "vote": return new VoteAction(this, step.player_idx);
+            case "execute": return new ExecuteAction(this);
+            case "end_day": return new EndDayAction(this);
+        }
+        throw new Error(`未知的行动类型: ${step.action}`);
     }
 
     async run() {
@@ -141,8 +185,10 @@ class Game {
         const playersData = await this.gameData.getStatus();
         this.players = Object.values(playersData);
 
-        const action = this.actions[this.current_action_index++];
-        this.current_action_index = this.current_action_index % this.actions.length;
+        // 行动顺序由服务端决定（出局玩家的行动已跳过）
+        const step = await this.gameData.nextStep();
+        this.current_step = step.seq;
+        const action = this.createAction(step);
 
         // 执行行动
         const result = await action.do();
@@ -150,58 +196,25 @@ class Game {
         return result;
     }
 
-    // 在当前行动开始播放时，异步预取下一有效行动（会跳过出局/人类/无效目标）
-    prefetchNextAction() {
+    // 在当前行动开始播放时，按服务端的行动计划预取接下来依赖已完成的行动
+    async prefetchNextAction() {
         try {
-            const n = this.actions.length;
-            if (!n) return;
-            let i = this.current_action_index % n;
-            // 最多向前查看一轮，找到第一个可预取的候选
-            for (let step = 0; step < n; step++) {
-                const nextAction = this.actions[i];
-                if (!nextAction) break;
-
-                // 预取下一个发言内容（仅AI、且存活）
-                if (nextAction instanceof SpeakAction) {
-                    const idx = nextAction.player_idx;
-                    const player = this.players[idx - 1];
-                    if (player && player.is_alive && !player.is_human) {
-                        this.gameData.prefetchSpeak({ player_idx: idx, content: "" });
-                        return;
-                    }
+            const plan = await this.gameData.getPlan(this.prefetch_depth);
+            for (const step of plan.upcoming) {
+                // 计划返回前该行动可能已经开始，它的正式请求已经发出，不再预取
+                if (!step.ready || !step.prefetch || step.seq <= this.current_step) {
+                    continue;
                 }
-
-                // 预言家预取（仅预言家存活）
-                if (nextAction instanceof DivineAction) {
-                    const seer = this.get_diviner();
-                    if (seer && seer.is_alive) {
-                        this.gameData.prefetchDivine({ player_idx: seer.index });
-                        return;
-                    }
+                const action = { player_idx: step.player_idx };
+                if (step.action == "speak") {
+                    this.gameData.prefetchSpeak({ player_idx: step.player_idx, content: "" });
+                } else if (step.action == "vote") {
+                    this.gameData.prefetchDecideVote(action);
+                } else if (step.action == "divine") {
+                    this.gameData.prefetchDivine(action);
+                } else if (step.action == "witch") {
+                    this.gameData.prefetchDecideCureOrPoison(action);
                 }
-
-                // 女巫决策依赖“所有狼人投票结果”，为避免使用未完整投票的中间态，这里不做预取
-                // if (nextAction instanceof WitchAction) { ... }
-
-                // 夜转白/白转夜后需要时间信息
-                if (nextAction instanceof EndNightAction) {
-                    this.gameData.prefetchCurrentTime();
-                    return;
-                }
-
-                // 执行环节前，预取投票汇总
-                if (nextAction instanceof ExecuteAction) {
-                    this.gameData.prefetchGetVoteResult();
-                    return;
-                }
-
-                // 胜负判断不做预取，避免状态变更（如猎人开枪）前缓存旧结果
-                if (nextAction instanceof CheckWinnerAction) {
-                    return;
-                }
-
-                // 不可预取则继续向后查看
-                i = (i + 1) % n;
             }
         } catch (e) {
             console.warn('预取下一行动失败: ', e);
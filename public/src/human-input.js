@@ -0,0 +1,52 @@
+// 人类玩家输入：长轮询服务端登记的输入请求（/human/poll），显示输入框并提交（/human/submit）。
+// 服务端在轮到人类玩家行动时才发出请求，AI玩家的请求不必等待界面输入。
+class HumanInputClient {
+    constructor(gameData, ui) {
+        this.gameData = gameData;
+        this.ui = ui;
+        this.running = false;
+    }
+
+    start() {
+        if (this.running) return;
+        this.running = true;
+        this._loop();
+    }
+
+    stop() {
+        this.running = false;
+    }
+
+    async _loop() {
+        while (this.running) {
+            let request = null;
+            try {
+                const result = await this.gameData.pollHumanInput();
+                request = result && result.request;
+            } catch (error) {
+                console.warn('获取人类玩家输入请求失败:', error);
+                await new Promise((resolve) => setTimeout(resolve, 3000));
+                continue;
+            }
+            if (request) {
+                await this._handle(request);
+            }
+        }
+    }
+
+    async _handle(request) {
+        const context = Object.entries(request.context || {})
+            .map(([key, value]) => `${key}: ${Array.isArray(value) ? value.join('；') : value}`)
+            .join('\n');
+        const hint = `${request.player_idx}号玩家 ${request.hint}${context ? '\n' + context : ''}`;
+        while (this.running) {
+            const text = await this.ui.showHumanInput(hint);
+            const result = await this.gameData.submitHumanInput(request.id, text);
+            if (result.ok) return;
+            if (result.error === '该输入请求已结束') return;
+            alert(result.error);
+        }
+    }
+}
+
+export default HumanInputClient;
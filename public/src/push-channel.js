@@ -0,0 +1,90 @@
+// WebSocket 推送通道：接收服务端推送的历史事件、玩家状态变化和阶段切换，
+// 并用 sync 请求代替 /status、/current_time 轮询
+class PushChannel {
+    constructor(showAll = false, gameId = null) {
+        this.showAll = showAll;
+        // 只接收这一局的推送
+        this.gameId = gameId;
+        this.socket = null;
+        this.players = {};
+        this.time = null;
+        this.listeners = {};
+        this._syncId = 0;
+        this._pending = new Map();
+    }
+
+    connect() {
+        return new Promise((resolve) => {
+            const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+            const game = this.gameId ? `&game_id=${encodeURIComponent(this.gameId)}` : '';
+            const socket = new WebSocket(`${protocol}://${location.host}/ws?show_all=${this.showAll}${game}`);
+            socket.onopen = () => {
+                this.socket = socket;
+                resolve(true);
+            };
+            socket.onerror = () => resolve(false);
+            socket.onclose = () => {
+                this.socket = null;
+                // 未完成的 sync 交给调用方回退到 HTTP
+                for (const pending of this._pending.values()) {
+                    pending(null);
+                }
+                this._pending.clear();
+            };
+            socket.onmessage = (event) => this._handle(JSON.parse(event.data));
+        });
+    }
+
+    isOpen() {
+        return this.socket !== null && this.socket.readyState === WebSocket.OPEN;
+    }
+
+    // 监听推送消息：snapshot / event / players / phase / winner
+    on(type, callback) {
+        (this.listeners[type] = this.listeners[type] || []).push(callback);
+    }
+
+    // 请求当前状态，what 为 "status" 或 "current_time"；通道不可用时返回 null
+    sync(what) {
+        if (!this.isOpen()) {
+            return Promise.resolve(null);
+        }
+        const id = ++this._syncId;
+        return new Promise((resolve) => {
+            this._pending.set(id, resolve);
+            this.socket.send(JSON.stringify({ type: 'sync', id: id, what: what }));
+        });
+    }
+
+    _handle(message) {
+        if (message.type === 'sync') {
+            const resolve = this._pending.get(message.id);
+            if (resolve) {
+                this._pending.delete(message.id);
+                resolve(message.data);
+            }
+            return;
+        }
+        if (message.type === 'snapshot') {
+            this.players = message.players;
+            this.time = { current_day: message.current_day, current_phase: message.current_phase };
+        } else if (message.type === 'players') {
+            for (const [idx, changes] of Object.entries(message.changes)) {
+                this.players[idx] = Object.assign(this.players[idx] || {}, changes);
+            }
+        } else if (message.type === 'phase' || message.type === 'start') {
+            this.time = { current_day: message.current_day, current_phase: message.current_phase };
+        }
+        for (const callback of this.listeners[message.type] || []) {
+            callback(message);
+        }
+    }
+
+    close() {
+        if (this.socket) {
+            this.socket.close();
+        }
+    }
+}
+
+export default PushChannel;
@@ -4,9 +4,15 @@
  */
 
 class ScoreDisplay {
-    constructor() {
+    constructor(gameId = null) {
         this.scoreData = null;
         this.mvpVoted = false;
+        // 对局ID（多进程部署时服务端据此找到对局）
+        this.gameId = gameId;
+    }
+
+    gameHeaders() {
+        return this.gameId ? { 'X-Game-Id': this.gameId } : {};
     }
 
     /**
@@ -14,9 +20,8 @@ class ScoreDisplay {
      */
     async show(winner) {
         try {
-            // 获取积分数据
-            const response = await fetch('/get_game_scores');
-            this.scoreData = await response.json();
+            // 获取积分数据：服务端在后台结算，未完成时长轮询等待
+            this.scoreData = await this.fetchScores();
             
             if (!this.scoreData.ranking) {
                 console.log("积分数据不完整，跳过积分展示");
@@ -31,6 +36,19 @@ class ScoreDisplay {
         }
     }
 
+    /**
+     * 获取积分数据，结算未完成（status 为 pending）时继续等待
+     */
+    async fetchScores() {
+        while (true) {
+            const response = await fetch('/get_game_scores?wait=25', { headers: this.gameHeaders() });
+            const data = await response.json();
+            if (data.status !== 'pending') {
+                return data;
+            }
+        }
+    }
+
     /**
      * 创建积分展示界面
      */
@@ -213,7 +231,8 @@ class ScoreDisplay {
             const response = await fetch('/set_mvp', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    ...this.gameHeaders()
                 },
                 body: JSON.stringify({
                     mvp_player_index: playerIndex
@@ -242,8 +261,7 @@ class ScoreDisplay {
                 // 重新获取积分数据并刷新表格
                 setTimeout(async () => {
                     try {
-                        const response = await fetch('/get_game_scores');
-                        this.scoreData = await response.json();
+                        this.scoreData = await this.fetchScores();
 
                         // 更新排名表格
                         const rankingContainer = document.querySelector('.ranking-container');
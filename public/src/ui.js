@@ -358,6 +358,16 @@ class Ui {
         }
     }
 
+    // 显示正在生成中的发言（流式），不做打字机效果，只展示最新的若干行
+    showStreamingSpeech(title, text) {
+        const lines = this.formatText(text);
+        this.titleTextSpirit.text = title;
+        this.titleTextSpirit.visible = true;
+        this.speakTextSpirit.text = lines.slice(-9).join('\n');
+        this.speakTextSpirit.visible = true;
+        this.chat_box.visible = true;
+    }
+
     async hideSpeak() {
         this.chat_box.visible = false;
         this.titleTextSpirit.visible = false;
@@ -1,35 +1,87 @@
-from llm import BuildModel
+from llm import BuildModel, CANCELLED
 from history import *
 from log import *
+from json_stream import JsonFieldExtractor, output_fields
+from event_bus import event_bus
 import yaml
 import json
 import time
 import os
 from datetime import datetime
 import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 10        # 请求失败后等待多久重试（秒）
+MIN_RETRY_BUDGET = 10   # 行动剩余的时间预算少于此值（秒）时不再重试，直接采用默认决策
+
+class SpeechStreamer:
+    """把LLM流式输出中的 speak 字段实时发布到 speak/{玩家编号} 主题，供 /speak_stream 推送给浏览器（消息带对局ID）"""
+    def __init__(self, player_index, game_id=None):
+        self.player_index = player_index
+        self.game_id = game_id
+        self.topic = f"speak/{player_index}"
+        self.extractor = JsonFieldExtractor('speak')
+
+    def on_delta(self, text):
+        if text is None:
+            self.extractor = JsonFieldExtractor('speak')
+            self._publish(False)
+            return
+        if self.extractor.feed(text):
+            self._publish(False)
+
+    def finish(self, speak):
+        event_bus.publish(self.topic, {"player_idx": self.player_index, "game": self.game_id,
+                                       "text": speak or self.extractor.value, "done": True})
+        event_bus.clear_retained(self.topic)
+
+    def _publish(self, done):
+        # 保留最新状态，预取时浏览器晚于生成开始订阅也能拿到已生成部分
+        event_bus.publish(self.topic, {"player_idx": self.player_index, "game": self.game_id,
+                                       "text": self.extractor.value, "done": done}, retain=True)
+
 
 class BaseRole:
+    # 批量模拟时同时保留大量对局，玩家状态使用 __slots__（子类各自声明新增的字段）
+    __slots__ = ("player_index", "role_type", "is_alive", "game", "model", "tier_models")
+
     def __init__(self, player_index, role_type, model_name, api_key, game, base_url=None):
         self.player_index = player_index
         self.role_type = role_type
         self.is_alive = True
         self.game = game
         self.model = BuildModel(model_name, api_key, force_json=True, base_url=base_url)
+        # 按行动类型使用的模型档位 {行动类型: (档位名, 模型)}，由 WerewolfGame.attach_models 按配置设置
+        self.tier_models = {}
 
 
     def __str__(self):
         return f"你的玩家编号: {self.player_index}, 角色类型: {self.role_type}"
 
     def error(self, e, resp):
-        print("\033[91m发生错误:\033[0m")
-        print("\033[91m{}\033[0m".format(e))
-        print("\033[91m{}\033[0m".format(resp))
+        logger.error(f"{self.player_index}号玩家发生错误: {e}")
+        logger.debug(f"{resp}")
+
+    def model_for(self, prompt_type):
+        """本次行动使用的 (档位名, 模型)；未配置档位时为座位本身的模型，档位名为 seat"""
+        return self.tier_models.get(prompt_type) or ("seat", self.model)
+
+    def metric_tags(self, prompt_file):
+        """LLM调用指标的标签：对局、玩家、角色和提示词类型"""
+        prompt_type = os.path.splitext(os.path.basename(prompt_file))[0]
+        if prompt_type.startswith('prompt_'):
+            prompt_type = prompt_type[len('prompt_'):]
+        return {
+            "game": self.game.start_time,
+            "player": self.player_index,
+            "role": self.role_type,
+            "prompt_type": prompt_type
+        }
 
     def get_players_state(self):
-        state = []
-        for player in self.game.players:
-            state.append(f"{player.player_index}号玩家: {'存活' if player.is_alive else '死亡'}")
-        return state
+        return self.game.context().players_state
 
     def get_player_prompt_file(self, prompt_type):
         """根据玩家编号获取专属提示词文件路径，优先md格式，其次yaml格式"""
@@ -74,13 +126,14 @@ class BaseRole:
         return result
 
     def prompt_preprocess(self, prompt_template):
-        # 兼容md和yaml两种格式
+        # 兼容md和yaml两种格式；公共部分取自本阶段共享的上下文快照
+        context = self.game.context()
         replacements = {
             '角色': f"你是一名{self.role_type}",
-            '第几天': f'当前是第{self.game.current_day}天',
+            '第几天': context.current_day,
             '你的玩家编号': f"你是{self.player_index}号玩家",
-            '事件': self.game.history.get_history(),
-            '玩家状态': self.get_players_state(),
+            '事件': context.history,
+            '玩家状态': context.players_state,
             '随机数种子': int(time.time() * 1000) + random.randint(1, 1000)
         }
         for k, v in replacements.items():
@@ -88,7 +141,13 @@ class BaseRole:
                 prompt_template[k] = v
         return prompt_template
 
-    def handle_action(self, prompt_file, extra_data=None, retry_count=0):
+    def handle_action(self, prompt_file, extra_data=None, retry_count=0, on_delta=None, deadline=None, deferred=None,
+                      cancel=None):
+        """
+        deferred: 投机执行时（见 WerewolfGame.speculate_witch）传入列表，LLM日志与归档的写入追加到列表中，
+        决策被采用时再执行，作废时丢弃；此时也不使用指定的决策（有指定决策时不投机）
+        cancel: 可选取消标记（llm.CancelToken），投机执行作废时置位，中止进行中的请求
+        """
         if prompt_file.endswith('.md'):
             prompt_template = self.parse_prompt_md(prompt_file)
         else:
@@ -103,42 +162,141 @@ class BaseRole:
         if extra_data:
             prompt_dict.update(extra_data)
         prompt_str = json.dumps(prompt_dict, ensure_ascii=False)
-        resp, reason = self.model.get_response(prompt_str)
-        if resp is None:
-            self.error("请求失败", prompt_str)
-            if retry_count < 10:
-                print_red("重新发起请求")
-                time.sleep(10)
-                return self.handle_action(prompt_file, extra_data, retry_count+1)
-            return None
+        tags = self.metric_tags(prompt_file)
+        if retry_count == 0:
+            deadline = self.action_deadline(tags["prompt_type"])
         required_fields = prompt_template.get('required_fields', [])
         if isinstance(required_fields, str):
             required_fields = [x.strip() for x in required_fields.split(',')]
+        # 按输出格式提前结束流式输出、限制输出长度（见 settings.OutputSettings）
+        output = self.game.load_settings().output
+        tier, model = self.model_for(tags["prompt_type"])
+        tags["tier"] = tier
+        # 反事实分支中指定的决策（见 WerewolfGame.force）
+        forced = self.game.take_forced(self.player_index, tags["prompt_type"]) if deferred is None else None
+        if forced is not None:
+            logger.info(f"{self.player_index}号玩家的 {tags['prompt_type']} 使用指定的决策: {forced}")
+            return forced
+
+        def request():
+            with self.game.llm_call():
+                return model.get_response(
+                    prompt_str, tags=tags, on_delta=on_delta, deadline=deadline,
+                    stop_fields=required_fields if output.early_stop and required_fields else None,
+                    max_tokens=output.max_tokens(output_fields(prompt_template.get('output_format', ''))),
+                    cancel=cancel
+                )
+        # 分支对局共享的响应缓存（见 llm_cache.py），提示词相同的请求只调用一次模型
+        cache = self.game.llm_cache
+        if cache is not None and model.model_name != "human":
+            resp, reason = cache.get_or_call(cache.key(model.model_name, tier, prompt_str), request)
+        else:
+            resp, reason = request()
+        if resp is None and reason == CANCELLED:
+            # 所属对局已结束或重新开始、投机执行已作废：不再重试（重试的请求会被当作新一局的请求），直接采用默认决策
+            resp = self.default_decision(tags["prompt_type"])
+            logger.info(f"{self.player_index}号玩家的 {tags['prompt_type']} 请求已取消，采用默认决策: {resp}")
+            return resp
+        if resp is None:
+            self.error("请求失败", prompt_str)
+            if self.wait_for_retry(retry_count, deadline):
+                return self.handle_action(prompt_file, extra_data, retry_count+1, on_delta, deadline, deferred, cancel)
+            return self.timeout_fallback(tags["prompt_type"], prompt_dict, deadline, deferred)
         if required_fields:
             missing_fields = [field for field in required_fields if field not in resp]
             if missing_fields:
                 self.error(f"响应缺少必要字段: {missing_fields}", resp)
-                if retry_count < 10:
-                    print_red("重新发起请求")
-                    time.sleep(10)
-                    return self.handle_action(prompt_file, extra_data, retry_count+1)
-                return None
+                if self.wait_for_retry(retry_count, deadline):
+                    return self.handle_action(prompt_file, extra_data, retry_count+1, on_delta, deadline, deferred, cancel)
+                return self.timeout_fallback(tags["prompt_type"], prompt_dict, deadline, deferred)
         # 日志部分保留
-        with open(f'logs/llm_{self.game.start_time}.txt', 'a', encoding='utf-8') as log_file:
-            log_file.write(f"--- {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
-            log_file.write(f"--- {self.player_index}号玩家 ({self.role_type}) ---\n")
-            log_file.write(f"---输入---:\n{prompt_str}\n")
-            log_file.write(f"---输出---:\n{json.dumps(resp, ensure_ascii=False)}\n")
-            if reason:
-                log_file.write(f"---推理过程---:\n{reason}\n")
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        def write_log():
+            with self.game.llm_log() as log_file:
+                log_file.write(f"--- {timestamp} ---\n")
+                log_file.write(f"--- {self.player_index}号玩家 ({self.role_type}) ---\n")
+                log_file.write(f"---输入---:\n{prompt_str}\n")
+                log_file.write(f"---输出---:\n{json.dumps(resp, ensure_ascii=False)}\n")
+                if reason:
+                    log_file.write(f"---推理过程---:\n{reason}\n")
+            self.game.archive.add_llm_call(self.player_index, tags["prompt_type"], model.model_name, prompt_dict, resp, reason)
+            self.checkpoint_decision(tags["prompt_type"], resp)
+        if deferred is not None:
+            deferred.append(write_log)
+        else:
+            write_log()
         return resp
 
+    def action_deadline(self, prompt_type):
+        """本次行动的截止时刻（time.monotonic()），未配置时间预算时返回 None；人类玩家使用单独的时限"""
+        deadlines = self.game.load_settings().deadlines
+        budget = deadlines.budget('human' if self.model.model_name == "human" else prompt_type)
+        return time.monotonic() + budget if budget else None
+
+    def wait_for_retry(self, retry_count, deadline):
+        """失败后等待重试，返回是否还应重试（已达重试上限或剩余的时间预算不够再请求一次时为 False）"""
+        if retry_count >= 10:
+            return False
+        delay = RETRY_DELAY
+        if deadline is not None:
+            # 等待之后至少还要留出 MIN_RETRY_BUDGET 秒用于请求，否则等待只会耗尽预算
+            delay = min(delay, deadline - time.monotonic() - MIN_RETRY_BUDGET)
+            if delay < 0:
+                return False
+        logger.warning("重新发起请求")
+        with self.game.llm_call():
+            time.sleep(delay)
+        return True
+
+    def timeout_fallback(self, prompt_type, prompt_dict, deadline, deferred=None):
+        """剩余的时间预算不够重试时返回默认决策并记入归档；预算充足（重试次数用尽）时返回 None"""
+        if deadline is None or deadline - time.monotonic() >= MIN_RETRY_BUDGET:
+            return None
+        resp = self.default_decision(prompt_type)
+        logger.warning(f"{self.player_index}号玩家 {prompt_type} 超时，采用默认决策: {resp}")
+        def record():
+            self.game.archive.add_llm_call(self.player_index, prompt_type, self.model.model_name,
+                                           prompt_dict, resp, "超时默认决策")
+            self.checkpoint_decision(prompt_type, resp)
+        if deferred is not None:
+            deferred.append(record)
+        else:
+            record()
+        return resp
+
+    def checkpoint_decision(self, prompt_type, resp):
+        """把采用的决策写入检查点：行动未完成就崩溃时，恢复后重新执行该行动直接采用（见 journal.drop_unfinished）"""
+        self.game.checkpoint("decision", player_idx=self.player_index, prompt_type=prompt_type, response=resp)
+
+    def default_decision(self, prompt_type):
+        """行动超时的默认决策：跳过发言、弃票（或随机投票）、狼人随机刀一名好人、随机查验、不用药、猎人不开枪"""
+        thinking = "决策超时，按默认规则处理"
+        others = [p.player_index for p in self.game.players if p.is_alive and p.player_index != self.player_index]
+        if prompt_type in ('speak', 'lastword'):
+            return {'thinking': thinking, 'speak': '（超时未发言）'}
+        if prompt_type == 'vote':
+            random_vote = self.game.load_settings().deadlines.vote_fallback == 'random'
+            return {'thinking': thinking, 'vote': random.choice(others) if random_vote and others else -1}
+        if prompt_type == 'kill':
+            targets = [p.player_index for p in self.game.players if p.is_alive and p.role_type != '狼人']
+            return {'reason': thinking, 'kill': random.choice(targets) if targets else -1}
+        if prompt_type == 'divine':
+            return {'thinking': thinking, 'divine': random.choice(others)} if others else None
+        if prompt_type == 'cure_or_poison':
+            return {'thinking': thinking, 'cure': 0, 'poison': -1}
+        if prompt_type == 'hunter_revenge':
+            return {'thinking': thinking, 'attack': -1}
+        return None
+
     def speak(self, content, extra_data=None):
         if not content:
             if extra_data is None:
                 extra_data={}
             prompt_file = self.get_player_prompt_file('speak')
-            resp_dict = self.handle_action(prompt_file, extra_data)
+            streamer = SpeechStreamer(self.player_index, self.game.start_time)
+            resp_dict = self.handle_action(prompt_file, extra_data, on_delta=streamer.on_delta)
+            streamer.finish(resp_dict.get('speak') if resp_dict else None)
             if resp_dict:
                 self.game.history.add_event(SpeakEvent(self.player_index, resp_dict['speak']))
                 return resp_dict
@@ -172,43 +330,52 @@ class BaseRole:
 
 
 
+    def make_extra_data(self):
+        """角色专属的提示词附加信息（技能、已知信息等），由各角色覆盖"""
+        return {}
+
     def last_words(self, speak, death_reason, extra_data=None):
         """发表遗言(死后)"""
-        resp_dict = {}
-        if extra_data is None:
-            extra_data={}
-        extra_data['reason'] = death_reason
-
         if not speak:
-            prompt_file = self.get_player_prompt_file('lastword')
-            resp_dict = self.handle_action(prompt_file, extra_data)
+            resp_dict = self.compose_last_words(death_reason, extra_data)
         else:
-            resp_dict['speak'] = speak
-            resp_dict['thinking'] = ''
+            resp_dict = {'speak': speak, 'thinking': ''}
+        return self.commit_last_words(resp_dict)
+
+    def compose_last_words(self, death_reason, extra_data=None):
+        """只生成遗言，不写入历史（WerewolfGame.resolve_deaths 并发生成后再按顺序写入）"""
+        extra_data = dict(extra_data if extra_data is not None else (self.make_extra_data() or {}))
+        extra_data['reason'] = death_reason
+        prompt_file = self.get_player_prompt_file('lastword')
+        streamer = SpeechStreamer(self.player_index, self.game.start_time)
+        resp_dict = self.handle_action(prompt_file, extra_data, on_delta=streamer.on_delta)
+        streamer.finish(resp_dict.get('speak') if resp_dict else None)
+        return resp_dict
+
+    def commit_last_words(self, resp_dict):
         if resp_dict:
             self.game.history.add_event(LastWordEvent(self.player_index, resp_dict['speak']))
-
         return resp_dict
 
     def be_executed(self, vote_result):
         '''被放逐'''
         self.is_alive = False
         self.game.history.add_event(ExecuteEvent(self.player_index, vote_result))
-        with open(f'logs/result_{self.game.start_time}.txt', 'a', encoding='utf-8') as log_file:
+        with self.game.result_log() as log_file:
             log_file.write(f"【{self.game.current_day} {self.game.current_phase}】 【{self.player_index}】号【{self.role_type}】被处决\n")
 
     def be_attacked(self):
         '''被攻击'''
         self.is_alive = False
         self.game.history.add_event(AttackEvent(self.player_index))
-        with open(f'logs/result_{self.game.start_time}.txt', 'a', encoding='utf-8') as log_file:
+        with self.game.result_log() as log_file:
             log_file.write(f"【{self.game.current_day} {self.game.current_phase}】 【{self.player_index}】号【{self.role_type}】被猎人反击杀死\n")
 
     def be_killed(self):
         '''被杀'''
         self.is_alive = False
         self.game.history.add_event(KillEvent(self.player_index))
-        with open(f'logs/result_{self.game.start_time}.txt', 'a', encoding='utf-8') as log_file:
+        with self.game.result_log() as log_file:
             log_file.write(f"【{self.game.current_day} {self.game.current_phase}】 【{self.player_index}】号【{self.role_type}】被狼人杀死\n")
 
     def be_poisoned(self):
@@ -216,7 +383,7 @@ class BaseRole:
         self.is_alive = False
         self.game.history.add_event(PoisonEvent(self.player_index))
         self.game.history.add_event(KillEvent(self.player_index))
-        with open(f'logs/result_{self.game.start_time}.txt', 'a', encoding='utf-8') as log_file:
+        with self.game.result_log() as log_file:
             log_file.write(f"【{self.game.current_day} {self.game.current_phase}】 【{self.player_index}】号【{self.role_type}】被女巫毒死\n")
 
     def be_cured(self):
@@ -226,10 +393,14 @@ class BaseRole:
 
 
 class Villager(BaseRole):
+    __slots__ = ()
+
     def __init__(self, player_index, model_name, api_key,  game, base_url=None):
         super().__init__(player_index, "村民", model_name, api_key, game, base_url)
 
 class Hunter(BaseRole):
+    __slots__ = ()
+
     def __init__(self, player_index, model_name, api_key,  game, base_url=None):
         super().__init__(player_index, "猎人", model_name, api_key,  game, base_url)
 
@@ -239,16 +410,18 @@ class Hunter(BaseRole):
         }
         return extra_data
 
-    def last_words(self, speak, death_reason):
-        extra_data = self.make_extra_data()
-        return super().last_words(speak, death_reason, extra_data)
-
     def revenge(self, death_reason):
+        return self.commit_revenge(self.decide_revenge(death_reason))
+
+    def decide_revenge(self, death_reason):
+        """只决定是否开枪，不写入历史（见 WerewolfGame.resolve_deaths）"""
         extra_data = {
             "出局的原因": death_reason
         }
         prompt_file = self.get_player_prompt_file('hunter_revenge')
-        resp_dict = self.handle_action(prompt_file, extra_data)
+        return self.handle_action(prompt_file, extra_data)
+
+    def commit_revenge(self, resp_dict):
         if resp_dict and resp_dict.get('attack', -1) != -1:
             # 记录猎人反击事件
             hunter_event = HunterRevengeEvent(self.player_index, resp_dict['attack'])
@@ -257,6 +430,8 @@ class Hunter(BaseRole):
 
 
 class Seer(BaseRole):
+    __slots__ = ("divine_result",)
+
     def __init__(self, player_index, model_name, api_key, game, base_url=None):
         super().__init__(player_index, "预言家", model_name, api_key, game, base_url)
         self.divine_result = []
@@ -267,11 +442,6 @@ class Seer(BaseRole):
             extra_data = {'你已经掌握的信息': self.divine_result}
         return extra_data
 
-    def last_words(self, speak, death_reason):
-        """发表遗言(死后)"""
-        extra_data = self.make_extra_data()
-        return super().last_words(speak, death_reason, extra_data)
-
     def speak(self, content):
         extra_data = self.make_extra_data()
         return super().speak(content, extra_data)
@@ -300,28 +470,18 @@ class Seer(BaseRole):
 
 
 class Wolf(BaseRole):
+    __slots__ = ()
+
     def __init__(self, player_index, model_name, api_key,  game, base_url=None):
         super().__init__(player_index, "狼人", model_name, api_key,  game, base_url)
 
 
     def make_extra_data(self):
-        wolves  = self.game.get_wolves()
-        wolves_list = []
-        for wolf in wolves:
-            if wolf["player_index"] == self.player_index:
-                continue
-            is_alive = "存活" if wolf["is_alive"] else "已死亡"
-            wolves_list.append(f"{wolf['player_index']}号玩家是狼人, 目前{is_alive}")
         extra_data = {
-            "你的狼人队友": wolves_list
+            "你的狼人队友": self.game.context().wolf_teammates(self.player_index)
         }
         return extra_data
 
-    def last_words(self, speak, death_reason):
-        """发表遗言(死后)"""
-        extra_data = self.make_extra_data()
-        return super().last_words(speak, death_reason, extra_data)
-
     def vote(self, vote_id):
         extra_data = self.make_extra_data()
         return super().vote(vote_id, extra_data)
@@ -360,6 +520,8 @@ class Wolf(BaseRole):
 
 
 class Witch(BaseRole):
+    __slots__ = ("cured_someone", "poisoned_someone")
+
     def __init__(self, player_index, model_name, api_key,  game, base_url=None):
         super().__init__(player_index, "女巫", model_name, api_key,  game, base_url)
         self.cured_someone = 0
@@ -372,11 +534,6 @@ class Witch(BaseRole):
         }
         return extra_data
 
-    def last_words(self, speak, death_reason):
-        """发表遗言(死后)"""
-        extra_data = self.make_extra_data()
-        return super().last_words(speak, death_reason, extra_data)
-
     def vote(self, vote_id):
         extra_data = self.make_extra_data()
         return super().vote(vote_id, extra_data)
@@ -387,13 +544,22 @@ class Witch(BaseRole):
 
     def decide_cure_or_poison(self, someone_will_be_killed):
         """决定是否要治疗或毒杀"""
+        return self.commit_cure_or_poison(self.plan_cure_or_poison(someone_will_be_killed), someone_will_be_killed)
+
+    def plan_cure_or_poison(self, someone_will_be_killed, deferred=None, cancel=None):
+        """
+        只做决策，不写入历史、不改变用药状态（可在狼人投票结束前投机执行，见 WerewolfGame.wolf_kill）；
+        deferred、cancel 见 handle_action
+        """
         extra_data = self.make_extra_data()
         if someone_will_be_killed != -1:
             extra_data['今晚发生了什么'] = f'{someone_will_be_killed}号玩家将被杀害'
         else:
             extra_data['今晚发生了什么'] = "没有人将被杀害"
         prompt_file = self.get_player_prompt_file('cure_or_poison')
-        resp_dict = self.handle_action(prompt_file, extra_data)
+        return self.handle_action(prompt_file, extra_data, deferred=deferred, cancel=cancel)
+
+    def commit_cure_or_poison(self, resp_dict, someone_will_be_killed):
         if resp_dict:
             # 记录女巫行动事件
             if resp_dict['cure'] == 1 and someone_will_be_killed != -1:
@@ -0,0 +1,120 @@
+"""
+无界面对局驱动
+
+网页模式下游戏流程由前端脚本（public/src/action.js）驱动。HeadlessRunner 在服务端按同样的行动顺序
+（game.PhaseMachine）直接调用 WerewolfGame 的方法跑完一整局，用于批量对局（见 tournament.py），不支持人类玩家。
+"""
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+UNDECIDED = '胜负未分'
+
+
+class HeadlessRunner:
+    def __init__(self, game, max_days: int = 20):
+        self.game = game
+        self.max_days = max_days
+
+    def play(self, resume: bool = False) -> str:
+        """
+        从开局跑到分出胜负，返回胜负结果；超过 max_days 仍未结束时返回"胜负未分"。
+        行动顺序与前端相同，由 game.next_step() 给出；resume=True 时不重新开局，从 game.restore 恢复的进度继续
+        """
+        game = self.game
+        if not resume:
+            game.start()
+        if any(p.model.model_name == "human" for p in game.players):
+            raise ValueError("无界面对局不支持人类玩家")
+
+        while True:
+            step = game.next_step()
+            if step["day"] > self.max_days:
+                logger.warning(f"对局 {game.start_time} 超过 {self.max_days} 天仍未分出胜负")
+                return UNDECIDED
+            winner = self.run_step(step)
+            if winner is not None and winner != UNDECIDED:
+                return winner
+
+    def run_step(self, step) -> Optional[str]:
+        """执行一个行动，胜负判断时返回结果"""
+        game = self.game
+        action, player_idx = step["action"], step["player_idx"]
+        if action == "divine":
+            game.divine(player_idx)
+        elif action == "wolf_kill":
+            game.wolf_kill()
+        elif action == "witch":
+            self.witch(game.get_wolf_want_kill())
+        elif action == "check_winner":
+            return game.check_winner()
+        elif action == "end_night":
+            # 先清空投票结果再切换昼夜，切换即完成本行动（见 journal.py）
+            game.reset_vote_result()
+            game.toggle_day_night()
+        elif action == "speak":
+            game.speak(player_idx, "")
+        elif action == "vote":
+            decision = game.decide_vote(player_idx) or {}
+            vote_id = decision.get('vote', -1)
+            game.vote(player_idx, vote_id if isinstance(vote_id, int) else -1)
+        elif action == "execute":
+            self.execute()
+        elif action == "end_day":
+            game.toggle_day_night()
+        return None
+
+    def find_role(self, role_type: str):
+        return next((p for p in self.game.players if p.role_type == role_type), None)
+
+    def witch(self, target: int):
+        """与前端 WitchAction 一致：按女巫的决策用药，当晚的死者由 game.resolve_deaths 一并结算（无人死亡时也调用，结束女巫行动）"""
+        game = self.game
+        witch = self.find_role('女巫')
+        deaths = []
+        if not witch or not witch.is_alive:
+            if target != -1:
+                game.kill(target)
+                deaths.append({"player_idx": target, "death_reason": "被狼人杀死"})
+        else:
+            result = game.decide_cure_or_poison(witch.player_index) or {}
+            cured = result.get('cure') == 1
+            if cured and target != -1:
+                game.cure(target)
+            if not cured and target != -1:
+                game.kill(target)
+                deaths.append({"player_idx": target, "death_reason": "被狼人杀死"})
+            poison = result.get('poison', -1)
+            if isinstance(poison, int) and 1 <= poison <= len(game.players):
+                game.poison(poison)
+                deaths.append({"player_idx": poison, "death_reason": "被女巫毒杀"})
+        game.resolve_deaths(deaths)
+
+    def execute(self) -> Optional[int]:
+        """
+        按投票结果处决，平票或全部弃票时无人出局；被处决的玩家由 game.resolve_deaths 结算遗言与猎人开枪
+        （无人出局时也调用，结束处决行动）
+        """
+        game = self.game
+        vote_results = game.get_vote_result()
+        executed = self.voted_out(vote_results)
+        deaths = []
+        if executed is not None:
+            game.execute(executed, vote_results)
+            deaths.append({"player_idx": executed, "death_reason": "被投票处决"})
+        game.resolve_deaths(deaths)
+        return executed
+
+    @staticmethod
+    def voted_out(vote_results) -> Optional[int]:
+        """得票唯一最高的玩家，平票或全部弃票时为 None"""
+        votes = {}
+        for vote in vote_results:
+            if vote["vote_id"] != -1:
+                votes[vote["vote_id"]] = votes.get(vote["vote_id"], 0) + 1
+        if not votes:
+            return None
+        max_votes = max(votes.values())
+        voted_out = [player for player, count in votes.items() if count == max_votes]
+        return voted_out[0] if len(voted_out) == 1 else None
@@ -7,12 +7,16 @@
    - 预言家：查验出狼人+5分
    - 女巫：救对人或毒死狼人+5分
    - 猎人：开枪带走狼人+5分
-   - 狼人：击杀神民+5分（团队加分）
+   - 狼人：击杀神民+5分（团队加分，女巫毒杀不算）
    - 村民：参与投票放逐狼人每次+3分
 3. MVP加分：全场最佳+5分
+
+贡献分由 ScoreTracker 随事件增量累加，ScoreCalculator 结算时只需加上阵营分与 MVP 分。
 """
 
 from typing import Dict, List, Any
+import threading
+
 from history import *
 
 
@@ -58,6 +62,115 @@ class PlayerScore:
         }
 
 
+GOD_ROLES = ["预言家", "女巫", "猎人"]
+
+
+class ScoreTracker:
+    """
+    贡献分累加器：订阅 History 的事件，每个事件 O(1) 更新各玩家的贡献分，
+    对局进行中即可读取（观战界面的实时积分），结算时不必重新分析整局历史。
+    贡献分与胜负无关，阵营分与 MVP 分在 ScoreCalculator 结算时再加上。
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.history = game.history
+        self.contributions: Dict[int, List[tuple]] = {}  # 玩家编号 -> [(描述, 分数)]
+        self.contribution_scores: Dict[int, int] = {}
+        self.version = 0  # 贡献分每变化一次加一
+        self._lock = threading.Lock()
+        # 各项只加一次分的贡献
+        self._seer_found_wolf = False
+        self._witch_cured_god = False
+        self._witch_poisoned_wolf = False
+        self._hunter_shot_wolf = False
+        self._wolves_killed_god = False
+        self._last_poisoned = None  # 被毒杀时紧随 PoisonEvent 记录的 KillEvent 不算狼人击杀
+
+    @classmethod
+    def replay(cls, game) -> "ScoreTracker":
+        """按时间顺序重放已有历史（没有实时订阅的对局，如旧对局或离线分析）"""
+        tracker = cls(game)
+        if tracker.history:
+            for round_obj in tracker.history.rounds:
+                for event in round_obj.day_events:
+                    tracker.on_event(event)
+                for event in round_obj.night_events:
+                    tracker.on_event(event)
+        return tracker
+
+    def _role(self, player_idx) -> str:
+        players = self.game.players
+        if isinstance(player_idx, int) and 1 <= player_idx <= len(players):
+            return players[player_idx - 1].role_type
+        return ""
+
+    def _add(self, player_idx: int, description: str, score: int):
+        self.contributions.setdefault(player_idx, []).append((description, score))
+        self.contribution_scores[player_idx] = self.contribution_scores.get(player_idx, 0) + score
+        self.version += 1
+
+    def on_event(self, event):
+        """History 监听回调"""
+        with self._lock:
+            code = event.CODE
+            if code == DivineEvent.CODE:
+                if not self._seer_found_wolf and event.result == "狼人":
+                    self._seer_found_wolf = True
+                    self._add(event.player_idx, "查验出狼人", 5)
+            elif code == CureEvent.CODE:
+                role_type = self._role(event.player_idx)
+                if not self._witch_cured_god and role_type in GOD_ROLES:
+                    witch = self._find_player("女巫")
+                    if witch is not None:
+                        self._witch_cured_god = True
+                        self._add(witch.player_index, f"成功救活神民（{role_type}）", 5)
+            elif code == PoisonEvent.CODE:
+                self._last_poisoned = event.player_idx
+                if not self._witch_poisoned_wolf and self._role(event.player_idx) == "狼人":
+                    witch = self._find_player("女巫")
+                    if witch is not None:
+                        self._witch_poisoned_wolf = True
+                        self._add(witch.player_index, "毒杀狼人", 5)
+                return
+            elif code == AttackEvent.CODE:
+                if not self._hunter_shot_wolf and self._role(event.player_idx) == "狼人":
+                    hunter = self._find_player("猎人")
+                    if hunter is not None:
+                        self._hunter_shot_wolf = True
+                        self._add(hunter.player_index, "开枪带走狼人", 5)
+            elif code == KillEvent.CODE:
+                if (not self._wolves_killed_god and event.player_idx != self._last_poisoned
+                        and self._role(event.player_idx) in GOD_ROLES):
+                    self._wolves_killed_god = True
+                    # 狼人团队加分
+                    for player in self.game.players:
+                        if player.role_type == "狼人":
+                            self._add(player.player_index, "击杀神民", 5)
+            elif code == ExecuteEvent.CODE:
+                executed_idx = event.player_idx
+                # 只有被处决的是狼人才给投票放逐他的村民加分
+                if self._role(executed_idx) == "狼人":
+                    votes = event.votes
+                    for i in range(0, len(votes), 2):
+                        if votes[i + 1] == executed_idx and self._role(votes[i]) == "村民":
+                            self._add(votes[i], "投票放逐狼人", 3)
+            self._last_poisoned = None
+
+    def _find_player(self, role_type: str):
+        for player in self.game.players:
+            if player.role_type == role_type:
+                return player
+        return None
+
+    def contribution_score(self, player_idx: int) -> int:
+        return self.contribution_scores.get(player_idx, 0)
+
+    def get_contributions(self, player_idx: int) -> List[tuple]:
+        with self._lock:
+            return list(self.contributions.get(player_idx, ()))
+
+
 class ScoreCalculator:
     """积分计算器"""
     
@@ -67,7 +180,7 @@ class ScoreCalculator:
         
     def calculate_scores(self, winner: str, mvp_player_index: int = None) -> Dict[int, PlayerScore]:
         """
-        计算所有玩家的积分
+        计算所有玩家的积分（贡献分直接取自对局的 ScoreTracker，耗时只与玩家数有关）
         
         Args:
             winner: 胜利阵营 ("狼人胜利" 或 "村民胜利")
@@ -88,6 +201,14 @@ class ScoreCalculator:
             
         return self.player_scores
         
+    def apply_mvp(self, mvp_player_index: int = None) -> Dict[int, PlayerScore]:
+        """在已计算的积分上更换MVP（MVP分与其它分项无关，无需重新分析历史）"""
+        for score in self.player_scores.values():
+            score.mvp_score = 0
+        if mvp_player_index and mvp_player_index in self.player_scores:
+            self.player_scores[mvp_player_index].set_mvp()
+        return self.player_scores
+
     def _initialize_player_scores(self, winner: str):
         """初始化玩家积分"""
         self.player_scores = {}
@@ -110,180 +231,12 @@ class ScoreCalculator:
         
     def _calculate_contribution_scores(self):
         """计算贡献分"""
-        history = self.game.history.get_history(show_all=True)
-        
-        # 分析历史事件，计算各种贡献
-        self._calculate_seer_contributions(history)
-        self._calculate_witch_contributions(history)
-        self._calculate_hunter_contributions(history)
-        self._calculate_wolf_contributions(history)
-        self._calculate_villager_contributions(history)
-        
-    def _calculate_seer_contributions(self, history: List[Dict]):
-        """计算预言家贡献分"""
-        for player in self.game.players:
-            if player.role_type == "预言家" and hasattr(player, 'divine_result'):
-                # 检查是否查验出狼人
-                wolf_found = False
-                for result in player.divine_result:
-                    if "狼人" in result:
-                        wolf_found = True
-                        break
-                        
-                if wolf_found:
-                    self.player_scores[player.player_index].add_contribution(
-                        "查验出狼人", 5
-                    )
-                    
-    def _calculate_witch_contributions(self, history: List[Dict]):
-        """计算女巫贡献分"""
-        witch_player = self._find_witch_player()
-        if not witch_player:
-            return
-
-        witch_cured = False
-        witch_poisoned_wolf = False
-        god_roles = ["预言家", "女巫", "猎人"]
-
-        for round_data in history:
-            night_events = round_data.get("夜晚事件", [])
-
-            for event in night_events:
-                # 检查救人（只加一次分）
-                if "被女巫救治" in event and not witch_cured:
-                    import re
-                    match = re.search(r'【(\d+)号玩家】被女巫救治', event)
-                    if match:
-                        cured_player_idx = int(match.group(1))
-                        cured_player = self.game.players[cured_player_idx - 1]
-                        if cured_player.role_type in god_roles:
-                            self.player_scores[witch_player.player_index].add_contribution(
-                                f"成功救活神民（{cured_player.role_type}）", 5
-                            )
-                            witch_cured = True
-
-                # 检查毒杀狼人（只加一次分）
-                if "被投毒" in event and not witch_poisoned_wolf:
-                    # 提取被毒玩家编号
-                    import re
-                    match = re.search(r'【(\d+)号玩家】被投毒', event)
-                    if match:
-                        poisoned_player_idx = int(match.group(1))
-                        poisoned_player = self.game.players[poisoned_player_idx - 1]
-                        if poisoned_player.role_type == "狼人":
-                            self.player_scores[witch_player.player_index].add_contribution(
-                                "毒杀狼人", 5
-                            )
-                            witch_poisoned_wolf = True
-                                
-    def _calculate_hunter_contributions(self, history: List[Dict]):
-        """计算猎人贡献分"""
-        hunter_player = self._find_hunter_player()
-        if not hunter_player:
-            return
-
-        hunter_killed_wolf = False
-
-        for round_data in history:
-            day_events = round_data.get("白天事件", [])
-            night_events = round_data.get("夜晚事件", [])
-
-            all_events = day_events + night_events
-            for event in all_events:
-                if "被猎人反击杀死" in event and not hunter_killed_wolf:
-                    # 提取被反击玩家编号
-                    import re
-                    match = re.search(r'【(\d+)号玩家】被猎人反击杀死', event)
-                    if match:
-                        attacked_player_idx = int(match.group(1))
-                        attacked_player = self.game.players[attacked_player_idx - 1]
-                        if attacked_player.role_type == "狼人":
-                            self.player_scores[hunter_player.player_index].add_contribution(
-                                "开枪带走狼人", 5
-                            )
-                            hunter_killed_wolf = True
-                                
-    def _calculate_wolf_contributions(self, history: List[Dict]):
-        """计算狼人贡献分"""
-        god_roles = ["预言家", "女巫", "猎人"]
-        wolf_team_bonus_given = False
-        
-        for round_data in history:
-            night_events = round_data.get("夜晚事件", [])
-            
-            for event in night_events:
-                if "被杀死" in event and not wolf_team_bonus_given:
-                    # 提取被杀玩家编号
-                    import re
-                    match = re.search(r'【(\d+)号玩家】被杀死', event)
-                    if match:
-                        killed_player_idx = int(match.group(1))
-                        killed_player = self.game.players[killed_player_idx - 1]
-                        if killed_player.role_type in god_roles:
-                            # 给所有狼人加分
-                            for player in self.game.players:
-                                if player.role_type == "狼人":
-                                    self.player_scores[player.player_index].add_contribution(
-                                        "击杀神民", 5
-                                    )
-                            wolf_team_bonus_given = True
-                            break
-                            
-    def _calculate_villager_contributions(self, history: List[Dict]):
-        """计算村民贡献分"""
-        for round_data in history:
-            day_events = round_data.get("白天事件", [])
-            
-            for event in day_events:
-                if "被处决" in event:
-                    # 解析投票结果和被处决玩家
-                    self._analyze_execution_event(event)
-                    
-    def _analyze_execution_event(self, event: str):
-        """分析处决事件，给投票放逐狼人的村民加分"""
-        import re
-        
-        # 提取被处决玩家编号
-        executed_match = re.search(r'【(\d+)号玩家】被处决', event)
-        if not executed_match:
-            return
-            
-        executed_player_idx = int(executed_match.group(1))
-        executed_player = self.game.players[executed_player_idx - 1]
-        
-        # 只有被处决的是狼人才给村民加分
-        if executed_player.role_type != "狼人":
-            return
-            
-        # 提取投票信息
-        vote_matches = re.findall(r'【(\d+)号玩家】 投票给 (\d+)号玩家', event)
-        
-        for voter_idx_str, target_idx_str in vote_matches:
-            voter_idx = int(voter_idx_str)
-            target_idx = int(target_idx_str)
-            
-            # 如果投票目标是被处决的狼人
-            if target_idx == executed_player_idx:
-                voter = self.game.players[voter_idx - 1]
-                # 只给村民加分
-                if voter.role_type == "村民":
-                    self.player_scores[voter_idx].add_contribution(
-                        "投票放逐狼人", 3
-                    )
-                    
-    def _find_witch_player(self):
-        """找到女巫玩家"""
-        for player in self.game.players:
-            if player.role_type == "女巫":
-                return player
-        return None
-        
-    def _find_hunter_player(self):
-        """找到猎人玩家"""
-        for player in self.game.players:
-            if player.role_type == "猎人":
-                return player
-        return None
+        tracker = getattr(self.game, 'score_tracker', None)
+        if tracker is None or tracker.history is not self.game.history:
+            tracker = ScoreTracker.replay(self.game)
+        for player_index, player_score in self.player_scores.items():
+            for description, score in tracker.get_contributions(player_index):
+                player_score.add_contribution(description, score)
         
     def get_ranking(self) -> List[Dict[str, Any]]:
         """获取积分排名"""
@@ -0,0 +1,93 @@
+"""
+对局结算任务
+
+对局结束时积分结算不再阻塞 /check_winner：ScoringJob 在后台线程中计算积分，
+调用评审模型自动评选 MVP（select_mvp=False 时跳过，由锦标赛主进程攒批评选，见 tournament.py），
+再在已算好的积分上加上 MVP 分。结果缓存在 job.result 中，/get_game_scores 在结算完成前返回 pending，
+也可以等待至多若干秒（长轮询）。
+"""
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import threading
+
+from score_calculator import ScoreCalculator
+from mvp_selector import MvpSelector
+
+logger = logging.getLogger(__name__)
+
+
+class ScoringJob:
+    def __init__(self, game, winner: str, select_mvp: bool = True):
+        self.game = game
+        self.winner = winner
+        self.select_mvp = select_mvp
+        self.calculator: Optional[ScoreCalculator] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.mvp_prompt: Optional[Dict[str, Any]] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def start(self) -> "ScoringJob":
+        threading.Thread(target=self.run, daemon=True, name=f"scoring-{self.game.start_time}").start()
+        return self
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """结算完成后调用 callback()；已完成时立即调用"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def run(self):
+        try:
+            calculator = ScoreCalculator(self.game)
+            calculator.calculate_scores(self.winner)
+            ranking = calculator.get_ranking()
+
+            auto_mvp = None
+            if self.select_mvp:
+                try:
+                    auto_mvp = MvpSelector().select(self.game, self.winner, precomputed_ranking=ranking)
+                except Exception as e:
+                    # 自动评选失败不影响结算
+                    logger.warning(f"自动评选MVP失败：{e}")
+                    auto_mvp = None
+            else:
+                # 只保留评审提示词，由调用方攒批评选
+                self.mvp_prompt = MvpSelector.build_prompt(self.game, self.winner, ranking)
+            if auto_mvp and isinstance(auto_mvp.get('mvp_player_index'), int):
+                calculator.apply_mvp(auto_mvp['mvp_player_index'])
+                ranking = calculator.get_ranking()
+
+            self.calculator = calculator
+            self.result = {
+                'status': 'done',
+                'winner': self.winner,
+                'ranking': ranking,
+                'player_scores': {str(k): v.get_score_detail() for k, v in calculator.player_scores.items()},
+                'auto_mvp': auto_mvp  # 形如 {mvp_player_index, reason, model, auto}
+            }
+            self.game.write_scores_log(self.winner, ranking, auto_mvp)
+        except Exception as e:
+            logger.error(f"积分计算出错：{e}")
+            with self.game.result_log() as log_file:
+                log_file.write(f"\n积分计算出错：{e}\n")
+            self.result = {'status': 'error', 'winner': self.winner, 'message': f"积分计算出错：{e}"}
+        finally:
+            with self._lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"结算完成回调出错：{e}")
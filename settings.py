@@ -0,0 +1,323 @@
+"""
+全局配置
+
+config.json 在进程内只解析一次，经 pydantic 校验后缓存为 Settings 对象：
+- get_settings() 返回当前配置；距上次检查超过 CHECK_INTERVAL 秒时比较文件的修改时间与大小，变化后自动重新加载
+- 文件被改坏时保留上一次的有效配置并记录错误
+- 运行中修改配置（手动调整座位、交换位置等）通过 settings_store.update(fn) 完成：
+  加锁后在原始配置字典上修改、校验，再原子替换文件，避免并发请求各自读改写导致的覆盖
+"""
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from pydantic import BaseModel
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = 'config.json'
+CHECK_INTERVAL = 1.0
+
+RoleName = Literal['狼人', '村民', '预言家', '女巫', '猎人']
+
+
+class ModelSettings(BaseModel):
+    model_name: Optional[str] = None
+    api_key: Optional[str] = ""
+    base_url: Optional[str] = None
+
+    class Config:
+        extra = 'allow'
+
+
+class PlayerSettings(ModelSettings):
+    role: Optional[RoleName] = None
+    backup: Optional[ModelSettings] = None   # 该座位的对冲备用模型，未设置时使用 hedging.backup
+
+
+class RouteSettings(BaseModel):
+    """模型路由：match 为模型名、前缀（以 * 结尾）或 glob 模式，其余字段为该路由的默认参数"""
+    match: str
+    provider: str = "openai_compatible"
+    model: Optional[str] = None            # 发送给服务端的模型名，默认与 match 到的模型名相同
+    strip_prefix: Optional[str] = None     # 发送前去掉的模型名前缀，如 "local/"
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    api_key_env: Optional[str] = None
+    timeout: Optional[float] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    stream: bool = True
+    reasoning: bool = False                # 是否收集 reasoning_content 作为思考过程
+    reasoning_effort: Optional[str] = None
+    extra_body: Optional[Dict[str, Any]] = None
+
+
+class HedgingSettings(BaseModel):
+    """对冲请求：主模型超过截止时间未返回时向备用模型发出同样的请求"""
+    enabled: bool = False
+    quantile: float = 0.95           # 截止时间取主模型近期成功调用耗时的分位数
+    min_samples: int = 20            # 样本少于此数时使用 default_deadline
+    default_deadline: float = 60.0
+    min_deadline: float = 5.0
+    max_deadline: float = 300.0
+    backup: Optional[ModelSettings] = None
+
+
+ACTION_TYPES = ('speak', 'lastword', 'vote', 'kill', 'divine', 'cure_or_poison', 'hunter_revenge', 'human')
+
+
+class DeadlineSettings(BaseModel):
+    """
+    各类行动的时间预算（秒，按提示词类型），超时后取消请求并采用默认决策；设为 null 表示不限时。
+    AI 行动的预算在 enabled 开启后才生效（慢速或推理模型请按实际耗时调整），人类玩家的时限始终生效
+    """
+    enabled: bool = False
+    speak: Optional[float] = 120
+    lastword: Optional[float] = 120
+    vote: Optional[float] = 60
+    kill: Optional[float] = 60
+    divine: Optional[float] = 60
+    cure_or_poison: Optional[float] = 60
+    hunter_revenge: Optional[float] = 60
+    human: Optional[float] = 300          # 人类玩家的每次行动
+    vote_fallback: Literal['abstain', 'random'] = 'abstain'   # 投票超时：弃票或随机投一名存活玩家
+
+    def budget(self, prompt_type: str) -> Optional[float]:
+        if not self.enabled and prompt_type != 'human':
+            return None
+        value = getattr(self, prompt_type, None)
+        return value if isinstance(value, (int, float)) and value > 0 else None
+
+    def request_timeout(self) -> float:
+        """前端请求超时（秒）：一次请求可能包含多次行动（如重新投票），取最长预算的两倍加余量；有不限时的行动时为 1800"""
+        budgets = [self.budget(action) for action in ACTION_TYPES]
+        if None in budgets:
+            return 1800.0
+        return max(budgets) * 2 + 30
+
+
+class TierSettings(BaseModel):
+    """模型档位：model_name 为空时沿用玩家座位本身的模型，只覆盖下面的调用参数"""
+    model_name: Optional[str] = None
+    api_key: Optional[str] = ""
+    base_url: Optional[str] = None
+    reasoning_effort: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+    def overrides(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in ("reasoning_effort", "temperature", "max_tokens")
+                if getattr(self, key) is not None}
+
+
+class TieringSettings(BaseModel):
+    """
+    按角色、行动类型选择模型档位：actions 的键为角色名或 default，值为 {行动类型: 档位名}，
+    角色的配置优先于 default；未配置的行动使用座位本身的模型
+    """
+    tiers: Dict[str, TierSettings] = {}
+    actions: Dict[str, Dict[str, str]] = {}
+
+    def tier(self, role_type: str, prompt_type: str) -> Optional[str]:
+        for key in (role_type, "default"):
+            name = self.actions.get(key, {}).get(prompt_type)
+            if name:
+                return name if name in self.tiers else None
+        return None
+
+
+class OutputSettings(BaseModel):
+    """按提示词的 output_format / required_fields 控制模型输出长度"""
+    early_stop: bool = True           # 流式输出的顶层 JSON 对象结束且包含全部 required_fields 后立即中止请求
+    cap_max_tokens: bool = False      # 按 output_format 的字段估算 max_tokens；推理模型的 max_tokens 包含推理过程，默认关闭
+    text_field_tokens: int = 1500     # 每个文本字段（thinking、speak 等）的 token 预算
+    value_field_tokens: int = 16      # 每个数值字段（vote、kill 等）的 token 预算
+    overhead_tokens: int = 64         # JSON 结构与代码块标记
+
+    def max_tokens(self, fields: List[Tuple[str, bool]]) -> Optional[int]:
+        """fields 为 json_stream.output_fields 的结果；未开启或无法解析字段时返回 None（不限制）"""
+        if not self.cap_max_tokens or not fields:
+            return None
+        return self.overhead_tokens + sum(self.text_field_tokens if is_text else self.value_field_tokens
+                                          for _, is_text in fields)
+
+
+class StateStoreSettings(BaseModel):
+    """多进程部署时各 worker 共享对局状态的外部存储（见 state_store.py）"""
+    enabled: bool = False                  # workers 为 1 时也使用外部存储（如由 uvicorn 命令行另行指定 worker 数）
+    backend: Literal['sqlite', 'redis'] = 'sqlite'
+    path: str = 'logs/state.sqlite'        # sqlite：WAL 模式的数据库文件
+    url: Optional[str] = None              # redis：如 redis://127.0.0.1:6379/0，任何兼容 Redis 协议的服务
+    lock_ttl: Optional[float] = None       # 对局锁的租期（秒），默认为前端请求超时加 60 秒
+    cached_games: int = 32                 # 每个 worker 在内存中保留的对局数
+
+    def lock_ttl_for(self, deadlines: DeadlineSettings) -> float:
+        return self.lock_ttl or deadlines.request_timeout() + 60
+
+
+class Settings(BaseModel):
+    openai_api_key: Optional[str] = None
+    openai_base_url: Optional[str] = None
+    comment_tts_voices: Union[str, List[str], None] = None
+    comment_tts_models: Optional[str] = None
+
+    players: List[PlayerSettings] = []
+    models: List[ModelSettings] = []
+    judge: Optional[ModelSettings] = None
+    model_routes: List[RouteSettings] = []
+    hedging: HedgingSettings = HedgingSettings()
+    deadlines: DeadlineSettings = DeadlineSettings()
+    output: OutputSettings = OutputSettings()
+    tiering: TieringSettings = TieringSettings()
+
+    random_model: bool = False
+    randomize_roles: bool = False
+    randomize_position: bool = False
+    random_seed: Optional[int] = None
+
+    display_role: bool = True
+    display_thinking: bool = True
+    display_witch_action: bool = True
+    display_wolf_action: bool = True
+    display_hunter_action: bool = True
+    display_divine_action: bool = True
+    display_vote_action: bool = True
+    display_model: bool = True
+    auto_play: bool = True
+
+    checkpoint: bool = True   # 对局进行中写检查点日志 logs/journal_*.jsonl，崩溃后可恢复（见 journal.py）
+    workers: int = 1          # web.py 的 worker 进程数，大于 1 时对局状态保存在 state_store 中
+    state_store: StateStoreSettings = StateStoreSettings()
+    log_level: str = "INFO"
+
+    class Config:
+        extra = 'allow'
+
+
+DISPLAY_KEYS = ("display_role", "display_thinking", "display_witch_action", "display_wolf_action",
+                "display_hunter_action", "display_divine_action", "display_vote_action", "display_model",
+                "auto_play")
+
+
+class SettingsError(ValueError):
+    """配置文件不存在可用的有效版本"""
+
+
+def parse_settings(data: Dict[str, Any]) -> Settings:
+    """校验配置字典（兼容 pydantic v1 / v2）"""
+    if hasattr(Settings, 'model_validate'):
+        return Settings.model_validate(data)
+    return Settings.parse_obj(data)
+
+
+class SettingsStore:
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._settings: Optional[Settings] = None
+        self._raw: Dict[str, Any] = {}
+        self._stamp = None
+        self._checked_at = 0.0
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, stamp):
+        if stamp is None:
+            if self._settings is None:
+                logger.warning(f"配置文件 {self.path} 不存在，使用默认配置")
+                self._raw, self._settings = {}, Settings()
+            self._stamp = None
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            settings = parse_settings(raw)
+        except Exception as e:
+            if self._settings is None:
+                raise SettingsError(f"配置文件 {self.path} 无效: {e}")
+            logger.error(f"配置文件 {self.path} 无效，继续使用上一次的配置: {e}")
+            self._stamp = stamp
+            return
+        self._raw, self._settings, self._stamp = raw, settings, stamp
+        logger.info(f"已加载配置文件 {self.path}")
+
+    def get(self) -> Settings:
+        now = time.monotonic()
+        if self._settings is not None and now - self._checked_at < CHECK_INTERVAL:
+            return self._settings
+        with self._lock:
+            self._checked_at = now
+            stamp = self._file_stamp()
+            if self._settings is None or stamp != self._stamp:
+                self._load(stamp)
+            return self._settings
+
+    def raw(self) -> Dict[str, Any]:
+        """当前配置的原始字典（副本）"""
+        self.get()
+        with self._lock:
+            return copy.deepcopy(self._raw)
+
+    def update(self, mutate: Callable[[Dict[str, Any]], None]) -> Settings:
+        """
+        原子地修改配置文件：mutate 在原始配置字典上就地修改，校验通过后写回。
+        其它进程同时修改时通过文件锁串行化。
+        """
+        with self._lock, _FileLock(self.path + '.lock'):
+            # 以磁盘上的最新内容为基础，避免覆盖其它进程的修改
+            self._checked_at = 0.0
+            self._load(self._file_stamp())
+            raw = copy.deepcopy(self._raw)
+            mutate(raw)
+            settings = parse_settings(raw)
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(raw, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+            self._raw, self._settings, self._stamp = raw, settings, self._file_stamp()
+            self._checked_at = time.monotonic()
+            return settings
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'w')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+# 全局配置
+settings_store = SettingsStore()
+
+
+def get_settings() -> Settings:
+    return settings_store.get()
@@ -0,0 +1,296 @@
+"""
+外部状态存储
+
+web.py 默认把对局保存在进程内，只能运行一个 worker。多进程部署时（config.json 的 workers 大于 1，
+或 state_store.enabled）各 worker 通过 StateStore 共享状态，请求可以落在任意 worker 上：
+- 列表：每局的检查点记录（见 journal.StoreJournal）与回放记录，只追加
+- 哈希：对局登记、人类玩家的输入请求与提交、积分结算结果
+- 锁：按对局加锁，带租期，持有锁的进程退出后到期自动释放
+- 消息：各 worker 发布的推送消息（见 event_bus.StoreBridge），按序号读取，只保留最近一段时间
+
+默认使用 SQLite（WAL 模式，同一台机器上的多个进程并发读写）；接口只用到列表、哈希、SET NX 与流，
+任何兼容 Redis 协议的服务都可以通过 RedisStateStore 接入（需安装 redis）。值均为可 JSON 序列化的对象。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LOCK_POLL_INTERVAL = 0.05
+MESSAGE_RETENTION = 600   # 推送消息保留的秒数
+
+
+class LockTimeout(TimeoutError):
+    """等待对局锁超时"""
+
+
+class StateStore:
+    """状态存储接口"""
+
+    def append(self, key: str, items: List[Any]) -> int:
+        """追加到列表末尾，返回追加后的长度"""
+        raise NotImplementedError
+
+    def read(self, key: str, start: int = 0) -> List[Any]:
+        """列表中从 start 开始的全部元素"""
+        raise NotImplementedError
+
+    def length(self, key: str) -> int:
+        raise NotImplementedError
+
+    def truncate(self, key: str, length: int):
+        """只保留列表的前 length 个元素"""
+        raise NotImplementedError
+
+    def hset(self, name: str, field: str, value: Any):
+        raise NotImplementedError
+
+    def hsetnx(self, name: str, field: str, value: Any) -> bool:
+        """字段不存在时写入，返回是否写入"""
+        raise NotImplementedError
+
+    def hget(self, name: str, field: str) -> Any:
+        raise NotImplementedError
+
+    def hgetall(self, name: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def hdel(self, name: str, field: str) -> bool:
+        """删除字段，返回字段原先是否存在"""
+        raise NotImplementedError
+
+    def acquire(self, name: str, token: str, ttl: float) -> bool:
+        """锁空闲或已过期时以 token 持有 ttl 秒，返回是否成功"""
+        raise NotImplementedError
+
+    def release(self, name: str, token: str):
+        """释放 token 持有的锁（已过期并被他人持有时不做任何事）"""
+        raise NotImplementedError
+
+    def post(self, origin: str, messages: List[Any]):
+        """发布消息，origin 为发布者（worker）标识"""
+        raise NotImplementedError
+
+    def messages(self, after) -> Tuple[Any, List[Tuple[str, Any]]]:
+        """序号 after 之后的消息，返回 (最后一条的序号, [(origin, 消息)])"""
+        raise NotImplementedError
+
+    def latest(self):
+        """当前最后一条消息的序号，从这里开始读取即只收到之后发布的消息"""
+        raise NotImplementedError
+
+    def wait_acquire(self, name: str, ttl: float, timeout: Optional[float] = None) -> str:
+        """等待并持有锁，返回释放时使用的 token；timeout 秒内拿不到锁时抛出 LockTimeout"""
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.acquire(name, token, ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(f"等待锁 {name} 超时")
+            time.sleep(LOCK_POLL_INTERVAL)
+        return token
+
+    @contextmanager
+    def lock(self, name: str, ttl: float, timeout: Optional[float] = None):
+        """持有锁执行一段代码"""
+        token = self.wait_acquire(name, ttl, timeout)
+        try:
+            yield token
+        finally:
+            self.release(name, token)
+
+
+class SqliteStateStore(StateStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._trimmed_at = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lists (key TEXT, idx INTEGER, value TEXT, PRIMARY KEY (key, idx));
+            CREATE TABLE IF NOT EXISTS hashes (name TEXT, field TEXT, value TEXT, PRIMARY KEY (name, field));
+            CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT, expires REAL);
+            CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, body TEXT, created REAL);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL 模式下 NORMAL 只在检查点时同步磁盘，进程崩溃不丢数据
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def append(self, key, items):
+        with self._write() as conn:
+            length = conn.execute("SELECT COALESCE(MAX(idx) + 1, 0) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+            conn.executemany("INSERT INTO lists (key, idx, value) VALUES (?, ?, ?)",
+                             [(key, length + i, json.dumps(item, ensure_ascii=False)) for i, item in enumerate(items)])
+        return length + len(items)
+
+    def read(self, key, start=0):
+        rows = self._conn().execute("SELECT value FROM lists WHERE key = ? AND idx >= ? ORDER BY idx",
+                                    (key, start)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def length(self, key):
+        return self._conn().execute("SELECT COALESCE(MAX(idx) + 1, 0) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+
+    def truncate(self, key, length):
+        self._conn().execute("DELETE FROM lists WHERE key = ? AND idx >= ?", (key, length))
+
+    def hset(self, name, field, value):
+        self._conn().execute("INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                             (name, field, json.dumps(value, ensure_ascii=False)))
+
+    def hsetnx(self, name, field, value):
+        return self._conn().execute("INSERT OR IGNORE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                                    (name, field, json.dumps(value, ensure_ascii=False))).rowcount == 1
+
+    def hget(self, name, field):
+        row = self._conn().execute("SELECT value FROM hashes WHERE name = ? AND field = ?", (name, field)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def hgetall(self, name):
+        rows = self._conn().execute("SELECT field, value FROM hashes WHERE name = ?", (name,)).fetchall()
+        return {field: json.loads(value) for field, value in rows}
+
+    def hdel(self, name, field):
+        return self._conn().execute("DELETE FROM hashes WHERE name = ? AND field = ?", (name, field)).rowcount == 1
+
+    def acquire(self, name, token, ttl):
+        now = time.time()
+        return self._conn().execute(
+            "INSERT INTO locks (name, token, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET token = excluded.token, expires = excluded.expires WHERE locks.expires < ?",
+            (name, token, now + ttl, now)).rowcount == 1
+
+    def release(self, name, token):
+        self._conn().execute("DELETE FROM locks WHERE name = ? AND token = ?", (name, token))
+
+    def post(self, origin, messages):
+        now = time.time()
+        with self._write() as conn:
+            conn.executemany("INSERT INTO messages (origin, body, created) VALUES (?, ?, ?)",
+                             [(origin, json.dumps(message, ensure_ascii=False), now) for message in messages])
+            if now - self._trimmed_at > 10:
+                self._trimmed_at = now
+                conn.execute("DELETE FROM messages WHERE created < ?", (now - MESSAGE_RETENTION,))
+
+    def messages(self, after):
+        rows = self._conn().execute("SELECT id, origin, body FROM messages WHERE id > ? ORDER BY id LIMIT 1000",
+                                    (after,)).fetchall()
+        if not rows:
+            return after, []
+        return rows[-1][0], [(origin, json.loads(body)) for _, origin, body in rows]
+
+    def latest(self):
+        return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+
+class RedisStateStore(StateStore):
+    """兼容 Redis 协议的存储（Redis、Valkey、KeyDB 等），键名统一加 prefix 前缀"""
+
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url: str, prefix: str = "wolf:"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("使用 Redis 状态存储需要安装 redis")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+
+    def _key(self, kind, name):
+        return f"{self.prefix}{kind}:{name}"
+
+    def append(self, key, items):
+        return self.client.rpush(self._key("list", key), *[json.dumps(item, ensure_ascii=False) for item in items])
+
+    def read(self, key, start=0):
+        return [json.loads(value) for value in self.client.lrange(self._key("list", key), start, -1)]
+
+    def length(self, key):
+        return self.client.llen(self._key("list", key))
+
+    def truncate(self, key, length):
+        if length <= 0:
+            self.client.delete(self._key("list", key))
+        else:
+            self.client.ltrim(self._key("list", key), 0, length - 1)
+
+    def hset(self, name, field, value):
+        self.client.hset(self._key("hash", name), field, json.dumps(value, ensure_ascii=False))
+
+    def hsetnx(self, name, field, value):
+        return bool(self.client.hsetnx(self._key("hash", name), field, json.dumps(value, ensure_ascii=False)))
+
+    def hget(self, name, field):
+        value = self.client.hget(self._key("hash", name), field)
+        return None if value is None else json.loads(value)
+
+    def hgetall(self, name):
+        return {field: json.loads(value) for field, value in self.client.hgetall(self._key("hash", name)).items()}
+
+    def hdel(self, name, field):
+        return self.client.hdel(self._key("hash", name), field) == 1
+
+    def acquire(self, name, token, ttl):
+        return bool(self.client.set(self._key("lock", name), token, nx=True, px=int(ttl * 1000)))
+
+    def release(self, name, token):
+        self._release(keys=[self._key("lock", name)], args=[token])
+
+    def post(self, origin, messages):
+        pipe = self.client.pipeline(transaction=False)
+        for message in messages:
+            pipe.xadd(self._key("stream", "messages"), {"origin": origin, "body": json.dumps(message, ensure_ascii=False)},
+                      maxlen=10000, approximate=True)
+        pipe.execute()
+
+    def messages(self, after):
+        result = self.client.xread({self._key("stream", "messages"): after}, count=1000)
+        if not result:
+            return after, []
+        entries = result[0][1]
+        return entries[-1][0], [(fields["origin"], json.loads(fields["body"])) for _, fields in entries]
+
+    def latest(self):
+        entries = self.client.xrevrange(self._key("stream", "messages"), count=1)
+        return entries[0][0] if entries else "0-0"
+
+
+def open_store(settings) -> Optional[StateStore]:
+    """按配置打开状态存储；单 worker 且未开启 state_store 时返回 None（对局只保存在进程内）"""
+    options = settings.state_store
+    if not (options.enabled or settings.workers > 1):
+        return None
+    if options.backend == "redis":
+        if not options.url:
+            raise ValueError("state_store.backend 为 redis 时需要配置 state_store.url")
+        logger.info(f"使用 Redis 状态存储 {options.url}")
+        return RedisStateStore(options.url)
+    logger.info(f"使用 SQLite 状态存储 {options.path}")
+    return SqliteStateStore(options.path)
@@ -0,0 +1,108 @@
+"""检查点日志的崩溃恢复：未完成行动中已做出的决策恢复后直接采用，不重发LLM请求"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import game as game_module
+import llm
+import role
+from journal import journal_path
+from llm import BaseLlm
+from runner import HeadlessRunner
+
+CONFIG = {"players": [{"model_name": "fake", "role": r}
+                      for r in ["狼人"] * 3 + ["预言家", "女巫", "猎人", "村民", "村民", "村民"]],
+          "auto_mvp": False}
+
+
+class Crash(BaseException):
+    """模拟进程崩溃（不被重试逻辑捕获）"""
+
+
+class FakeLlm(BaseLlm):
+    """按当前局面给出确定的决策：狼人刀最后一名存活好人，好人投第一名存活狼人，女巫不用药"""
+    game = None
+    calls = []
+    crash_on = None
+
+    def __init__(self, model_name, *args, **kwargs):
+        super().__init__(model_name, force_json=True)
+
+    def generate(self, message, chat_history=[]):
+        prompt = json.loads(message)
+        kind = "witch" if "今晚发生了什么" in prompt else "lastword" if "reason" in prompt else "other"
+        FakeLlm.calls.append(kind)
+        if FakeLlm.crash_on == kind:
+            FakeLlm.crash_on = None
+            raise Crash()
+        alive = [p for p in self.game.players if p.is_alive]
+        good = [p.player_index for p in alive if p.role_type != "狼人"]
+        wolves = [p.player_index for p in alive if p.role_type == "狼人"]
+        return json.dumps({"thinking": "", "speak": "", "reason": "", "vote": wolves[0] if wolves else -1,
+                           "kill": good[-1] if good else -1, "divine": 1, "cure": 0, "poison": -1,
+                           "attack": -1}), None
+
+
+def dump(game):
+    return [(r.day_count, [e.desc() for e in r.day_events], [e.desc() for e in r.night_events])
+            for r in game.history.rounds]
+
+
+class CrashRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.symlink(os.path.join(ROOT, "prompts"), os.path.join(self.tmp, "prompts"))
+        os.chdir(self.tmp)
+        self.patched = (game_module.BuildModel, role.BuildModel, llm.BuildModel)
+        game_module.BuildModel = role.BuildModel = llm.BuildModel = FakeLlm
+        FakeLlm.calls = []
+        FakeLlm.crash_on = None
+
+    def tearDown(self):
+        game_module.BuildModel, role.BuildModel, llm.BuildModel = self.patched
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def play(self, game_id):
+        game = FakeLlm.game = game_module.WerewolfGame(CONFIG, game_id=game_id)
+        game.auto_mvp = False
+        return game, HeadlessRunner(game).play()
+
+    def test_crash_mid_witch_reuses_decision(self):
+        full, winner = self.play("full")
+        expected_calls = len(FakeLlm.calls)
+
+        # 女巫已经决策、首夜死者的遗言还在生成时崩溃
+        FakeLlm.calls = []
+        FakeLlm.crash_on = "lastword"
+        crashed = FakeLlm.game = game_module.WerewolfGame(CONFIG, game_id="crash")
+        crashed.auto_mvp = False
+        with self.assertRaises(Crash):
+            HeadlessRunner(crashed).play()
+        crashed.close_logs()
+        self.assertEqual(FakeLlm.calls.count("witch"), 1)
+        before_restore = len(FakeLlm.calls)
+
+        resumed = FakeLlm.game = game_module.WerewolfGame(CONFIG, game_id="crash")
+        resumed.auto_mvp = False
+        resumed.restore(journal_path("crash"))
+        self.assertEqual(len(FakeLlm.calls), before_restore)
+        self.assertEqual(HeadlessRunner(resumed).play(resume=True), winner)
+        resumed.close_logs()
+        full.close_logs()
+
+        # 只有崩溃时未返回的那次遗言请求被重新发出，女巫的决策没有再请求
+        self.assertEqual(len(FakeLlm.calls), expected_calls + 1)
+        self.assertEqual(FakeLlm.calls[:before_restore + 1].count("witch"), 1)
+        self.assertEqual(dump(resumed), dump(full))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""贡献分：对局中由 ScoreTracker 随事件累加的积分与结算时按整局历史重新计算的结果一致"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import game as game_module
+import llm
+import role
+from runner import HeadlessRunner
+from score_calculator import ScoreCalculator, ScoreTracker
+from test_journal import CONFIG, FakeLlm
+
+
+class ScriptedLlm(FakeLlm):
+    """在 FakeLlm 的决策上按 (行动, 天数) 覆盖部分字段，如首夜狼人刀谁、女巫是否用药"""
+    script = {}
+
+    def generate(self, message, chat_history=[]):
+        resp, reason = super().generate(message, chat_history)
+        prompt = json.loads(message)
+        kind = "witch" if "今晚发生了什么" in prompt else "kill" if "第几轮投票" in prompt else "other"
+        override = ScriptedLlm.script.get((kind, self.game.current_day))
+        if override:
+            resp = json.dumps({**json.loads(resp), **override})
+        return resp, reason
+
+
+class IncrementalScoreTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.symlink(os.path.join(ROOT, "prompts"), os.path.join(self.tmp, "prompts"))
+        os.chdir(self.tmp)
+        self.patched = (game_module.BuildModel, role.BuildModel, llm.BuildModel)
+        game_module.BuildModel = role.BuildModel = llm.BuildModel = ScriptedLlm
+        FakeLlm.calls = []
+        FakeLlm.crash_on = None
+        ScriptedLlm.script = {}
+
+    def tearDown(self):
+        game_module.BuildModel, role.BuildModel, llm.BuildModel = self.patched
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def play(self, game_id, script):
+        ScriptedLlm.script = script
+        game = FakeLlm.game = game_module.WerewolfGame(CONFIG, game_id=game_id)
+        game.auto_mvp = False
+        winner = HeadlessRunner(game).play()
+        self.assertTrue(game.scoring.wait(10))
+        game.close_logs()
+        return game, winner
+
+    def assertMatchesRecompute(self, game, winner):
+        """实时累加的贡献分与结算结果都等于按整局历史重新计算的结果"""
+        live = game.score_tracker
+        replayed = ScoreTracker.replay(game)
+        self.assertEqual(live.contributions, replayed.contributions)
+        self.assertEqual(live.contribution_scores, replayed.contribution_scores)
+
+        game.score_tracker = None
+        try:
+            fresh = ScoreCalculator(game)
+            fresh.calculate_scores(winner)
+        finally:
+            game.score_tracker = live
+        self.assertEqual(game.scoring.result['ranking'], fresh.get_ranking())
+
+    def contributions(self, game):
+        return {idx: [desc for desc, _ in items] for idx, items in game.score_tracker.contributions.items()}
+
+    def test_plain_game(self):
+        game, winner = self.play("plain", {})
+        self.assertNotEqual(winner, '胜负未分')
+        self.assertMatchesRecompute(game, winner)
+
+    def test_witch_cures_god(self):
+        # 首夜狼人刀猎人（6号），女巫用解药救活：女巫得"成功救活神民"，狼人不得击杀神民分
+        game, winner = self.play("cure", {("kill", 1): {"kill": 6}, ("witch", 1): {"cure": 1}})
+        self.assertMatchesRecompute(game, winner)
+        contributions = self.contributions(game)
+        self.assertIn("成功救活神民（猎人）", contributions.get(5, []))
+        self.assertFalse(any("击杀神民" in items for items in contributions.values()))
+
+    def test_poisoned_god_is_not_a_wolf_kill(self):
+        # 首夜女巫毒杀预言家（4号）：毒杀记录的死亡不算狼人击杀神民
+        game, winner = self.play("poison", {("witch", 1): {"poison": 4}})
+        self.assertFalse(game.players[3].is_alive)
+        self.assertMatchesRecompute(game, winner)
+        contributions = self.contributions(game)
+        self.assertFalse(any("击杀神民" in items for items in contributions.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
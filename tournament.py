@@ -0,0 +1,236 @@
+"""
+锦标赛调度
+
+用 config.json 中 models 列表里的模型批量对局，生成均衡的赛程：
+每局的 9 个座位按 (座位 + a) 轮换角色、按 (座位 + b) 轮换模型，a 取遍 9 个角色位、b 取遍所有模型，
+一个完整周期共 9 × 模型数 局。周期内每个模型在每个座位、每个角色位上出现的次数都相同，
+每个座位也在每个角色位上出现相同次数，从而排除座位与角色分配对模型比较的影响。
+
+对局分发到进程池并行运行（每个进程同时只跑一局，由 runner.HeadlessRunner 驱动），
+每局结束后写出归档（logs/game_{对局ID}.wga.*），进度保存在 logs/tournament_{名称}.json，
+中断后用相同名称再次运行会跳过已完成的对局，只重跑未完成或出错的对局；
+未完成的对局有检查点日志（logs/journal_{对局ID}.jsonl，见 journal.py）时从中断处继续，已完成的LLM调用不会重发。
+各局的 MVP 不在工作进程中评选：工作进程只返回评审提示词，主进程每攒够 --mvp-batch 局
+并发调用一次评审模型，结果写入检查点。
+
+用法：
+    python tournament.py <名称> [--cycles N] [--workers N] [--max-days N] [--mvp-batch N]
+"""
+from typing import Dict, Any, List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import os
+import sys
+import time
+
+from log import setup_logging, shutdown_logging
+from mvp_selector import MvpSelector
+from settings import settings_store, get_settings
+
+logger = logging.getLogger(__name__)
+
+ROLE_SLOTS = ['狼人', '狼人', '狼人', '预言家', '女巫', '猎人', '村民', '村民', '村民']
+DEFAULT_MAX_DAYS = 20
+DEFAULT_MVP_BATCH = 8
+
+
+def balanced_schedule(models: List[str], cycles: int = 1, prefix: str = "") -> List[Dict[str, Any]]:
+    """生成均衡赛程，每项为 {game_id, seats: [{role, model}, ...]}"""
+    n_seats = len(ROLE_SLOTS)
+    n_models = len(models)
+    schedule = []
+    for cycle in range(cycles):
+        for b in range(n_models):
+            for a in range(n_seats):
+                seats = [{"role": ROLE_SLOTS[(s + a) % n_seats], "model": models[(s + b) % n_models]}
+                         for s in range(n_seats)]
+                schedule.append({"game_id": f"{prefix}{len(schedule) + 1:04d}", "seats": seats})
+    return schedule
+
+
+def build_game_config(base_config: Dict[str, Any], seats: List[Dict[str, str]]) -> Dict[str, Any]:
+    """按赛程给出的座位生成单局配置（关闭所有随机分配）"""
+    models = {m["model_name"]: m for m in base_config.get("models", [])}
+    config = dict(base_config)
+    config["players"] = []
+    for seat in seats:
+        model = models[seat["model"]]
+        player = {"role": seat["role"], "model_name": model["model_name"], "api_key": model.get("api_key", "")}
+        if model.get("base_url"):
+            player["base_url"] = model["base_url"]
+        config["players"].append(player)
+    config["random_model"] = False
+    config["randomize_roles"] = False
+    config["randomize_position"] = False
+    return config
+
+
+def _init_worker():
+    setup_logging()
+
+
+def play_scheduled_game(task: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中跑完一局并写出归档"""
+    from game import WerewolfGame
+    from journal import journal_path
+    from runner import HeadlessRunner
+
+    game_id = task["game_id"]
+    started = time.time()
+    try:
+        game = WerewolfGame(config=build_game_config(settings_store.raw(), task["seats"]), game_id=game_id)
+        # MVP 由主进程攒批评选，这里只结算积分并返回评审提示词
+        game.auto_mvp = False
+        resume = False
+        if os.path.exists(journal_path(game_id)):
+            try:
+                game.restore(journal_path(game_id))
+                resume = True
+            except Exception as e:
+                logger.warning(f"对局 {game_id} 的检查点无法恢复，重新开局：{e}")
+        if not resume:
+            # 重跑中断的对局时清掉上次残留的日志，避免追加写入
+            for name in (f"logs/result_{game_id}.txt", f"logs/llm_{game_id}.txt"):
+                if os.path.exists(name):
+                    os.remove(name)
+        winner = HeadlessRunner(game, max_days=task.get("max_days", DEFAULT_MAX_DAYS)).play(resume=resume)
+        mvp_prompt = None
+        if game.scoring is not None:
+            game.scoring.wait()
+            mvp_prompt = game.scoring.mvp_prompt
+        archive_path = game.save_archive()
+        game.close_logs()
+        result = {"winner": winner, "archive": archive_path}
+        if mvp_prompt:
+            result["mvp_prompt"] = mvp_prompt
+    except Exception as e:
+        logger.exception(f"对局 {game_id} 出错")
+        result = {"error": str(e)}
+    finally:
+        # 写完本局排队中的日志，工作进程退出时不会丢失
+        shutdown_logging()
+    result["game_id"] = game_id
+    result["duration"] = round(time.time() - started, 1)
+    return result
+
+
+class Tournament:
+    """一次锦标赛：赛程、进度检查点与并行调度"""
+
+    def __init__(self, name: str, models: Optional[List[str]] = None, cycles: int = 1,
+                 max_days: int = DEFAULT_MAX_DAYS, mvp_batch: int = DEFAULT_MVP_BATCH):
+        self.name = name
+        self.mvp_batch = mvp_batch
+        self.checkpoint_path = os.path.join('logs', f"tournament_{name}.json")
+        self.results: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.models = state["models"]
+            self.max_days = state["max_days"]
+            self.schedule = state["schedule"]
+            self.results = state["results"]
+            logger.info(f"从检查点恢复锦标赛 {name}：已完成 {len(self.finished())}/{len(self.schedule)} 局")
+        else:
+            if not models:
+                raise ValueError("锦标赛至少需要一个模型")
+            self.models = models
+            self.max_days = max_days
+            self.schedule = balanced_schedule(models, cycles, prefix=f"{name}_")
+            self.save()
+
+    def finished(self) -> List[str]:
+        return [game_id for game_id, r in self.results.items() if "error" not in r]
+
+    def unjudged(self) -> List[str]:
+        """已结束但尚未评选 MVP 的对局"""
+        return [game_id for game_id, r in self.results.items() if "mvp_prompt" in r]
+
+    def judge_mvp(self):
+        """批量评选已结束对局的 MVP（并发调用评审模型），结果写入检查点"""
+        game_ids = self.unjudged()
+        if not game_ids:
+            return
+        logger.info(f"锦标赛 {self.name}：评选 {len(game_ids)} 局的 MVP")
+        try:
+            prompts = [self.results[game_id]["mvp_prompt"] for game_id in game_ids]
+            mvps = MvpSelector().select_batch(prompts, game_ids, workers=self.mvp_batch)
+        except Exception as e:
+            # 保留提示词，下次运行时重试
+            logger.error(f"评选 MVP 出错：{e}")
+            return
+        for game_id, mvp in zip(game_ids, mvps):
+            self.results[game_id].pop("mvp_prompt")
+            self.results[game_id]["mvp"] = mvp
+        self.save()
+
+    def pending(self) -> List[Dict[str, Any]]:
+        done = set(self.finished())
+        return [entry for entry in self.schedule if entry["game_id"] not in done]
+
+    def save(self):
+        os.makedirs('logs', exist_ok=True)
+        state = {
+            "name": self.name,
+            "models": self.models,
+            "max_days": self.max_days,
+            "schedule": self.schedule,
+            "results": self.results,
+        }
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def run(self, workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """并行跑完所有未完成的对局，每完成一局更新一次检查点"""
+        todo = self.pending()
+        logger.info(f"锦标赛 {self.name}：待运行 {len(todo)} 局，共 {len(self.schedule)} 局")
+        if not todo:
+            self.judge_mvp()
+            return self.results
+        tasks = [dict(entry, max_days=self.max_days) for entry in todo]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(play_scheduled_game, task) for task in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                game_id = result.pop("game_id")
+                self.results[game_id] = result
+                self.save()
+                if "error" in result:
+                    logger.error(f"对局 {game_id} 失败：{result['error']}")
+                else:
+                    logger.info(f"对局 {game_id} 结束：{result['winner']}（{result['duration']}秒），"
+                                f"进度 {len(self.finished())}/{len(self.schedule)}")
+                if len(self.unjudged()) >= self.mvp_batch:
+                    self.judge_mvp()
+        self.judge_mvp()
+        return self.results
+
+    def archives(self) -> List[str]:
+        return [r["archive"] for r in self.results.values() if r.get("archive")]
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0].startswith("--"):
+        print("用法: python tournament.py <名称> [--cycles N] [--workers N] [--max-days N] [--mvp-batch N]")
+        sys.exit(1)
+    name = args[0]
+    options = {"--cycles": 1, "--workers": None, "--max-days": DEFAULT_MAX_DAYS, "--mvp-batch": DEFAULT_MVP_BATCH}
+    for i in range(1, len(args) - 1, 2):
+        if args[i] in options:
+            options[args[i]] = int(args[i + 1])
+
+    setup_logging()
+    model_names = [m.model_name for m in get_settings().models]
+    tournament = Tournament(name, model_names, cycles=options["--cycles"], max_days=options["--max-days"],
+                            mvp_batch=options["--mvp-batch"])
+    tournament.run(workers=options["--workers"])
+
+    # 汇总本次锦标赛的排行榜（只统计本次锦标赛的归档）
+    from analytics import AnalyticsStore, format_leaderboard
+    store = AnalyticsStore(os.path.join('logs', f"tournament_{name}_analytics.json"))
+    store.ingest(tournament.archives())
+    print(format_leaderboard(store.leaderboard("model")))
@@ -8,10 +8,12 @@ import hashlib
 import json
 import random
 from pathlib import Path
-from openai import OpenAI
+import threading
 from typing import Optional, Dict, Any, List, Union
 import logging
 
+from settings import Settings, SettingsStore, SettingsError, settings_store
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,31 +36,28 @@ class TTSService:
         # 初始化OpenAI客户端
         self._init_openai_client()
         
-    def _load_config(self, config_path: str) -> Dict[str, Any]:
-        """加载配置文件"""
+    def _load_config(self, config_path: str) -> Settings:
+        """加载配置（默认配置文件直接使用全局缓存的配置）"""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            return config
-        except FileNotFoundError:
-            logger.warning(f"配置文件 {config_path} 不存在，使用默认配置")
-            return {}
-        except json.JSONDecodeError as e:
+            store = settings_store if config_path == settings_store.path else SettingsStore(config_path)
+            return store.get()
+        except SettingsError as e:
             logger.error(f"配置文件格式错误: {e}")
-            return {}
+            return Settings()
     
     def _init_openai_client(self):
         """初始化OpenAI客户端"""
         try:
             # 从配置文件或环境变量获取API密钥
-            api_key = self.config.get('openai_api_key') or os.getenv('OPENAI_API_KEY')
+            api_key = self.config.openai_api_key or os.getenv('OPENAI_API_KEY')
             if not api_key:
                 logger.error("未找到OpenAI API密钥，请在config.json中设置openai_api_key或设置OPENAI_API_KEY环境变量")
                 return
                 
             # 获取API基础URL（如果有自定义的话）
-            base_url = self.config.get('openai_base_url') or os.getenv('OPENAI_BASE_URL')
+            base_url = self.config.openai_base_url or os.getenv('OPENAI_BASE_URL')
             
+            from openai import OpenAI
             if base_url:
                 self.client = OpenAI(api_key=api_key, base_url=base_url)
             else:
@@ -86,7 +85,7 @@ class TTSService:
         Returns:
             随机选择的音色名称
         """
-        voices_config = self.config.get('comment_tts_voices', 'coral')
+        voices_config = self.config.comment_tts_voices or 'coral'
 
         # 如果配置是列表，随机选择一个
         if isinstance(voices_config, list) and voices_config:
@@ -134,7 +133,7 @@ class TTSService:
 
         # 从配置获取模型（如果配置中有的话）
         if model == "tts-1":  # 只有在使用默认模型时才从配置读取
-            model = self.config.get('comment_tts_models', 'tts-1')
+            model = self.config.comment_tts_models or 'tts-1'
         
         # 清理文本，移除特殊字符
         cleaned_text = self._clean_text(text)
@@ -226,5 +225,15 @@ class TTSService:
         
         return deleted_count
 
-# 全局TTS服务实例
-tts_service = TTSService()
+# 全局TTS服务实例，首次使用时才创建（创建缓存目录、导入并初始化OpenAI客户端）
+_tts_service = None
+_tts_lock = threading.Lock()
+
+
+def get_tts_service() -> TTSService:
+    global _tts_service
+    if _tts_service is None:
+        with _tts_lock:
+            if _tts_service is None:
+                _tts_service = TTSService()
+    return _tts_service
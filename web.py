@@ -1,13 +1,30 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
 from game import WerewolfGame
-from tts_service import tts_service
+from tts_service import get_tts_service
+from metrics import llm_metrics
+from log import setup_logging
+from event_bus import event_bus, StoreBridge
+from human_input import human_broker
+from journal import drop_unfinished, journal_key, load_journal
+from settings import get_settings
+from state_store import LockTimeout, open_store
+import asyncio
 import json
+import logging
+import os
 import sys
 import copy
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 
 class PlayerAction(BaseModel):
@@ -54,6 +71,13 @@ class RevengeAction(BaseModel):
     player_idx: int
     death_reason: str
 
+class DeathInfo(BaseModel):
+    player_idx: int
+    death_reason: str
+
+class ResolveDeathsAction(BaseModel):
+    deaths: List[DeathInfo]
+
 class ManualPositionAction(BaseModel):
     position_mapping: dict  # {position: player_data} 格式，例如 {1: {"role": "狼人", "model_name": "gpt-4"}}
 
@@ -61,25 +85,43 @@ class SwapPositionAction(BaseModel):
     position1: int
     position2: int
 
+class HumanInputAction(BaseModel):
+    request_id: str
+    text: str
+
 
 class Recorder():
-    def __init__(self, game):
+    def __init__(self, game, store=None):
+        self.game = game
+        # 多进程部署时各 worker 的回放记录追加到状态存储中同一局的列表
+        self.store = store
         self.log = []
         self.is_loaded = False
         self.index  = 0
 
     def record(self, response):
-        self.log.append(
-            {
-                "response": copy.deepcopy(response)
-            }
-        )
+        entry = {"response": copy.deepcopy(response)}
+        if self.store is not None:
+            key = f"replay:{self.game.start_time}"
+            length = self.store.append(key, [entry])
+            if length == len(self.log) + 1:
+                self.log.append(entry)
+            elif length > len(self.log) + 1:
+                # 其它 worker 也追加了记录：只读取本地还没有的部分
+                self.log.extend(self.store.read(key, len(self.log)))
+            else:
+                self.log = self.store.read(key)
+        else:
+            self.log.append(entry)
 
-        with open(f"logs/replay_{game.start_time}.json", 'w') as f:
+        path = f"logs/replay_{self.game.start_time}.json"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(self.log, f)
+        os.replace(tmp_path, path)
 
     def load(self, filename):
-        print("加载日志文件")
+        logger.info(f"加载回放文件 {filename}")
         with open(filename, 'r') as f:
             self.log = json.load(f)
             self.is_loaded = True
@@ -90,19 +132,258 @@ class Recorder():
         return result["response"]
 
 
-game = WerewolfGame()
-recorder = Recorder(game)
+class GameSession:
+    """一局对局与它的回放记录；多进程部署时还有本进程对该局的锁（见 GameLease）"""
+
+    def __init__(self, game, recorder):
+        self.game = game
+        self.recorder = recorder
+        self.lease = None
+        if recorder.store is not None:
+            self.lease = game.lease = GameLease(recorder.store, game)
+
+
+class GameLease:
+    """
+    多进程部署时本进程对一局的锁，使同一局的状态读写在各 worker 间串行执行。
+    只在读写对局状态时持有：写请求开始时持有并追上其它 worker 的进度，请求LLM期间释放（见 WerewolfGame.llm_call），
+    进行中的LLM调用全部返回后重新持有并再次追上进度；释放期间写入的检查点临时持有（见 WerewolfGame.checkpoint）。
+    本进程内同一局的请求共用一把锁，与单进程时一样可以并行（如查验与刀人）
+    """
+
+    def __init__(self, store, game):
+        self.store = store
+        self.game = game
+        self.name = f"game:{game.start_time}"
+        self._mutex = threading.RLock()
+        self._token = None
+        self._requests = 0
+        self._llm_calls = 0
+
+    def _acquire(self):
+        """持有锁，返回是否是新持有的；拿不到锁时抛出 LockTimeout"""
+        if self._token is not None:
+            return False
+        settings = get_settings()
+        ttl = settings.state_store.lock_ttl_for(settings.deadlines)
+        self._token = self.store.wait_acquire(self.name, ttl, timeout=ttl)
+        return True
+
+    def _release(self):
+        if self._token is not None:
+            self.store.release(self.name, self._token)
+            self._token = None
+
+    @contextmanager
+    def request(self):
+        """一次写请求"""
+        with self._mutex:
+            self._requests += 1
+            try:
+                with self.held():
+                    self.game.sync()
+            except BaseException:
+                self._requests -= 1
+                raise
+        try:
+            yield
+        finally:
+            with self._mutex:
+                self._requests -= 1
+                if self._requests == 0:
+                    self._release()
+
+    @contextmanager
+    def held(self):
+        """读写状态期间持有锁（已持有时不变）"""
+        with self._mutex:
+            acquired = self._acquire()
+            try:
+                yield
+            finally:
+                if acquired and (self._requests == 0 or self._llm_calls > 0):
+                    self._release()
+
+    @contextmanager
+    def released(self):
+        """请求LLM期间释放锁（本进程同一局的其它LLM调用都在进行中时才真正释放）"""
+        with self._mutex:
+            self._llm_calls += 1
+            if self._llm_calls == 1:
+                self._release()
+        try:
+            yield
+        finally:
+            with self._mutex:
+                self._llm_calls -= 1
+                if self._llm_calls == 0 and self._requests > 0:
+                    self._acquire()
+                    self.game.sync()
+
+
+class SessionManager:
+    """
+    对局会话。默认（单 worker）只有一局，保存在本进程内。
+    配置了状态存储（见 state_store.py）时可以运行多个 worker，每次请求都可能落在不同的 worker 上：
+    - 按请求头 X-Game-Id（WebSocket 与 SSE 用查询参数 game_id）找到对局，都没有时为最近开始的对局
+    - 本进程没有该局或落后于存储时，重放其它 worker 追加的检查点记录追上进度（只重放新增部分，不调用LLM）
+    - 会修改对局状态的请求只在读写状态时持有该局的锁（见 GameLease），请求LLM期间释放；只读请求不加锁
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        game = WerewolfGame()
+        self.default = GameSession(game, Recorder(game))
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def replaying(self):
+        return self.default.recorder.is_loaded
+
+    @property
+    def shared(self):
+        """对局状态是否保存在状态存储中"""
+        return self.store is not None and not self.replaying
+
+    def game_id(self, conn):
+        """请求所属的对局ID；还没有开始过对局时为 None"""
+        return conn.headers.get("x-game-id") or conn.query_params.get("game_id") or self.store.hget("meta", "current")
+
+    def get(self, game_id):
+        with self._lock:
+            session = self._sessions.get(game_id)
+            if session is not None:
+                self._sessions.move_to_end(game_id)
+                return session
+        game = WerewolfGame()
+        try:
+            game.load_store(self.store, game_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"对局 {game_id} 不存在")
+        logger.info(f"已从状态存储加载对局 {game_id}")
+        return self.add(GameSession(game, Recorder(game, self.store)))
+
+    def add(self, session):
+        with self._lock:
+            session = self._sessions.setdefault(session.game.start_time, session)
+            self._sessions.move_to_end(session.game.start_time)
+            while len(self._sessions) > get_settings().state_store.cached_games:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.game.close_logs()
+        return session
+
+    def read(self, conn):
+        """只读请求的会话"""
+        game_id = self.game_id(conn) if self.shared else None
+        if game_id is None:
+            # 开局前（如调整座位）使用本进程内的默认对局
+            return self.default
+        session = self.get(game_id)
+        session.game.sync()
+        return session
+
+    @contextmanager
+    def write(self, conn):
+        """会修改对局状态的请求的会话，请求期间按 GameLease 持有对局锁"""
+        game_id = self.game_id(conn) if self.shared else None
+        if game_id is None:
+            yield self.default
+            return
+        session = self.get(game_id)
+        with session.lease.request():
+            yield session
+
+    def new_game(self):
+        """开始新的一局，返回 (会话, 显示配置)"""
+        if not self.shared:
+            return self.default, self.default.game.start()
+        game = WerewolfGame()
+        game.store = self.store
+        display_config = game.start()
+        session = self.add(GameSession(game, Recorder(game, self.store)))
+        self.store.hset("meta", "current", game.start_time)
+        return session, display_config
+
+    def take_resumed(self):
+        """以 --resume 启动时，第一次开局请求接手恢复的对局"""
+        if not self.shared:
+            if self.default.game.resumed:
+                self.default.game.resumed = False
+                return self.default
+            return None
+        game_id = self.store.hget("meta", "resume")
+        if game_id is None or not self.store.hdel("meta", "resume"):
+            return None
+        self.store.hset("meta", "current", game_id)
+        return self.get(game_id)
+
+    def resume(self, target):
+        """
+        恢复崩溃前的对局：target 为检查点日志文件（见 journal.py）或状态存储中的对局ID。
+        最后一个未完成的行动被回退，前端开局后从该行动重新开始
+        """
+        if not self.shared:
+            self.default.game.restore(target)
+            return
+        if os.path.exists(target):
+            records = load_journal(target)
+            game_id = records[0]["game"]
+            if self.store.length(journal_key(game_id)) == 0:
+                self.store.append(journal_key(game_id), records)
+                self.store.hsetnx("games", game_id, {"started": time.time()})
+        else:
+            game_id = target
+        records = self.store.read(journal_key(game_id))
+        if not records:
+            raise ValueError(f"状态存储中没有对局 {game_id}")
+        # 未完成行动中的决策转为 forced 记录（见 journal.drop_unfinished），整体重写该局的检查点
+        kept = drop_unfinished(records)
+        self.store.truncate(journal_key(game_id), 0)
+        self.store.append(journal_key(game_id), kept)
+        self.store.hset("meta", "resume", game_id)
+        logger.info(f"对局 {game_id} 将在下一次开局请求时继续")
+
+
+def read_session(request: Request) -> GameSession:
+    return sessions.read(request)
+
+
+def write_session(request: Request):
+    with sessions.write(request) as session:
+        yield session
+
+
+# 异步日志：控制台与对局日志文件由后台线程写入，级别由 config.json 的 log_level 控制
+setup_logging()
+
+sessions = SessionManager(open_store(get_settings()))
 
 app = FastAPI()
 # 设置静态文件目录
 app.mount("/static", StaticFiles(directory="public"), name="public")
 
+@app.exception_handler(LockTimeout)
+def game_busy(request: Request, exc: LockTimeout):
+    """多进程部署时等不到对局锁（见 GameLease）"""
+    return JSONResponse(status_code=503, content={"detail": f"对局正忙: {exc}"})
+
+
+@app.on_event("startup")
+def share_state():
+    """多进程部署时各 worker 经状态存储转发推送消息、共享人类玩家的输入请求"""
+    if sessions.shared:
+        StoreBridge(event_bus, sessions.store).start()
+        human_broker.use_store(sessions.store)
+
+
 @app.get("/")
 def default():
     return RedirectResponse(url="/static/index.html")
 
 @app.get("/start")
 def start_game():
+    recorder = sessions.default.recorder
     if recorder.is_loaded:
         display_config = recorder.fetch()
         display_config["auto_play"] = False
@@ -116,12 +397,22 @@ def start_game():
         display_config["display_model"] = True
         return display_config
 
-    display_config = game.start()
-    recorder.record(display_config)
+    session = sessions.take_resumed()
+    if session is not None:
+        # 以 --resume 启动时，第一次开局请求接手恢复的对局，前端从服务端的行动进度继续
+        game = session.game
+        display_config = {**game.display_config(), "resumed": True, **game.get_time()}
+    else:
+        session, display_config = sessions.new_game()
+    # 告知前端可以通过 /ws 获取状态；之后的请求带上对局ID（多进程部署时据此找到对局）
+    display_config["push_channel"] = True
+    display_config["game_id"] = session.game.start_time
+    session.recorder.record(display_config)
     return display_config
 
 @app.get("/status")
-def get_status():
+def get_status(session: GameSession = Depends(read_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     players = game.get_players()
@@ -129,7 +420,8 @@ def get_status():
     return players
 
 @app.post("/divine")
-def divine(action: PlayerAction):
+def divine(action: PlayerAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.divine(action.player_idx)
@@ -138,7 +430,8 @@ def divine(action: PlayerAction):
 
 
 @app.post("/reset_wolf_want_kill")
-def reset_wolf_want_kill():
+def reset_wolf_want_kill(session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.reset_wolf_want_kill()
@@ -146,7 +439,8 @@ def reset_wolf_want_kill():
     return {"message": "狼人想杀的目标已重置"}
 
 @app.get("/get_wolf_want_kill")
-def get_wolf_want_kill():
+def get_wolf_want_kill(session: GameSession = Depends(read_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.get_wolf_want_kill()
@@ -155,8 +449,20 @@ def get_wolf_want_kill():
     return wolf_want_kill
 
 
+@app.post("/wolf_kill")
+def wolf_kill(session: GameSession = Depends(write_session)):
+    """狼人当晚的完整刀人投票（第一轮并发、必要时第二轮），返回各轮决策与最终目标"""
+    game, recorder = session.game, session.recorder
+    if recorder.is_loaded:
+        return recorder.fetch()
+    result = game.wolf_kill()
+    recorder.record(result)
+    return result
+
+
 @app.post("/decide_kill")
-def decide_kill(action: DecideKillAction):
+def decide_kill(action: DecideKillAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.decide_kill(action.player_idx, action.kill_id, action.is_second_vote)
@@ -164,28 +470,50 @@ def decide_kill(action: DecideKillAction):
     return result
 
 @app.post("/kill")
-def kill(action: PlayerAction):
+def kill(action: PlayerAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.kill(action.player_idx)
     recorder.record({"message": f"玩家 {action.player_idx} 被杀死"})
     return {"message": f"玩家 {action.player_idx} 被杀死"}
 
+@app.post("/next_step")
+def next_step(session: GameSession = Depends(write_session)):
+    """开始下一个行动（行动顺序由服务端决定，见 game.PhaseMachine）"""
+    game, recorder = session.game, session.recorder
+    if recorder.is_loaded:
+        return recorder.fetch()
+    result = game.next_step()
+    recorder.record(result)
+    return result
+
+
+@app.get("/plan")
+def get_plan(n: int = 3, session: GameSession = Depends(read_session)):
+    """接下来 n 个尚未完成的行动及其是否可以预取"""
+    game, recorder = session.game, session.recorder
+    if recorder.is_loaded:
+        return recorder.fetch()
+    result = game.get_plan(n)
+    recorder.record(result)
+    return result
+
+
 @app.get("/current_time")
-def get_current_time():
+def get_current_time(session: GameSession = Depends(read_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
-    current_time = {
-        "current_day": game.get_day(),
-        "current_phase": game.current_phase
-    }
+    current_time = game.get_time()
     recorder.record(current_time)
     return current_time
 
 
 @app.post("/last_words")
-def last_words(action: LastWordsAction):
+def last_words(action: LastWordsAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.last_words(action.player_idx, action.speak, action.death_reason)
@@ -194,7 +522,8 @@ def last_words(action: LastWordsAction):
 
 
 @app.post("/attack")
-def attack(action: AttackAction):
+def attack(action: AttackAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     attack_result = game.attack(action.target_idx)
@@ -207,7 +536,8 @@ def attack(action: AttackAction):
     return result
 
 @app.post("/toggle_day_night")
-def toggle_day_night():
+def toggle_day_night(session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.toggle_day_night()
@@ -217,7 +547,8 @@ def toggle_day_night():
 
 
 @app.post("/decide_cure_or_poison")
-def decide_cure_or_poison(action: DecideCureOrPoisonAction):
+def decide_cure_or_poison(action: DecideCureOrPoisonAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.decide_cure_or_poison(action.player_idx)
@@ -226,7 +557,8 @@ def decide_cure_or_poison(action: DecideCureOrPoisonAction):
 
 
 @app.post("/poison")
-def poison(action: PoisonAction):
+def poison(action: PoisonAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.poison(action.player_idx)
@@ -234,13 +566,15 @@ def poison(action: PoisonAction):
     return {"message": f"玩家 {action.player_idx} 被毒死"}
 
 @app.post("/cure")
-def cure(action: PlayerAction):
+def cure(action: PlayerAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.cure(action.player_idx)
     recorder.record({"message": "治疗成功"})
 @app.post("/decide_vote")
-def decide_vote(action: DecideVoteAction):
+def decide_vote(action: DecideVoteAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.decide_vote(action.player_idx)
@@ -248,7 +582,8 @@ def decide_vote(action: DecideVoteAction):
     return result
 
 @app.post("/speak")
-def speak(action: SpeakAction):
+def speak(action: SpeakAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -260,8 +595,9 @@ def speak(action: SpeakAction):
         if game.current_phase == "白天" and result and isinstance(result, dict):
             speak_text = result.get("speak", "") if hasattr(result, "get") else ""
             if isinstance(speak_text, str) and speak_text.strip():
-                if tts_service.is_available():
-                    audio_path = tts_service.generate_speech(
+                tts = get_tts_service()
+                if tts.is_available():
+                    audio_path = tts.generate_speech(
                         text=speak_text,
                         voice=None,      # 不指定音色，交由服务端随机选择
                         model="tts-1",
@@ -271,14 +607,133 @@ def speak(action: SpeakAction):
                         result["audio_path"] = audio_path
     except Exception as e:
         # 生成TTS失败不影响原始发言返回
-        print(f"[WARN] 预生成TTS失败: {e}")
+        logger.warning(f"预生成TTS失败: {e}")
 
     recorder.record(result)
     return result
 
+@app.websocket("/ws")
+async def game_channel(websocket: WebSocket, show_all: bool = False, game_id: Optional[str] = None):
+    """
+    WebSocket 推送通道，支持多个观战者同时连接：
+    - 连接后先收到 snapshot（完整状态），之后推送 event（历史事件）、players（玩家状态变化）、phase、winner
+    - show_all=true 时额外推送非公开事件（投票、查验、女巫用药）
+    - game_id 指定对局时只推送该局的消息，不指定时为最近开始的对局，并推送所有对局的消息
+    - 客户端发送 {"type": "sync", "id": n, "what": "status"|"current_time"} 可代替 /status、/current_time 轮询，
+      回复排在此前所有推送之后，因此拿到的一定是最新状态；同样写入回放（回放模式下从回放读取）
+    """
+    try:
+        session = await run_in_threadpool(sessions.read, websocket)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = event_bus.subscribe("game/all" if show_all else "game/public")
+
+    async def pump():
+        try:
+            async for message in subscription:
+                if game_id and message.get("game") not in (None, game_id):
+                    continue
+                await websocket.send_json(message)
+        except Exception:
+            # 连接已断开，由接收循环负责清理
+            pass
+
+    def sync(what):
+        current = sessions.read(websocket)
+        if current.recorder.is_loaded:
+            return current.recorder.fetch()
+        data = current.game.get_time() if what == "current_time" else current.game.get_players()
+        current.recorder.record(data)
+        return data
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        if not session.recorder.is_loaded:
+            subscription.queue.put_nowait(session.game.get_snapshot(show_all))
+        while True:
+            request = await websocket.receive_json()
+            if request.get("type") != "sync":
+                continue
+            data = await run_in_threadpool(sync, request.get("what"))
+            # 与推送共用队列，保证回复在已发布的推送之后送达
+            subscription.queue.put_nowait({"type": "sync", "id": request.get("id"), "data": data})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pump_task.cancel()
+        subscription.close()
+
+
+@app.get("/speak_stream")
+async def speak_stream(player_idx: int, request: Request, game_id: Optional[str] = None):
+    """
+    SSE：实时推送某位玩家正在生成的发言(speak字段)，每条消息为 {player_idx, game, text, done}，text 为目前已生成的全文；
+    game_id 指定对局时忽略其它对局的发言
+    """
+    if sessions.replaying:
+        # 回放模式下没有实时生成，直接结束
+        async def finished():
+            yield f"data: {json.dumps({'player_idx': player_idx, 'text': '', 'done': True})}\n\n"
+        return StreamingResponse(finished(), media_type="text/event-stream")
+
+    subscription = event_bus.subscribe(f"speak/{player_idx}")
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await subscription.get(timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if game_id and message.get("game") not in (None, game_id):
+                    continue
+                yield f"data: {json.dumps(message, ensure_ascii=False)}\n\n"
+                if message.get("done"):
+                    break
+        finally:
+            subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/human/poll")
+async def human_poll(player_idx: Optional[int] = None, timeout: float = 25, game_id: Optional[str] = None):
+    """
+    长轮询：返回某位（不指定则任意）人类玩家待处理的输入请求，timeout 秒内没有请求时返回 {"request": None}；
+    game_id 指定对局时只返回该局的请求
+    """
+    if sessions.replaying:
+        return {"request": None}
+    subscription = event_bus.subscribe(f"human/{player_idx}" if player_idx else "human/all")
+    try:
+        # 先订阅再查询，避免漏掉两者之间登记的请求
+        pending = await run_in_threadpool(human_broker.pending, player_idx, game_id)
+        if pending:
+            return {"request": pending[0]}
+        while True:
+            message = await subscription.get(timeout=timeout)
+            if message.get("type") != "request" or (game_id and message["request"].get("game") != game_id):
+                continue
+            if await run_in_threadpool(human_broker.is_pending, message["request"]["id"]):
+                return {"request": message["request"]}
+    except asyncio.TimeoutError:
+        return {"request": None}
+    finally:
+        subscription.close()
+
+
+@app.post("/human/submit")
+def human_submit(action: HumanInputAction):
+    """提交人类玩家的输入，输入不合法时返回 {"ok": false, "error": ...}，可修改后重新提交"""
+    return human_broker.submit(action.request_id, action.text)
+
 
 @app.post("/vote")
-def vote(action: VoteAction):
+def vote(action: VoteAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.vote(action.player_idx, action.vote_id)
@@ -286,7 +741,8 @@ def vote(action: VoteAction):
     return result
 
 @app.post("/reset_vote_result")
-def reset_vote_result():
+def reset_vote_result(session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     game.reset_vote_result()
@@ -294,7 +750,8 @@ def reset_vote_result():
     return {"message": "投票结果已重置"}
 
 @app.get("/get_vote_result")
-def get_vote_result():
+def get_vote_result(session: GameSession = Depends(read_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.get_vote_result()
@@ -302,15 +759,28 @@ def get_vote_result():
     return {"vote_result": result}
 
 @app.post("/revenge")
-def revenge(action: RevengeAction):
+def revenge(action: RevengeAction, session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     result = game.revenge(action.player_idx, action.death_reason)
     recorder.record(result)
     return result
 
+@app.post("/resolve_deaths")
+def resolve_deaths(action: ResolveDeathsAction, session: GameSession = Depends(write_session)):
+    """一次结算本阶段的全部死亡：遗言与猎人开枪并发生成，按规则顺序写入历史"""
+    game, recorder = session.game, session.recorder
+    if recorder.is_loaded:
+        return recorder.fetch()
+    deaths = [{"player_idx": death.player_idx, "death_reason": death.death_reason} for death in action.deaths]
+    result = game.resolve_deaths(deaths)
+    recorder.record(result)
+    return result
+
 @app.post("/execute")
-def execute():
+def execute(session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
     players = game.get_players()
@@ -353,16 +823,25 @@ def execute():
         }
 
 @app.get("/check_winner")
-def check_winner():
+def check_winner(session: GameSession = Depends(write_session)):
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
+    scoring = game.scoring
     result = game.check_winner()
-    recorder.record({"winner": result})
+    if result != '胜负未分' and game.scoring is not scoring:
+        # 本次请求判出胜负、开始结算（之后的轮询不再重复）：把本局LLM调用指标一并写入回放，
+        # 积分在后台结算，完成后再写出归档；多进程部署时由开始结算的 worker 写出归档
+        recorder.record({"winner": result, "llm_metrics": llm_metrics.game_summary(game.start_time)})
+        game.scoring.add_done_callback(lambda: game.save_archive(recorder.log))
+    else:
+        recorder.record({"winner": result})
     return {"winner": result}
 
 @app.post("/manual_position")
-def set_manual_position(action: ManualPositionAction):
+def set_manual_position(action: ManualPositionAction, session: GameSession = Depends(write_session)):
     """手动设置玩家位置和角色分配"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -376,8 +855,9 @@ def set_manual_position(action: ManualPositionAction):
         return error_result
 
 @app.post("/swap_position")
-def swap_position(action: SwapPositionAction):
+def swap_position(action: SwapPositionAction, session: GameSession = Depends(write_session)):
     """交换两个位置的玩家"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -391,8 +871,9 @@ def swap_position(action: SwapPositionAction):
         return error_result
 
 @app.get("/get_position_info")
-def get_position_info():
+def get_position_info(session: GameSession = Depends(read_session)):
     """获取当前位置和角色信息"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -401,8 +882,9 @@ def get_position_info():
     return result
 
 @app.get("/get_history")
-def get_history():
+def get_history(session: GameSession = Depends(read_session)):
     """获取游戏历史记录"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -419,12 +901,13 @@ def get_history():
 
 
 @app.get("/get_game_scores")
-def get_game_scores():
-    """获取游戏积分数据"""
+def get_game_scores(wait: float = 0, session: GameSession = Depends(read_session)):
+    """获取游戏积分数据；结算未完成时最多等待 wait 秒（长轮询），仍未完成则返回 {"status": "pending"}"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
-    scores = game.get_game_scores()
+    scores = game.get_game_scores(min(wait, 30))
     if scores:
         recorder.record(scores)
         return scores
@@ -434,8 +917,9 @@ def get_game_scores():
         return result
 
 @app.post("/set_mvp")
-def set_mvp(action: dict):
+def set_mvp(action: dict, session: GameSession = Depends(write_session)):
     """设置MVP玩家"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
@@ -450,6 +934,7 @@ def set_mvp(action: dict):
         if success:
             result = {"success": True, "message": f"{mvp_player_index}号玩家被设为MVP"}
             recorder.record(result)
+            game.save_archive(recorder.log)
             return result
         else:
             result = {"success": False, "message": "设置MVP失败，游戏可能尚未结束"}
@@ -460,21 +945,27 @@ def set_mvp(action: dict):
         recorder.record(result)
         return result
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus格式的LLM调用指标（不写入回放）"""
+    return PlainTextResponse(llm_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.post("/generate_tts")
-def generate_tts(action: TTSAction):
+def generate_tts(action: TTSAction, session: GameSession = Depends(read_session)):
     """生成TTS语音文件"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
     try:
         # 检查TTS服务是否可用
-        if not tts_service.is_available():
+        if not get_tts_service().is_available():
             result = {"success": False, "message": "TTS服务不可用，请检查OpenAI API配置"}
             recorder.record(result)
             return result
 
         # 生成语音文件
-        audio_path = tts_service.generate_speech(
+        audio_path = get_tts_service().generate_speech(
             text=action.text,
             voice=action.voice,
             model=action.model,
@@ -500,13 +991,14 @@ def generate_tts(action: TTSAction):
         return result
 
 @app.get("/tts_status")
-def get_tts_status():
+def get_tts_status(session: GameSession = Depends(read_session)):
     """获取TTS服务状态"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
     try:
-        is_available = tts_service.is_available()
+        is_available = get_tts_service().is_available()
         result = {
             "available": is_available,
             "message": "TTS服务可用" if is_available else "TTS服务不可用"
@@ -519,13 +1011,14 @@ def get_tts_status():
         return result
 
 @app.post("/clear_tts_cache")
-def clear_tts_cache():
+def clear_tts_cache(session: GameSession = Depends(read_session)):
     """清理TTS缓存"""
+    game, recorder = session.game, session.recorder
     if recorder.is_loaded:
         return recorder.fetch()
 
     try:
-        deleted_count = tts_service.clear_cache()
+        deleted_count = get_tts_service().clear_cache()
         result = {
             "success": True,
             "deleted_count": deleted_count,
@@ -540,8 +1033,18 @@ def clear_tts_cache():
 
 if __name__ == "__main__":
     import uvicorn
-    if len(sys.argv) > 1:
+    workers = get_settings().workers
+    if len(sys.argv) > 2 and sys.argv[1] == "--resume":
+        # 从检查点日志（多进程部署时也可以是状态存储中的对局ID）恢复崩溃前的对局（见 journal.py）
+        sessions.resume(sys.argv[2])
+    elif len(sys.argv) > 1:
         log_path = sys.argv[1]
-        recorder.load(log_path)
+        sessions.default.recorder.load(log_path)
+        # 回放只在本进程内进行
+        workers = 1
 
-    uvicorn.run(app, host="127.0.0.1", port=8000, timeout_keep_alive=1800)
\ No newline at end of file
+    if workers > 1:
+        # 各 worker 进程重新导入本模块，经状态存储共享对局（见 SessionManager）
+        uvicorn.run("web:app", host="127.0.0.1", port=8000, timeout_keep_alive=1800, workers=workers)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000, timeout_keep_alive=1800)
\ No newline at end of file